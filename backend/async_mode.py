@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Async serving mode.
+
+With SERVER_MODE=async the API runs under gunicorn's gevent worker (see
+gunicorn.conf.py). gevent patches sockets, so the requests, httpx (OpenAI)
+and gRPC (Gemini) clients yield while they wait on a provider, and one
+worker process can hold thousands of slow upstream calls at once instead
+of pinning one thread per call.
+
+Waiting is then cheap but CPU work is not: anything CPU-bound on a
+greenlet stalls every other request in the process. run_cpu_bound() sends
+such work (image decoding and resizing) to a per-worker process pool in
+async mode and calls it inline otherwise. Work that cannot leave the
+process, such as local ONNX inference on the worker's loaded session
+(which releases the GIL while it runs), goes through run_in_native_thread()
+to gevent's pool of real OS threads instead.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'sync').lower()
+ASYNC_MODE = SERVER_MODE == 'async'
+CPU_POOL_WORKERS = int(os.environ.get('CPU_POOL_WORKERS', str(os.cpu_count() or 2)))
+
+_cpu_pool = None
+_cpu_pool_pid = None
+_cpu_pool_lock = threading.Lock()
+
+
+def gevent_patched() -> bool:
+    """Whether this process runs under gevent's monkey patching"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def init_async_mode():
+    """Prepare clients that need explicit gevent support; call once at startup"""
+    if not ASYNC_MODE:
+        return
+    if not gevent_patched():
+        print("⚠️ SERVER_MODE=async but gevent is not active - run under gunicorn -c gunicorn.conf.py")
+        return
+
+    try:
+        # Gemini's gRPC transport only cooperates with gevent after this call
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+    except ImportError:
+        pass
+    print(f"✅ Async serving mode active (gevent, {CPU_POOL_WORKERS} CPU pool workers)")
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """Per-worker process pool for CPU-bound work, created on first use"""
+    global _cpu_pool, _cpu_pool_pid
+
+    if _cpu_pool is not None and _cpu_pool_pid == os.getpid():
+        return _cpu_pool
+
+    with _cpu_pool_lock:
+        if _cpu_pool is None or _cpu_pool_pid != os.getpid():
+            # Spawn rather than fork, so children do not inherit the gevent hub
+            _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+            _cpu_pool_pid = os.getpid()
+    return _cpu_pool
+
+
+def run_in_native_thread(func, *args):
+    """Run blocking, GIL-releasing work on a real OS thread under gevent, inline otherwise"""
+    if not gevent_patched():
+        return func(*args)
+    # threading.Thread is a greenlet once gevent has patched it, so threads alone do not help
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args)
+
+
+def run_cpu_bound(func, *args):
+    """Run CPU-heavy work off the event loop in async mode, inline otherwise"""
+    if not ASYNC_MODE:
+        return func(*args)
+
+    future = get_cpu_pool().submit(func, *args)
+    if gevent_patched():
+        # Block a native thread rather than the hub while the child works
+        import gevent
+        return gevent.get_hub().threadpool.apply(future.result)
+    return future.result()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+Micro-batching scheduler for diagnosis inference.
+
+Concurrent request handlers submit one image each; a background thread
+collects them into batches of up to INFERENCE_MAX_BATCH_SIZE images, waiting
+at most INFERENCE_MAX_WAIT_MS for a batch to fill, and runs each batch as a
+single backend call. Every caller gets its own result back through a Future.
+
+Under gevent (SERVER_MODE=async) the batching thread is a greenlet, so the
+backend calls themselves run on a native thread (see
+async_mode.run_in_native_thread) rather than on the event loop.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List
+
+from async_mode import run_in_native_thread
+
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', '16'))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', '10'))
+INFERENCE_TIMEOUT_SECONDS = float(os.environ.get('INFERENCE_TIMEOUT_SECONDS', '30'))
+
+
+class _PendingRequest:
+    __slots__ = ('payload', 'future', 'enqueued_at')
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class BatchScheduler:
+    """Collects concurrent inference requests into batches for one backend"""
+
+    def __init__(self, backend, max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Statistics
+        self._batch_size_histogram = {}
+        self._batches = 0
+        self._requests = 0
+        self._failed_batches = 0
+        self._failed_requests = 0
+        self._total_queue_wait = 0.0
+
+    def _ensure_worker(self):
+        """Start the batching thread, restarting it in forked gunicorn workers"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Anything queued before a fork belongs to the parent process
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, payload: Any) -> Future:
+        """Queue one image for inference and return a Future for its predictions"""
+        self._ensure_worker()
+        pending = _PendingRequest(payload)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, payload: Any, timeout: float = INFERENCE_TIMEOUT_SECONDS) -> List[Dict[str, Any]]:
+        """Submit one image and block until its predictions are available"""
+        return self.submit(payload).result(timeout=timeout)
+
+    def _collect_batch(self) -> List[_PendingRequest]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Callers that timed out or were cancelled no longer need a result
+            batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started_at = time.monotonic()
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_size_histogram[len(batch)] = self._batch_size_histogram.get(len(batch), 0) + 1
+                self._total_queue_wait += sum(started_at - pending.enqueued_at for pending in batch)
+
+            try:
+                results = run_in_native_thread(self.backend.predict_batch, [pending.payload for pending in batch])
+                for pending, result in zip(batch, results):
+                    pending.future.set_result(result)
+            except Exception as e:
+                with self._lock:
+                    self._failed_batches += 1
+                print(f"Inference batch of {len(batch)} failed, retrying items one by one: {e}")
+                self._run_individually(batch)
+
+    def _run_individually(self, batch: List[_PendingRequest]):
+        """Predict each request on its own, so one bad input fails only its own caller"""
+        for pending in batch:
+            if pending.future.done():
+                continue
+            try:
+                pending.future.set_result(run_in_native_thread(self.backend.predict, pending.payload))
+            except Exception as e:
+                with self._lock:
+                    self._failed_requests += 1
+                pending.future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and batch-size histogram for health checks"""
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "failed_batches": self._failed_batches,
+                "failed_requests": self._failed_requests,
+                "average_batch_size": round(self._requests / self._batches, 2) if self._batches else 0,
+                "average_queue_wait_ms": round(self._total_queue_wait / self._requests * 1000.0, 3) if self._requests else 0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_size_histogram.items())}
+            }
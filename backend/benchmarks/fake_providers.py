@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-ins for the Hugging Face, Gemini and OpenAI APIs.
+
+One threaded HTTP server answers all three, with the request shapes the
+real clients send:
+- POST /models/<model>                          Hugging Face image classification
+- POST /v1beta/models/<model>:generateContent   Gemini (REST transport)
+- POST /v1beta/models/<model>:streamGenerateContent
+- POST /v1/chat/completions                     OpenAI, with or without stream=true
+
+Every provider has its own latency (mean and uniform jitter, in ms) and
+error rate; an injected error is a 503, which the app treats like a real
+provider outage. Point the backend at it with:
+
+    HF_API_URL=http://127.0.0.1:<port>/models/plant-disease
+    GEMINI_API_ENDPOINT=http://127.0.0.1:<port>
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+
+Run standalone for manual testing:
+
+    cd backend && python -m benchmarks.fake_providers --port 9100 --hf-latency-ms 300
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+from inference import MODEL_LABELS
+
+PROVIDERS = ('huggingface', 'gemini', 'openai')
+
+FAKE_REPLY = (
+    "Remove the affected leaves, spray a copper based fungicide in the evening "
+    "and avoid overhead watering for the next two weeks."
+)
+
+FAKE_TREATMENT_JSON = json.dumps({
+    "fertilizers": [{"name": "Copper Fungicide Spray", "price": "₹450", "availability": "In Stock"}],
+    "steps": [{"step": 1, "title": "Remove Affected Parts", "description": "Remove and destroy affected leaves."}],
+    "duration": "14-21 days",
+    "success_rate": 85
+})
+
+
+class ProviderProfile:
+    """Latency and error injection for one provider"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency_ms = max(0.0, latency_ms)
+        self.jitter_ms = max(0.0, jitter_ms)
+        self.error_rate = min(1.0, max(0.0, error_rate))
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms, "error_rate": self.error_rate}
+
+
+class _FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/models/'):
+            provider = 'huggingface'
+        elif path.startswith('/v1beta/models/'):
+            provider = 'gemini'
+        elif path == '/v1/chat/completions':
+            provider = 'openai'
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+            return
+
+        profile = self.server.profiles[provider]
+        self.server.count(provider)
+        profile.delay()
+        if profile.should_fail():
+            self.server.count(provider, failed=True)
+            self._send_json(503, {"error": f"Injected {provider} failure"})
+            return
+
+        if provider == 'huggingface':
+            self._send_json(200, self._classification())
+        elif provider == 'gemini':
+            self._gemini(path, body)
+        else:
+            self._openai(body)
+
+    def _send_json(self, status: int, payload: Any):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _classification():
+        labels = random.sample(MODEL_LABELS, 5)
+        scores = sorted((random.random() for _ in labels), reverse=True)
+        total = sum(scores)
+        return [{"label": label, "score": score / total} for label, score in zip(labels, scores)]
+
+    def _gemini(self, path: str, body: bytes):
+        prompt = json.dumps(json.loads(body or b'{}'))
+        # Treatment prompts ask for JSON; chat prompts get prose
+        text = FAKE_TREATMENT_JSON if 'JSON' in prompt else FAKE_REPLY
+
+        def candidate(part: str) -> Dict[str, Any]:
+            return {"candidates": [{"content": {"parts": [{"text": part}], "role": "model"},
+                                    "finishReason": "STOP", "index": 0}]}
+
+        if path.endswith(':streamGenerateContent'):
+            # The REST transport reads a streamed JSON array of responses
+            words = text.split(' ')
+            chunks = [' '.join(words[i:i + 8]) + ' ' for i in range(0, len(words), 8)]
+            self._send_json(200, [candidate(chunk) for chunk in chunks])
+        else:
+            self._send_json(200, candidate(text))
+
+    def _openai(self, body: bytes):
+        request = json.loads(body or b'{}')
+        model = request.get('model', 'gpt-3.5-turbo')
+        created = int(time.time())
+        if not request.get('stream'):
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": FAKE_REPLY},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 200, "completion_tokens": 30, "total_tokens": 230}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in FAKE_REPLY.split(' '):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """The stand-in server; start() runs it on a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, profiles: Dict[str, ProviderProfile] = None):
+        super().__init__((host, port), _FakeProviderHandler)
+        self.profiles = {provider: ProviderProfile() for provider in PROVIDERS}
+        self.profiles.update(profiles or {})
+        self._counts = {provider: {"requests": 0, "injected_errors": 0} for provider in PROVIDERS}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def provider_env(self) -> Dict[str, str]:
+        """Environment that points the backend's provider clients at this server"""
+        return {
+            "HF_API_URL": f"{self.base_url}/models/plant-disease",
+            "HF_TOKEN": "fake-hf-token",
+            "GEMINI_API_ENDPOINT": self.base_url,
+            "GEMINI_API_KEY": "fake-gemini-key",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "OPENAI_API_KEY": "fake-openai-key"
+        }
+
+    def count(self, provider: str, failed: bool = False):
+        with self._lock:
+            self._counts[provider]["injected_errors" if failed else "requests"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {provider: dict(counts, **self.profiles[provider].to_dict())
+                    for provider, counts in self._counts.items()}
+
+    def start(self) -> 'FakeProviderServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-providers', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_profile_arguments(parser):
+    """--<provider>-latency-ms, --<provider>-jitter-ms and --<provider>-error-rate options"""
+    defaults = {'huggingface': 250.0, 'gemini': 800.0, 'openai': 600.0}
+    for provider in PROVIDERS:
+        flag = 'hf' if provider == 'huggingface' else provider
+        parser.add_argument(f'--{flag}-latency-ms', type=float, default=defaults[provider],
+                            help=f'Mean {provider} response time')
+        parser.add_argument(f'--{flag}-jitter-ms', type=float, default=defaults[provider] / 4,
+                            help=f'Uniform jitter around the {provider} response time')
+        parser.add_argument(f'--{flag}-error-rate', type=float, default=0.0,
+                            help=f'Fraction of {provider} calls answered with a 503')
+
+
+def profiles_from_args(args) -> Dict[str, ProviderProfile]:
+    profiles = {}
+    for provider in PROVIDERS:
+        flag = 'hf' if provider == 'huggingface' else provider
+        profiles[provider] = ProviderProfile(getattr(args, f'{flag}_latency_ms'), getattr(args, f'{flag}_jitter_ms'),
+                                             getattr(args, f'{flag}_error_rate'))
+    return profiles
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local Hugging Face, Gemini and OpenAI stand-ins')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeProviderServer(args.host, args.port, profiles_from_args(args))
+    print(f"🧪 Fake providers listening on {server.base_url}")
+    for name, value in server.provider_env().items():
+        print(f"   {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+
+"""
+Reproducible load test for the backend APIs.
+
+Starts plant_diagnosis_api and mitra_chat_api under gunicorn, exactly as
+they are deployed, against the local provider stand-ins in
+fake_providers.py and a throwaway SQLite database (or --database-url, e.g.
+a local Postgres). It then replays a weighted request mix at a fixed
+arrival rate and reports throughput, errors and p50/p95/p99 latency per
+endpoint:
+
+    cd backend && python -m benchmarks.load_test --rps 20 --duration 60
+    cd backend && python -m benchmarks.load_test --rps 50 --hf-error-rate 0.2 --output /tmp/run.json
+    cd backend && python -m benchmarks.load_test --compare benchmarks/results/before.json
+
+Load is open-loop: request i is due at start + i / rps whether or not
+earlier requests have returned, and its latency is measured from that due
+time. A slow server therefore shows up as latency rather than as a lower
+request rate, which a closed loop of waiting clients would hide. Results
+are written as JSON (benchmarks/results/ by default) together with the
+configuration and git revision, so two runs can be compared with
+--compare.
+"""
+
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from PIL import Image
+
+from .fake_providers import FakeProviderServer, add_profile_arguments, profiles_from_args
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+DEFAULT_MIX = 'diagnose_base64=4,diagnose_upload=2,chat=2,mitra_chat=1,user_lookup=4,user_by_phone=2,history=3'
+STARTUP_TIMEOUT_SECONDS = 60
+REQUEST_TIMEOUT_SECONDS = 60
+
+CROPS = ('Tomato', 'Potato', 'Wheat', 'Rice', 'Cotton', 'Grape', 'Corn')
+CHAT_MESSAGES = (
+    "My tomato leaves have brown spots with yellow rings, what should I do?",
+    "When should I sow wheat in Punjab this year?",
+    "Which organic fertilizer is best for paddy?",
+    "How often should I water cotton in July?",
+)
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def make_test_images(count: int, size=(1280, 960)) -> List[bytes]:
+    """Distinct camera-sized JPEGs, so the diagnosis cache sees realistic misses"""
+    images = []
+    for index in range(count):
+        rng = random.Random(index)
+        image = Image.new('RGB', size, (rng.randrange(40, 120), rng.randrange(100, 200), rng.randrange(30, 90)))
+        pixels = image.load()
+        for _ in range(2000):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            pixels[x, y] = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of: {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class AppServer:
+    """One backend app running under gunicorn in a subprocess"""
+
+    def __init__(self, app: str, port: int, env: Dict[str, str], health_path: str, log_path: str):
+        self.app = app
+        self.port = port
+        self.env = env
+        self.health_path = health_path
+        self.log_path = log_path
+        self.process = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        env = dict(self.env, PORT=str(self.port))
+        log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{self.port}", self.app],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        deadline = time.time() + STARTUP_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.app} exited during startup, see {self.log_path}")
+            try:
+                if requests.get(self.base_url + self.health_path, timeout=2).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        raise RuntimeError(f"{self.app} did not become healthy within {STARTUP_TIMEOUT_SECONDS}s, see {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadContext:
+    """Shared fixtures the scenarios draw from"""
+
+    def __init__(self, api_url: str, chat_url: str, images: List[bytes], users: List[Dict[str, Any]]):
+        self.api_url = api_url
+        self.chat_url = chat_url
+        self.images = images
+        self.images_base64 = [base64.b64encode(image).decode('ascii') for image in images]
+        self.users = users
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def user(self) -> Dict[str, Any]:
+        return random.choice(self.users)
+
+
+# Scenarios: each sends one request and returns the response
+
+def diagnose_base64(ctx: LoadContext) -> requests.Response:
+    return ctx.session.post(f"{ctx.api_url}/api/diagnose", timeout=REQUEST_TIMEOUT_SECONDS, json={
+        "base64_image": random.choice(ctx.images_base64),
+        "user_id": ctx.user()['id'],
+        "crop_name": random.choice(CROPS)
+    })
+
+
+def diagnose_upload(ctx: LoadContext) -> requests.Response:
+    return ctx.session.post(f"{ctx.api_url}/api/diagnose/upload", timeout=REQUEST_TIMEOUT_SECONDS,
+                            files={"file": ("leaf.jpg", random.choice(ctx.images), 'image/jpeg')},
+                            data={"user_id": str(ctx.user()['id']), "crop_name": random.choice(CROPS)})
+
+
+def chat(ctx: LoadContext) -> requests.Response:
+    return ctx.session.post(f"{ctx.api_url}/api/chat", timeout=REQUEST_TIMEOUT_SECONDS,
+                            json={"message": random.choice(CHAT_MESSAGES)})
+
+
+def mitra_chat(ctx: LoadContext) -> requests.Response:
+    return ctx.session.post(f"{ctx.chat_url}/api/chat", timeout=REQUEST_TIMEOUT_SECONDS,
+                            json={"message": random.choice(CHAT_MESSAGES)})
+
+
+def user_lookup(ctx: LoadContext) -> requests.Response:
+    return ctx.session.get(f"{ctx.api_url}/api/users/{ctx.user()['id']}", timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+def user_by_phone(ctx: LoadContext) -> requests.Response:
+    return ctx.session.get(f"{ctx.api_url}/api/users/phone/{ctx.user()['phone']}", timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+def history(ctx: LoadContext) -> requests.Response:
+    return ctx.session.get(f"{ctx.api_url}/api/users/{ctx.user()['id']}/diagnoses", timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+SCENARIOS: Dict[str, Callable[[LoadContext], requests.Response]] = {
+    'diagnose_base64': diagnose_base64,
+    'diagnose_upload': diagnose_upload,
+    'chat': chat,
+    'mitra_chat': mitra_chat,
+    'user_lookup': user_lookup,
+    'user_by_phone': user_by_phone,
+    'history': history,
+}
+
+
+def seed_users(api_url: str, count: int) -> List[Dict[str, Any]]:
+    users = []
+    for index in range(count):
+        response = requests.post(f"{api_url}/api/users", timeout=REQUEST_TIMEOUT_SECONDS, json={
+            "name": f"Load Test Farmer {index}",
+            "phone": f"9{index:09d}",
+            "location": "Nashik",
+            "state": "Maharashtra"
+        })
+        response.raise_for_status()
+        users.append(response.json()['user'])
+    return users
+
+
+def run_load(ctx: LoadContext, weights: Dict[str, float], rps: float, duration: float, warmup: float,
+             concurrency: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Fire the mix at a fixed arrival rate; returns the samples per scenario, warm-up excluded"""
+    names = list(weights)
+    name_weights = [weights[name] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+
+    def send(name: str, due: float):
+        error = None
+        status = None
+        try:
+            response = SCENARIOS[name](ctx)
+            status = response.status_code
+            if status >= 400:
+                error = f"http_{status}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+        if due >= measure_from:
+            with lock:
+                samples[name].append({"latency": finished - due, "status": status, "error": error})
+
+    total = int((warmup + duration) * rps)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load') as pool:
+        for index in range(total):
+            due = start + index / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, random.choices(names, weights=name_weights)[0], due)
+    return samples
+
+
+def summarize(samples: Dict[str, List[Dict[str, Any]]], duration: float) -> Dict[str, Any]:
+    endpoints = {}
+    everything = []
+    for name, results in samples.items():
+        latencies = sorted(result['latency'] * 1000.0 for result in results)
+        everything.extend(latencies)
+        errors = {}
+        for result in results:
+            if result['error']:
+                errors[result['error']] = errors.get(result['error'], 0) + 1
+        endpoints[name] = _latency_summary(latencies, duration)
+        endpoints[name]["errors"] = sum(errors.values())
+        endpoints[name]["error_breakdown"] = errors
+    return {"overall": _latency_summary(sorted(everything), duration), "endpoints": endpoints}
+
+
+def _latency_summary(latencies_ms: List[float], duration: float) -> Dict[str, Any]:
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        "requests": len(latencies_ms),
+        "throughput_rps": round(len(latencies_ms) / duration, 2) if duration else None,
+        "mean_ms": rounded(sum(latencies_ms) / len(latencies_ms)) if latencies_ms else None,
+        "p50_ms": rounded(percentile(latencies_ms, 50)),
+        "p95_ms": rounded(percentile(latencies_ms, 95)),
+        "p99_ms": rounded(percentile(latencies_ms, 99)),
+        "max_ms": rounded(latencies_ms[-1]) if latencies_ms else None
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Dict[str, Any] = None):
+    header = f"{'endpoint':<18}{'reqs':>7}{'rps':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    rows = list(report['results']['endpoints'].items()) + [('overall', report['results']['overall'])]
+    for name, row in rows:
+        line = (f"{name:<18}{row['requests']:>7}{row['throughput_rps'] or 0:>8.1f}{row.get('errors', 0):>8}"
+                f"{_ms(row['p50_ms']):>10}{_ms(row['p95_ms']):>10}{_ms(row['p99_ms']):>10}")
+        if baseline:
+            before = baseline['results']['overall'] if name == 'overall' else \
+                baseline['results']['endpoints'].get(name)
+            if before and before.get('p95_ms') and row['p95_ms']:
+                line += f"   p95 {100.0 * (row['p95_ms'] - before['p95_ms']) / before['p95_ms']:+.1f}%"
+        print(line)
+
+
+def _ms(value) -> str:
+    return f"{value:.1f}" if value is not None else '-'
+
+
+def main(argv: List[str] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load test the backend against local provider stand-ins')
+    parser.add_argument('--rps', type=float, default=20.0, help='Target request arrival rate')
+    parser.add_argument('--duration', type=float, default=60.0, help='Measured seconds of load')
+    parser.add_argument('--warmup', type=float, default=5.0, help='Seconds of load before measuring')
+    parser.add_argument('--concurrency', type=int, default=256, help='Maximum requests in flight')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weighted scenarios, e.g. chat=1,history=3')
+    parser.add_argument('--users', type=int, default=50, help='Users created before the run')
+    parser.add_argument('--images', type=int, default=20, help='Distinct test images')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers per app (WEB_CONCURRENCY)')
+    parser.add_argument('--server-mode', choices=['sync', 'async'], default='sync', help='SERVER_MODE of the apps')
+    parser.add_argument('--database-url', default=None, help='Database to use instead of a fresh SQLite file')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the apps, e.g. --env WRITE_BUFFER_ENABLED=false')
+    parser.add_argument('--output', default=None, help='Result JSON path (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier result JSON to compare p95 latency with')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the request mix')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix='kisanmitra-loadtest-')
+    providers = FakeProviderServer(profiles=profiles_from_args(args)).start()
+    database_url = args.database_url or f"sqlite:///{os.path.join(work_dir, 'loadtest.db')}"
+
+    env = dict(os.environ)
+    env.update(providers.provider_env())
+    env.update({
+        "DATABASE_URL": database_url,
+        "SERVER_MODE": args.server_mode,
+        "WEB_CONCURRENCY": str(args.workers),
+        "FLASK_ENV": "production",
+        "METRICS_DIR": os.path.join(work_dir, 'metrics'),
+        "CIRCUIT_BREAKER_STATE_DIR": os.path.join(work_dir, 'circuit-breakers'),
+        "WRITE_BUFFER_SPOOL_DIR": os.path.join(work_dir, 'write-spool')
+    })
+    for item in args.env:
+        name, _, value = item.partition('=')
+        env[name] = value
+
+    servers = []
+    try:
+        print(f"🗄️  Preparing database {database_url}")
+        subprocess.run([sys.executable, os.path.join('database', 'init_db.py'), 'upgrade'],
+                       cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+
+        api = AppServer('plant_diagnosis_api:app', _free_port(), env, '/api/health',
+                        os.path.join(work_dir, 'plant_diagnosis_api.log'))
+        chat_api = AppServer('mitra_chat_api:app', _free_port(), env, '/api/health',
+                             os.path.join(work_dir, 'mitra_chat_api.log'))
+        for server in (api, chat_api):
+            server.start()
+            servers.append(server)
+        print(f"🚀 Apps up: {api.base_url} and {chat_api.base_url} ({args.workers} {args.server_mode} workers each)")
+
+        ctx = LoadContext(api.base_url, chat_api.base_url, make_test_images(args.images),
+                          seed_users(api.base_url, args.users))
+        print(f"🔥 {args.rps:g} rps for {args.warmup:g}s warm-up + {args.duration:g}s measured")
+        started_at = datetime.utcnow()
+        samples = run_load(ctx, weights, args.rps, args.duration, args.warmup, args.concurrency)
+        metrics_text = requests.get(f"{api.base_url}/metrics", timeout=REQUEST_TIMEOUT_SECONDS).text
+
+        report = {
+            "started_at": started_at.isoformat() + 'Z',
+            "git_revision": _git_revision(),
+            "config": {
+                "rps": args.rps, "duration_seconds": args.duration, "warmup_seconds": args.warmup,
+                "concurrency": args.concurrency, "mix": weights, "users": args.users, "images": args.images,
+                "workers": args.workers, "server_mode": args.server_mode,
+                "database": database_url.split('://', 1)[0], "seed": args.seed, "env": args.env
+            },
+            "providers": providers.stats(),
+            "results": summarize(samples, args.duration),
+            "server_metrics": metrics_text
+        }
+    finally:
+        for server in servers:
+            server.stop()
+        providers.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report, baseline)
+    print(f"📄 Results written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmarks for the per-request CPU hot paths of a diagnosis.
+
+Every stage runs over a corpus of synthetic phone-camera images at 1, 12
+and 48 megapixels, stored as JPEG, PNG and HEIC-as-converted-JPEG (phones
+hand HEIC photos to browsers as 4:2:0 JPEGs with an EXIF orientation). The
+stages are:
+- decode_base64: decode_base64_payload on a data URL
+- preprocess: preprocess_image_bytes, i.e. decode, draft and resize to 224x224
+- jpeg_encode: the JPEG re-encode sent to the remote backend
+- cache_key: the diagnosis cache key of the model input
+- postprocess: get_disease_with_highest_probability on a full prediction list
+- treatment_lookup: treatment advice for a diagnosed display name
+
+For each stage and image it records the median and p95 time per call,
+and the peak RSS growth of one call made in a freshly forked process, so
+earlier calls cannot hide the allocation. Results are compared against a
+stored baseline, and the run fails when a stage is more than --tolerance
+slower or bigger:
+
+    cd backend && python -m benchmarks.preprocess_bench --update-baseline
+    cd backend && python -m benchmarks.preprocess_bench
+
+Timings depend on the machine, so record the baseline on the machine (or
+CI runner class) that runs the check.
+"""
+
+import base64
+import ctypes
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from diagnosis_cache import image_cache_key
+from image_preprocessing import decode_base64_payload, preprocess_image_bytes
+from inference import MODEL_LABELS, get_disease_with_highest_probability, label_registry
+
+from .load_test import percentile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'preprocess_baseline.json')
+DEFAULT_CORPUS_DIR = os.path.join(BENCHMARKS_DIR, '.corpus')
+
+IMAGE_SIZES = {
+    '1mp': (1152, 864),
+    '12mp': (4000, 3000),
+    '48mp': (8000, 6000),
+}
+IMAGE_FORMATS = ('jpeg', 'png', 'heic_jpeg')
+STAGES = ('decode_base64', 'preprocess', 'jpeg_encode', 'cache_key', 'postprocess', 'treatment_lookup')
+
+# Peak RSS moves in whole pages and allocator chunks, so small stages need some absolute slack
+MEMORY_SLACK_KB = 1024
+EXIF_ORIENTATION = 0x0112
+
+
+def _photo(size: Tuple[int, int], seed: int) -> Image.Image:
+    """Leaf-coloured gradients with sensor noise, so codecs work as hard as on real photos"""
+    rng = random.Random(seed)
+    channels = []
+    for low, high in ((40, 140), (90, 210), (20, 110)):
+        gradient = Image.linear_gradient('L').rotate(rng.randrange(360)).resize(size, Image.Resampling.BILINEAR)
+        gradient = gradient.point(lambda value, low=low, high=high: low + value * (high - low) // 255)
+        noise = Image.effect_noise(size, rng.uniform(8, 20))
+        channels.append(Image.blend(gradient, noise, 0.25))
+    return Image.merge('RGB', channels)
+
+
+def build_corpus(corpus_dir: str, sizes: List[str], formats: List[str]) -> Dict[str, str]:
+    """Write the corpus images once; name -> path"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = {}
+    for seed, size_name in enumerate(sizes):
+        photo = None
+        for image_format in formats:
+            name = f"{size_name}_{image_format}"
+            path = os.path.join(corpus_dir, f"{name}.{'png' if image_format == 'png' else 'jpg'}")
+            if not os.path.exists(path):
+                if photo is None:
+                    photo = _photo(IMAGE_SIZES[size_name], seed)
+                print(f"🖼️  Generating {name}")
+                if image_format == 'png':
+                    photo.save(path, format='PNG')
+                elif image_format == 'heic_jpeg':
+                    exif = Image.Exif()
+                    exif[EXIF_ORIENTATION] = 6
+                    photo.save(path, format='JPEG', quality=90, subsampling='4:2:0', exif=exif.tobytes())
+                else:
+                    photo.save(path, format='JPEG', quality=85)
+            corpus[name] = path
+    return corpus
+
+
+def _predictions() -> List[Dict[str, Any]]:
+    rng = random.Random(0)
+    scores = [rng.random() for _ in MODEL_LABELS]
+    total = sum(scores)
+    return [{"label": f"LABEL_{index}_{label}", "score": score / total}
+            for index, (label, score) in enumerate(zip(MODEL_LABELS, scores))]
+
+
+def stage_calls(image_data: bytes) -> Dict[str, Callable[[], Any]]:
+    """stage name -> a zero-argument call running that stage on one image"""
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(image_data).decode('ascii')
+    preprocessed = preprocess_image_bytes(image_data)
+    predictions = _predictions()
+
+    def jpeg_encode():
+        preprocessed._jpeg_bytes = None
+        return preprocessed.jpeg_bytes()
+
+    return {
+        'decode_base64': lambda: decode_base64_payload(data_url),
+        'preprocess': lambda: preprocess_image_bytes(image_data),
+        'jpeg_encode': jpeg_encode,
+        'cache_key': lambda: image_cache_key(preprocessed.image),
+        'postprocess': lambda: get_disease_with_highest_probability(predictions),
+        'treatment_lookup': lambda: label_registry.treatment_for('Tomato With Late Blight'),
+    }
+
+
+def time_call(call: Callable[[], Any], min_iterations: int, min_seconds: float) -> List[float]:
+    """Seconds per call over at least min_iterations calls and min_seconds, after one warm-up call"""
+    call()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_iterations or time.perf_counter() - started < min_seconds:
+        call_started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - call_started)
+    return timings
+
+
+def _status_kb(field: str) -> Optional[int]:
+    """A kB field (VmRSS, VmHWM) of /proc/self/status; None off Linux"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _peak_rss_child(call: Callable[[], Any], results):
+    # Give the memory the parent freed back to the kernel, so the call cannot
+    # reuse already resident pages, then restart the high-water mark here
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        results.put(None)
+        return
+    start = _status_kb('VmRSS')
+    call()
+    peak = _status_kb('VmHWM')
+    results.put(None if start is None or peak is None else max(0, peak - start))
+
+
+def peak_rss_kb(call: Callable[[], Any]) -> Optional[int]:
+    """Peak RSS growth of one call, made in a forked child; None where fork or /proc is missing"""
+    if 'fork' not in multiprocessing.get_all_start_methods() or _status_kb('VmHWM') is None:
+        return None
+    context = multiprocessing.get_context('fork')
+    results = context.SimpleQueue()
+    process = context.Process(target=_peak_rss_child, args=(call, results))
+    process.start()
+    process.join()
+    return results.get() if process.exitcode == 0 else None
+
+
+def run_benchmarks(corpus: Dict[str, str], stages: List[str], min_iterations: int,
+                   min_seconds: float) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for image_name, path in corpus.items():
+        with open(path, 'rb') as f:
+            image_data = f.read()
+        calls = stage_calls(image_data)
+        for stage in stages:
+            # Label stages do not depend on the image
+            image_independent = stage in ('postprocess', 'treatment_lookup')
+            if image_independent and results.get(stage):
+                continue
+            key = stage if image_independent else f"{stage}/{image_name}"
+            timings = sorted(time_call(calls[stage], min_iterations, min_seconds))
+            results[key] = {
+                "iterations": len(timings),
+                "median_ms": round(statistics.median(timings) * 1000.0, 3),
+                "p95_ms": round(percentile(timings, 95) * 1000.0, 3),
+                "peak_rss_kb": peak_rss_kb(calls[stage])
+            }
+            print(f"  {key:<32}{results[key]['median_ms']:>10.3f} ms{_kb(results[key]['peak_rss_kb']):>12}")
+    return results
+
+
+def _kb(value) -> str:
+    return f"{value} kB" if value is not None else '-'
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                     tolerance: float) -> List[str]:
+    regressions = []
+    for key, result in sorted(results.items()):
+        before = baseline.get(key)
+        if not before:
+            continue
+        if result['median_ms'] > before['median_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: median {before['median_ms']:.3f} -> {result['median_ms']:.3f} ms")
+        if result['peak_rss_kb'] is not None and before.get('peak_rss_kb') is not None and \
+                result['peak_rss_kb'] > before['peak_rss_kb'] * (1 + tolerance) + MEMORY_SLACK_KB:
+            regressions.append(f"{key}: peak RSS {before['peak_rss_kb']} -> {result['peak_rss_kb']} kB")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Preprocessing and postprocessing microbenchmarks')
+    parser.add_argument('--sizes', default=','.join(IMAGE_SIZES), help='Image sizes to run')
+    parser.add_argument('--formats', default=','.join(IMAGE_FORMATS), help='Image formats to run')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Stages to run')
+    parser.add_argument('--min-iterations', type=int, default=5, help='Minimum timed calls per stage and image')
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='Minimum timed seconds per stage and image')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown or growth, as a fraction')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='Write this run as the new baseline')
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR, help='Where the generated images are kept')
+    parser.add_argument('--output', default=None, help='Also write this run as JSON')
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    formats = [image_format for image_format in args.formats.split(',') if image_format]
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = [value for value in sizes if value not in IMAGE_SIZES] + \
+              [value for value in formats if value not in IMAGE_FORMATS] + \
+              [value for value in stages if value not in STAGES]
+    if unknown:
+        parser.error(f"unknown size, format or stage: {', '.join(unknown)}")
+
+    corpus = build_corpus(args.corpus_dir, sizes, formats)
+    print(f"⏱️  Running {len(stages)} stages over {len(corpus)} images")
+    results = run_benchmarks(corpus, stages, args.min_iterations, args.min_seconds)
+    run = {
+        "created_at": datetime.utcnow().isoformat() + 'Z',
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+
+    if args.update_baseline:
+        baseline_results = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline_results = json.load(f).get('results', {})
+        baseline_results.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(dict(run, results=baseline_results), f, indent=2, sort_keys=True)
+        print(f"📄 Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"⚠️ No baseline at {args.baseline}; record one with --update-baseline")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline.get('results', {}), args.tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} regressions beyond {args.tolerance:.0%}:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
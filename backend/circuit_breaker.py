@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+Circuit breaker and token-bucket rate limiter for upstream AI providers.
+
+CircuitBreaker has three states:
+- closed: calls go through; consecutive failures are counted
+- open: calls are rejected immediately until the cooldown has passed
+- half_open: one probe call is let through; success closes the circuit,
+  failure re-opens it with a longer, jittered cooldown
+
+The cooldown replaces in-request sleeps: while a provider is down or its
+model is cold, requests fail fast to their fallback instead of waiting.
+When a state directory is configured, transitions are written to a small
+JSON file there so all gunicorn workers on the host share the state.
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+CIRCUIT_BREAKER_STATE_DIR = os.environ.get('CIRCUIT_BREAKER_STATE_DIR')
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open"""
+
+
+class RateLimitedError(Exception):
+    """Raised when a call is rejected by the rate limiter"""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker with jittered exponential cooldown"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, recovery_timeout: float = 10.0,
+                 max_recovery_timeout: float = 300.0, jitter: float = 0.2,
+                 state_dir: Optional[str] = CIRCUIT_BREAKER_STATE_DIR):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.jitter = jitter
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._consecutive_opens = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._updated_at = 0.0
+
+        # Metrics
+        self._transitions = {}
+        self._rejected = 0
+        self._successes = 0
+        self._failures_total = 0
+
+        self._state_path = None
+        self._state_mtime = None
+        if state_dir:
+            try:
+                os.makedirs(state_dir, exist_ok=True)
+                self._state_path = os.path.join(state_dir, f"{name}.json")
+            except OSError as e:
+                print(f"⚠️ Circuit breaker state directory unavailable, state is per worker: {e}")
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go upstream now; a True in half-open state is the probe"""
+        with self._lock:
+            self._sync_from_shared_state()
+            now = time.time()
+
+            if self._state == OPEN:
+                if now < self._open_until:
+                    self._rejected += 1
+                    return False
+                self._transition(HALF_OPEN, now)
+
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != CLOSED:
+                self._consecutive_opens = 0
+                self._transition(CLOSED, time.time())
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """Count a failed call; retry_after (seconds) overrides the computed cooldown"""
+        with self._lock:
+            self._failures_total += 1
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open(retry_after)
+
+    def _open(self, retry_after: Optional[float]):
+        """Open the circuit with an exponentially growing, jittered cooldown (lock held)"""
+        self._consecutive_opens += 1
+        cooldown = min(self.recovery_timeout * (2 ** (self._consecutive_opens - 1)), self.max_recovery_timeout)
+        if retry_after:
+            cooldown = min(max(retry_after, self.recovery_timeout), self.max_recovery_timeout)
+        cooldown *= 1 + random.uniform(-self.jitter, self.jitter)
+
+        now = time.time()
+        self._open_until = now + cooldown
+        self._failures = 0
+        self._transition(OPEN, now)
+        print(f"⚠️ Circuit '{self.name}' opened for {cooldown:.1f}s")
+
+    def _transition(self, new_state: str, now: float):
+        """Change state, count the transition and publish it to other workers (lock held)"""
+        if new_state == self._state:
+            return
+        key = f"{self._state}->{new_state}"
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        self._state = new_state
+        self._updated_at = now
+        if new_state != HALF_OPEN:
+            self._write_shared_state()
+
+    def _write_shared_state(self):
+        if not self._state_path:
+            return
+        state = {
+            "state": self._state,
+            "open_until": self._open_until,
+            "consecutive_opens": self._consecutive_opens,
+            "updated_at": self._updated_at
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._state_path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._state_path)
+            self._state_mtime = os.stat(self._state_path).st_mtime_ns
+        except OSError as e:
+            print(f"⚠️ Could not write circuit breaker state: {e}")
+
+    def _sync_from_shared_state(self):
+        """Adopt a newer state published by another worker; one stat() when nothing changed (lock held)"""
+        if not self._state_path:
+            return
+        try:
+            mtime = os.stat(self._state_path).st_mtime_ns
+            if mtime == self._state_mtime:
+                return
+            with open(self._state_path, 'r') as f:
+                shared = json.load(f)
+            self._state_mtime = mtime
+        except (OSError, ValueError):
+            return
+
+        if shared.get("updated_at", 0) <= self._updated_at:
+            return
+        new_state = shared.get("state", CLOSED)
+        if new_state != self._state:
+            key = f"{self._state}->{new_state}"
+            self._transitions[key] = self._transitions.get(key, 0) + 1
+        self._state = new_state
+        self._open_until = shared.get("open_until", 0.0)
+        self._consecutive_opens = shared.get("consecutive_opens", 0)
+        self._updated_at = shared["updated_at"]
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        """State and transition counts for health checks and metrics"""
+        with self._lock:
+            return {
+                "state": self._state,
+                "open_for_seconds": round(max(0.0, self._open_until - time.time()), 1) if self._state == OPEN else 0,
+                "consecutive_opens": self._consecutive_opens,
+                "transitions": dict(self._transitions),
+                "rejected": self._rejected,
+                "successes": self._successes,
+                "failures": self._failures_total,
+                "shared": bool(self._state_path)
+            }
+
+
+class TokenBucket:
+    """Non-blocking token bucket; the limit applies per worker process"""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available; never waits"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self._rejected += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rate_per_second": self.rate, "burst": self.capacity, "rejected": self._rejected}
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+Calibrated confidence for plant disease predictions.
+
+Raw softmax scores of the classifier are over-confident, so they are
+temperature scaled: p_i is proportional to exp(z_i / T), with one scalar T
+fitted offline on a labelled validation set by minimising the negative
+log-likelihood. T does not change the ranking, only how sharp the
+probabilities are. Scaling log-probabilities is the same as scaling
+logits, because the softmax normaliser cancels. The local backend returns
+the full probability vector, so its scores are calibrated exactly. The
+Hugging Face API returns only its top 5: those scores are scaled with the
+probability left outside them spread evenly over the remaining classes,
+which approximates the full vector but is not a fitted calibration. With
+T = 1 (no calibration file) scores are passed through unchanged.
+
+Fit T with the local ONNX model over a directory of images laid out as
+<label>/<image>:
+
+    cd backend && python confidence.py fit --data-dir /path/to/validation
+
+This writes calibration.json next to the model (LOCAL_MODEL_DIR).
+CONFIDENCE_TEMPERATURE overrides the file. Results below
+LOW_CONFIDENCE_THRESHOLD percent are answered with "retake photo"
+guidance instead of treatment advice.
+"""
+
+import json
+import math
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+CONFIDENCE_TOP_K = int(os.environ.get('CONFIDENCE_TOP_K', '5'))
+LOW_CONFIDENCE_THRESHOLD = int(os.environ.get('LOW_CONFIDENCE_THRESHOLD', '50'))
+
+RETAKE_PHOTO_TREATMENT = (
+    "We could not identify the problem confidently from this photo. Please retake it: photograph one "
+    "affected leaf close up, in daylight without direct sun or flash, with the leaf filling most of the frame."
+)
+RETAKE_PHOTO_STEPS = [
+    {"step": 1, "title": "Pick One Leaf", "description": "Choose a single leaf that clearly shows the spots, discoloration or damage."},
+    {"step": 2, "title": "Use Soft Daylight", "description": "Take the photo outdoors in shade or on a cloudy day. Avoid flash and harsh sunlight."},
+    {"step": 3, "title": "Fill the Frame", "description": "Hold the phone 15-20 cm away so the leaf fills most of the picture and is in focus."},
+    {"step": 4, "title": "Plain Background", "description": "Place the leaf against soil, paper or your palm so it stands out from other plants."}
+]
+
+_MIN_TEMPERATURE = 0.05
+_MAX_TEMPERATURE = 20.0
+_MIN_PROBABILITY = 1e-12
+
+
+def load_temperature(calibration_path: str) -> float:
+    """CONFIDENCE_TEMPERATURE, else the fitted temperature in calibration_path, else 1.0 (no scaling)"""
+    override = os.environ.get('CONFIDENCE_TEMPERATURE')
+    if override:
+        return min(_MAX_TEMPERATURE, max(_MIN_TEMPERATURE, float(override)))
+    try:
+        with open(calibration_path, 'r', encoding='utf-8') as f:
+            temperature = float(json.load(f)['temperature'])
+        return min(_MAX_TEMPERATURE, max(_MIN_TEMPERATURE, temperature))
+    except FileNotFoundError:
+        return 1.0
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ Could not read confidence calibration from {calibration_path}: {e}")
+        return 1.0
+
+
+def scale_log_scores(log_scores: Sequence[float], temperature: float) -> List[float]:
+    """Softmax of log_scores / temperature; log_scores may be logits or log-probabilities"""
+    scaled = [value / temperature for value in log_scores]
+    peak = max(scaled)
+    exp = [math.exp(value - peak) for value in scaled]
+    total = sum(exp)
+    return [value / total for value in exp]
+
+
+def calibrate_probabilities(probabilities: Sequence[float], temperature: float,
+                            num_classes: int = 0) -> List[float]:
+    """
+    Temperature-scale probabilities that may be only the top of the full vector
+    The mass outside them is treated as num_classes - len(probabilities) equal
+    classes, so partial scores are not inflated by renormalising over the top few
+    """
+    if temperature == 1.0:
+        return [float(value) for value in probabilities]
+    weights = [math.exp(math.log(max(value, _MIN_PROBABILITY)) / temperature) for value in probabilities]
+    total = sum(weights)
+    remainder = 1.0 - sum(probabilities)
+    missing = num_classes - len(probabilities)
+    if remainder > _MIN_PROBABILITY and missing > 0:
+        total += missing * math.exp(math.log(remainder / missing) / temperature)
+    return [value / total for value in weights]
+
+
+def is_low_confidence(confidence: int) -> bool:
+    return confidence < LOW_CONFIDENCE_THRESHOLD
+
+
+def retake_photo_bundle() -> Dict[str, Any]:
+    """Treatment bundle shape for a result too uncertain to treat"""
+    return {
+        "fertilizers": [],
+        "steps": [dict(step) for step in RETAKE_PHOTO_STEPS],
+        "duration": None,
+        "success_rate": None
+    }
+
+
+# Offline fitting
+
+def negative_log_likelihood(logits: Sequence[Sequence[float]], targets: Sequence[int], temperature: float) -> float:
+    total = 0.0
+    for row, target in zip(logits, targets):
+        total -= math.log(max(scale_log_scores(row, temperature)[target], _MIN_PROBABILITY))
+    return total / max(1, len(targets))
+
+
+def fit_temperature(logits: Sequence[Sequence[float]], targets: Sequence[int]) -> float:
+    """Temperature minimising the validation NLL (golden-section search on log T; the NLL is convex in 1/T)"""
+    low, high = math.log(_MIN_TEMPERATURE), math.log(_MAX_TEMPERATURE)
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = high - ratio * (high - low), low + ratio * (high - low)
+    nll_a = negative_log_likelihood(logits, targets, math.exp(a))
+    nll_b = negative_log_likelihood(logits, targets, math.exp(b))
+    for _ in range(60):
+        if nll_a < nll_b:
+            high, b, nll_b = b, a, nll_a
+            a = high - ratio * (high - low)
+            nll_a = negative_log_likelihood(logits, targets, math.exp(a))
+        else:
+            low, a, nll_a = a, b, nll_b
+            b = low + ratio * (high - low)
+            nll_b = negative_log_likelihood(logits, targets, math.exp(b))
+    return math.exp((low + high) / 2)
+
+
+def expected_calibration_error(logits: Sequence[Sequence[float]], targets: Sequence[int], temperature: float,
+                               bins: int = 15) -> float:
+    """Average gap between top-1 confidence and accuracy, over equal-width confidence bins"""
+    buckets = [[0, 0.0, 0.0] for _ in range(bins)]  # count, confidence sum, correct sum
+    for row, target in zip(logits, targets):
+        probabilities = scale_log_scores(row, temperature)
+        top = max(range(len(probabilities)), key=probabilities.__getitem__)
+        bucket = buckets[min(bins - 1, int(probabilities[top] * bins))]
+        bucket[0] += 1
+        bucket[1] += probabilities[top]
+        bucket[2] += 1.0 if top == target else 0.0
+    total = sum(bucket[0] for bucket in buckets) or 1
+    return sum(abs(bucket[1] - bucket[2]) for bucket in buckets if bucket[0]) / total
+
+
+def _validation_logits(backend, data_dir: str) -> Tuple[List[List[float]], List[int], List[str]]:
+    """Raw logits and label indexes for every image under data_dir/<label>/"""
+    from image_preprocessing import preprocess_image_stream
+    from label_registry import LabelRegistry
+
+    registry = LabelRegistry(backend.labels)
+    logits, targets, skipped = [], [], []
+    for directory in sorted(os.listdir(data_dir)):
+        info = registry.lookup(directory)
+        if info is None:
+            skipped.append(directory)
+            continue
+        directory_path = os.path.join(data_dir, directory)
+        for name in sorted(os.listdir(directory_path)):
+            try:
+                with open(os.path.join(directory_path, name), 'rb') as f:
+                    image = preprocess_image_stream(f)
+            except Exception as e:
+                print(f"⚠️ Skipping {directory}/{name}: {e}")
+                continue
+            logits.append([float(value) for value in backend.logits(image)])
+            targets.append(info.index)
+    return logits, targets, skipped
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from datetime import datetime
+
+    from inference import LOCAL_MODEL_DIR, LocalOnnxBackend
+
+    parser = argparse.ArgumentParser(description='Confidence calibration utility')
+    parser.add_argument('command', choices=['fit'], help='Command to run')
+    parser.add_argument('--data-dir', required=True, help='Validation images laid out as <label>/<image>')
+    parser.add_argument('--model-dir', default=LOCAL_MODEL_DIR, help='Exported ONNX model directory')
+    parser.add_argument('--output', default=None, help='Calibration file (default: <model-dir>/calibration.json)')
+    args = parser.parse_args()
+
+    backend = LocalOnnxBackend(args.model_dir)
+    logits, targets, skipped = _validation_logits(backend, args.data_dir)
+    if skipped:
+        print(f"⚠️ Directories that match no model label were skipped: {', '.join(skipped)}")
+    if not targets:
+        print("❌ No validation images found")
+        sys.exit(1)
+
+    temperature = fit_temperature(logits, targets)
+    report = {
+        "temperature": round(temperature, 4),
+        "samples": len(targets),
+        "nll_before": round(negative_log_likelihood(logits, targets, 1.0), 4),
+        "nll_after": round(negative_log_likelihood(logits, targets, temperature), 4),
+        "ece_before": round(expected_calibration_error(logits, targets, 1.0), 4),
+        "ece_after": round(expected_calibration_error(logits, targets, temperature), 4),
+        "fitted_at": datetime.utcnow().isoformat() + 'Z'
+    }
+    output = args.output or os.path.join(args.model_dir, 'calibration.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"🎯 Fitted temperature {report['temperature']} on {len(targets)} images: "
+          f"ECE {report['ece_before']} -> {report['ece_after']}, written to {output}")
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+"""
+Per-user conversation memory for the farming assistant chat.
+
+A conversation is the latest messages, kept verbatim, plus a running
+summary of everything before them. The verbatim turns are held under
+CHAT_MEMORY_TOKEN_BUDGET estimated tokens. When an exchange pushes them
+over, the oldest turns are folded into the summary until they fit in half
+the budget, so the summarisation call runs once every few turns rather
+than on every one. That call runs on a background thread after the reply
+has been sent; until it finishes the turns stay verbatim, so a prompt may
+briefly run an exchange or two over the budget. The summary is capped at
+CHAT_MEMORY_SUMMARY_TOKENS. A prompt therefore stays close to the system
+prompt, the summary, the budget and the new message, however long the
+conversation gets.
+
+Conversations live in an in-process LRU in front of the chat_conversations
+table, and every exchange is written through: in the request's own
+transaction when one is open, otherwise (streamed replies, the summary
+thread) in a session of its own. The memory copy and the revision it
+expects are only updated once that write has committed, so a request that
+rolls back leaves the memory as stored. Each row carries a revision
+number. If a user's messages reach two workers, the write that loses the
+revision check reloads the stored conversation and appends its exchange
+there, so no turns are lost. That one prompt may still have missed the
+other worker's latest exchange.
+
+Tokens are estimated per script: about four characters per token for
+ASCII text, and 1.5 for anything else, since Devanagari and other Indic
+scripts cost a token every one or two characters. No tokenizer is needed
+because the budget only has to be roughly right. Requests report the
+provider's own token counts when it returns them (see chat_usage).
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from request_session import after_request_commit, get_request_db, in_request_transaction
+
+try:
+    from database import get_db_session, get_chat_conversation, save_chat_conversation
+    DATABASE_AVAILABLE = True
+except ImportError:
+    DATABASE_AVAILABLE = False
+
+CHAT_MEMORY_TOKEN_BUDGET = int(os.environ.get('CHAT_MEMORY_TOKEN_BUDGET', '1200'))
+CHAT_MEMORY_SUMMARY_TOKENS = int(os.environ.get('CHAT_MEMORY_SUMMARY_TOKENS', '300'))
+CHAT_MEMORY_CACHE_SIZE = int(os.environ.get('CHAT_MEMORY_CACHE_SIZE', '1024'))
+
+ASCII_CHARS_PER_TOKEN = 4
+OTHER_CHARS_PER_TOKEN = 1.5
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + (len(text) - ascii_chars) / OTHER_CHARS_PER_TOKEN)
+
+
+def clip_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut text to about max_tokens, keeping its start (or its end with keep_end)"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    max_chars = max(1, len(text) * max_tokens // tokens)
+    return '…' + text[-(max_chars - 1):] if keep_end else text[:max_chars - 1] + '…'
+
+
+def parse_user_id(value: Any) -> Optional[int]:
+    """The user_id of a chat request, or None when the request should run without memory"""
+    try:
+        user_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return user_id if user_id > 0 else None
+
+
+class Conversation:
+    """Running summary plus recent turns of one user's chat"""
+
+    __slots__ = ('user_id', 'summary', 'turns', 'revision')
+
+    def __init__(self, user_id: int, summary: Optional[str] = None, turns: Optional[List[Dict[str, Any]]] = None,
+                 revision: int = 0):
+        self.user_id = user_id
+        self.summary = summary
+        self.turns = turns or []  # [{"role": "user" | "assistant", "content": str, "tokens": int}]
+        self.revision = revision  # revision of the stored row this copy was read from, 0 if none
+
+    @property
+    def turn_tokens(self) -> int:
+        return sum(turn['tokens'] for turn in self.turns)
+
+    def append(self, role: str, content: str, max_tokens: int):
+        content = clip_to_tokens(content.strip(), max_tokens)
+        self.turns.append({"role": role, "content": content, "tokens": estimate_tokens(content)})
+
+    def copy(self) -> 'Conversation':
+        return Conversation(self.user_id, self.summary, [dict(turn) for turn in self.turns], self.revision)
+
+
+def build_summary_prompt(summary: Optional[str], turns: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Prompt asking the chat model to fold turns into the running summary"""
+    transcript = '\n'.join(
+        f"{'Farmer' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns
+    )
+    return (
+        "Update the running summary of a conversation between a farmer and a farming assistant.\n"
+        "Keep the farmer's crops, location, symptoms, quantities and plans, and the advice already given. "
+        "Drop greetings and repetition.\n"
+        f"Reply with the updated summary only, in at most {max_tokens * 3 // 4} words.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        f"New turns:\n{transcript}"
+    )
+
+
+def fallback_summary(summary: Optional[str], turns: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Summary without a model call: the farmer's own earlier messages, newest kept when they do not fit"""
+    said = ' | '.join(turn['content'] for turn in turns if turn['role'] == 'user')
+    text = f"{summary} | {said}" if summary and said else (summary or said)
+    return clip_to_tokens(text, max_tokens, keep_end=True)
+
+
+def summary_message(conversation: Conversation) -> Optional[str]:
+    if not conversation.summary:
+        return None
+    return f"Summary of the earlier conversation with this farmer: {conversation.summary}"
+
+
+def chat_messages(system_prompt: str, conversation: Optional[Conversation], user_message: str) -> List[Dict[str, str]]:
+    """OpenAI-style messages: system prompt, earlier summary, recent turns, then the new message"""
+    messages = [{"role": "system", "content": system_prompt}]
+    if conversation is not None:
+        summary = summary_message(conversation)
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        messages.extend({"role": turn['role'], "content": turn['content']} for turn in conversation.turns)
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def chat_prompt(system_prompt: str, conversation: Optional[Conversation], user_message: str,
+                assistant_name: str = 'Hariyali Mitra') -> str:
+    """The same context as chat_messages, as one text prompt in the User/assistant_name transcript format"""
+    parts = [system_prompt]
+    if conversation is not None:
+        summary = summary_message(conversation)
+        if summary:
+            parts.append(summary)
+        parts.extend(
+            f"{'User' if turn['role'] == 'user' else assistant_name}: {turn['content']}" for turn in conversation.turns
+        )
+    parts.append(f"User: {user_message}")
+    parts.append(f"{assistant_name}:")
+    return '\n\n'.join(parts)
+
+
+def chat_usage(prompt: str, reply: str, prompt_tokens: Optional[int] = None,
+               completion_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Prompt length and token counts of one chat request; counts the provider did not report are estimated"""
+    estimated = prompt_tokens is None or completion_tokens is None
+    return {
+        "prompt_chars": len(prompt),
+        "prompt_tokens": prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt),
+        "completion_tokens": completion_tokens if completion_tokens is not None else estimate_tokens(reply),
+        "estimated": estimated
+    }
+
+
+class ConversationMemory:
+    """Per-user conversations: in-process LRU in front of the chat_conversations table"""
+
+    def __init__(self, token_budget: int = CHAT_MEMORY_TOKEN_BUDGET,
+                 summary_tokens: int = CHAT_MEMORY_SUMMARY_TOKENS,
+                 memory_size: int = CHAT_MEMORY_CACHE_SIZE):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # user_id -> Conversation
+        self._lock = threading.Lock()
+        self._compacting = set()  # user_ids with a summary in progress
+        self._executor = None
+        self._executor_pid = None
+        self._hits = 0
+        self._misses = 0
+        self._summaries = 0
+        self._conflicts = 0
+
+    def get(self, user_id: int) -> Conversation:
+        """A copy of the user's conversation, empty if there is none yet"""
+        with self._lock:
+            conversation = self._memory.get(user_id)
+            if conversation is not None:
+                self._memory.move_to_end(user_id)
+                self._hits += 1
+                return conversation.copy()
+            self._misses += 1
+
+        conversation = self._read_database(user_id) or Conversation(user_id)
+        self._remember(conversation)
+        return conversation.copy()
+
+    def record_exchange(self, user_id: int, user_message: str, reply: str,
+                        summarize: Optional[Callable[[str], str]] = None,
+                        usage: Optional[Dict[str, Any]] = None) -> Conversation:
+        """
+        Append a message and its reply and store the result; over budget, old turns are folded into the
+        summary in the background. summarize(prompt) -> text is the model call used to summarise; without it,
+        or when it fails, the summary falls back to the farmer's own messages. usage (see chat_usage) is added
+        to the user's totals
+        """
+        conversation = self.get(user_id)
+        for _ in range(2):
+            conversation.append('user', user_message, self.token_budget // 2)
+            conversation.append('assistant', reply, self.token_budget // 2)
+            if self._write_database(conversation, usage,
+                                    lambda stored=conversation: self._stored(stored, summarize)):
+                return conversation
+            stored = self._read_database(user_id)
+            if stored is None:
+                break  # Nothing newer is stored (e.g. the user does not exist); keep the memory copy
+            # Another worker stored a newer revision; apply this exchange on top of it
+            with self._lock:
+                self._conflicts += 1
+            conversation = stored
+        self._stored(conversation, summarize)
+        return conversation
+
+    def _stored(self, conversation: Conversation, summarize: Optional[Callable[[str], str]]):
+        """Remember a conversation once it is written, and fold its oldest turns if it is over budget"""
+        self._remember(conversation)
+        if self._turns_to_fold(conversation):
+            self._compact_later(conversation.user_id, summarize)
+
+    def _turns_to_fold(self, conversation: Conversation) -> List[Dict[str, Any]]:
+        """Oldest turns to fold so the rest fit in half the budget, always keeping the latest exchange"""
+        if conversation.turn_tokens <= self.token_budget:
+            return []
+        remaining = conversation.turn_tokens
+        count = 0
+        while len(conversation.turns) - count > 2 and remaining > self.token_budget // 2:
+            remaining -= conversation.turns[count]['tokens']
+            count += 1
+        return conversation.turns[:count]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """This process's summary thread, recreated in forked gunicorn workers"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+                self._executor_pid = os.getpid()
+                self._compacting = set()
+            return self._executor
+
+    def _compact_later(self, user_id: int, summarize: Optional[Callable[[str], str]]):
+        executor = self._get_executor()
+        with self._lock:
+            if user_id in self._compacting:
+                return
+            self._compacting.add(user_id)
+        executor.submit(self._compact, user_id, summarize)
+
+    def _compact(self, user_id: int, summarize: Optional[Callable[[str], str]]):
+        """Fold the oldest turns into the summary, off the request path"""
+        try:
+            conversation = self.get(user_id)
+            folded = self._turns_to_fold(conversation)
+            if not folded:
+                return
+            summary = self._summarize(conversation.summary, folded, summarize)
+
+            # Exchanges recorded while the model was summarising stay; only the folded turns are replaced
+            for _ in range(2):
+                conversation = self.get(user_id)
+                if conversation.turns[:len(folded)] != folded:
+                    return
+                del conversation.turns[:len(folded)]
+                conversation.summary = summary
+                if self._write_database(conversation, None, lambda: self._remember(conversation)):
+                    with self._lock:
+                        self._summaries += 1
+                    return
+                stored = self._read_database(user_id)
+                if stored is None:
+                    return
+                with self._lock:
+                    self._conflicts += 1
+                self._remember(stored)
+        except Exception as e:
+            print(f"⚠️ Could not summarise chat conversation for user {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._compacting.discard(user_id)
+
+    def _summarize(self, summary: Optional[str], folded: List[Dict[str, Any]],
+                   summarize: Optional[Callable[[str], str]]) -> str:
+        new_summary = None
+        if summarize is not None:
+            try:
+                new_summary = (summarize(build_summary_prompt(summary, folded, self.summary_tokens)) or '').strip()
+            except Exception as e:
+                print(f"⚠️ Chat summary failed, using the farmer's messages instead: {e}")
+        if not new_summary:
+            new_summary = fallback_summary(summary, folded, self.summary_tokens)
+        return clip_to_tokens(new_summary, self.summary_tokens)
+
+    def _remember(self, conversation: Conversation):
+        with self._lock:
+            self._memory[conversation.user_id] = conversation.copy()
+            self._memory.move_to_end(conversation.user_id)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _read_database(self, user_id: int) -> Optional[Conversation]:
+        if not DATABASE_AVAILABLE:
+            return None
+        if in_request_transaction():
+            row = get_chat_conversation(get_request_db(), user_id)
+        else:
+            db = get_db_session()
+            if not db:
+                return None
+            try:
+                row = get_chat_conversation(db, user_id)
+            finally:
+                db.close()
+        if row is None:
+            return None
+        return Conversation(user_id, row['summary'], row['turns'] or [], row['revision'])
+
+    def _write_database(self, conversation: Conversation, usage: Optional[Dict[str, Any]],
+                        committed: Callable[[], None]) -> bool:
+        """
+        Store conversation, then bump its revision and call committed() once the write is durable: at once with
+        a session of its own, after the commit inside a request, never if the request rolls back
+        False only when the stored row moved on since conversation was read
+        """
+        if not DATABASE_AVAILABLE:
+            committed()
+            return True
+        # Inside a request the row joins the request's transaction (see request_session.py)
+        in_request = in_request_transaction()
+        db = get_request_db(write=True) if in_request else get_db_session()
+        if not db:
+            committed()
+            return True
+        try:
+            saved = save_chat_conversation(
+                db, conversation.user_id, conversation.summary, conversation.turns, conversation.revision,
+                prompt_tokens=(usage or {}).get('prompt_tokens', 0),
+                completion_tokens=(usage or {}).get('completion_tokens', 0),
+                commit=not in_request
+            )
+        except Exception as e:
+            # Keep the conversation in memory; it is written again with the next exchange
+            print(f"⚠️ Could not persist chat conversation for user {conversation.user_id}: {e}")
+            committed()
+            return True
+        finally:
+            if not in_request:
+                db.close()
+        if not saved:
+            return False
+
+        def bump_revision():
+            conversation.revision += 1
+            committed()
+
+        if in_request:
+            after_request_commit(bump_revision)
+        else:
+            bump_revision()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._memory),
+                "max_size": self.memory_size,
+                "token_budget": self.token_budget,
+                "hits": self._hits,
+                "misses": self._misses,
+                "summaries": self._summaries,
+                "summaries_pending": len(self._compacting),
+                "conflicts": self._conflicts
+            }
+
+
+conversation_memory = ConversationMemory()
@@ -7,17 +7,44 @@ from .models import (
     Diagnosis,
     AdvisoryRecord,
     UserActivity,
+    UserActivityDaily,
+    TreatmentCacheEntry,
+    ChatConversation,
+    MarketPriceDaily,
+    RefreshWatermark,
     create_tables,
     get_db,
     get_db_session,
     create_user,
+    normalize_phone,
     get_user_by_phone,
     get_user_by_id,
+    create_listing,
     create_diagnosis,
+    bulk_create_diagnoses,
+    pack_top_k,
+    unpack_top_k,
     get_user_diagnoses,
+    find_user_diagnoses,
     create_user_activity,
+    bulk_create_user_activities,
+    increment_listing_counters,
+    get_cached_treatment,
+    upsert_cached_treatment,
+    get_chat_conversation,
+    save_chat_conversation,
     test_connection
 )
+from .write_buffer import WriteBehindBuffer
+from .user_cache import (
+    user_cache,
+    get_cached_user_by_id,
+    get_cached_user_by_phone,
+    invalidate_user_cache
+)
+from .listing_search import search_listings
+from .listing_counters import ListingCounterBuffer
+from .market_prices import get_market_prices, refresh_market_prices
 
 __all__ = [
     'Base',
@@ -26,14 +53,40 @@ __all__ = [
     'Diagnosis', 
     'AdvisoryRecord',
     'UserActivity',
+    'UserActivityDaily',
+    'TreatmentCacheEntry',
+    'ChatConversation',
+    'MarketPriceDaily',
+    'RefreshWatermark',
     'create_tables',
     'get_db',
     'get_db_session',
     'create_user',
+    'normalize_phone',
     'get_user_by_phone',
     'get_user_by_id',
+    'create_listing',
     'create_diagnosis',
+    'bulk_create_diagnoses',
+    'pack_top_k',
+    'unpack_top_k',
     'get_user_diagnoses',
+    'find_user_diagnoses',
     'create_user_activity',
-    'test_connection'
+    'bulk_create_user_activities',
+    'increment_listing_counters',
+    'get_cached_treatment',
+    'upsert_cached_treatment',
+    'get_chat_conversation',
+    'save_chat_conversation',
+    'test_connection',
+    'WriteBehindBuffer',
+    'user_cache',
+    'get_cached_user_by_id',
+    'get_cached_user_by_phone',
+    'invalidate_user_cache',
+    'search_listings',
+    'ListingCounterBuffer',
+    'get_market_prices',
+    'refresh_market_prices'
 ]
\ No newline at end of file
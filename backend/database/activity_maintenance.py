@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""
+Partition management, retention and rollup for user_activities.
+
+On PostgreSQL user_activities is range-partitioned by month on timestamp
+(migration 0003). Partitions are named user_activities_yYYYYmMM, and a
+DEFAULT partition catches rows outside every monthly range so inserts
+never fail. Each run of the maintenance job:
+
+1. creates the partitions for the current month and
+   ACTIVITY_PARTITION_MONTHS_AHEAD months ahead. If the job was skipped
+   for longer than that, the DEFAULT partition already holds rows for
+   those months and PostgreSQL refuses to create them as PARTITION OF, so
+   the partition is created standalone, the rows are moved into it and it
+   is attached
+2. rolls every month older than ACTIVITY_RETENTION_MONTHS up into
+   user_activity_daily (one row per user, day and action) and then detaches
+   and drops that month's partition, which frees the space at once with no
+   DELETE, vacuum or index bloat
+3. rolls up and deletes any remaining rows older than the cutoff (the
+   DEFAULT partition, or the whole table on databases without partitioning)
+
+Each rollup and the removal of its rows happen in one transaction. Run it
+daily, e.g. from cron:
+
+    cd backend && python database/init_db.py maintain-activities
+"""
+
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List
+
+from sqlalchemy import column, func, select, table, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import UserActivity, UserActivityDaily
+
+ACTIVITY_RETENTION_MONTHS = int(os.environ.get('ACTIVITY_RETENTION_MONTHS', '6'))
+ACTIVITY_PARTITION_MONTHS_AHEAD = int(os.environ.get('ACTIVITY_PARTITION_MONTHS_AHEAD', '2'))
+
+PARENT_TABLE = 'user_activities'
+DEFAULT_PARTITION = 'user_activities_default'
+_COLUMNS = 'id, user_id, action, data, "timestamp"'
+_PARTITION_NAME_RE = re.compile(r'^user_activities_y(\d{4})m(\d{2})$')
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    """First day of the month `months` after the month of value"""
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn) -> bool:
+    """Whether user_activities is a partitioned table (PostgreSQL only)"""
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": PARENT_TABLE}).first() is not None
+
+
+def create_monthly_partitions(conn, first_month: date, last_month: date) -> List[str]:
+    """Create the monthly partitions from first_month to last_month inclusive; returns the new ones"""
+    existing = set(list_monthly_partitions(conn))
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        name = partition_name(month)
+        if name not in existing:
+            _create_partition(conn, name, month)
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _create_partition(conn, name: str, month: date):
+    """Create one monthly partition, moving any of its rows out of the DEFAULT partition first"""
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    in_range = '"timestamp" >= :start AND "timestamp" < :end'
+    params = {"start": month, "end": add_months(month, 1)}
+
+    has_default = conn.execute(text("SELECT to_regclass(:table)"), {"table": DEFAULT_PARTITION}).scalar()
+    stranded = has_default is not None and conn.execute(text(
+        f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range} LIMIT 1"
+    ), params).first() is not None
+    if not stranded:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} {bounds}"))
+        return
+
+    # Attaching creates the partition's copies of the parent's keys and indexes, after checking that
+    # the DEFAULT partition no longer holds rows for the month
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING {_COLUMNS}) "
+        f"INSERT INTO {name} ({_COLUMNS}) SELECT {_COLUMNS} FROM moved"
+    ), params).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} {bounds}"))
+    print(f"✅ Moved {moved} activity rows from {DEFAULT_PARTITION} into new partition {name}")
+
+
+def list_monthly_partitions(conn) -> Dict[str, date]:
+    """partition name -> first day of its month"""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": PARENT_TABLE})
+    partitions = {}
+    for (name,) in rows:
+        match = _PARTITION_NAME_RE.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def _upsert_daily(conn, aggregate_select) -> int:
+    """Merge (user_id, day, action, event_count, first_at, last_at) rows into user_activity_daily"""
+    if conn.dialect.name == 'postgresql':
+        dialect_insert, earliest, latest = postgresql.insert, func.least, func.greatest
+    else:
+        # SQLite's multi-argument min()/max() are scalar functions
+        dialect_insert, earliest, latest = sqlite.insert, func.min, func.max
+
+    columns = ['user_id', 'day', 'action', 'event_count', 'first_at', 'last_at']
+    statement = dialect_insert(UserActivityDaily).from_select(columns, aggregate_select)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'action'],
+        set_={
+            'event_count': UserActivityDaily.event_count + statement.excluded.event_count,
+            'first_at': earliest(UserActivityDaily.first_at, statement.excluded.first_at),
+            'last_at': latest(UserActivityDaily.last_at, statement.excluded.last_at)
+        }
+    )
+    return conn.execute(statement).rowcount
+
+
+def _daily_aggregate(source, cutoff: datetime = None):
+    """Per-user daily counts from user_activities or one of its partitions"""
+    day = func.date(source.c.timestamp)
+    statement = select(
+        source.c.user_id, day.label('day'), source.c.action,
+        func.count().label('event_count'),
+        func.min(source.c.timestamp).label('first_at'),
+        func.max(source.c.timestamp).label('last_at')
+    ).group_by(source.c.user_id, day, source.c.action)
+    if cutoff is not None:
+        statement = statement.where(source.c.timestamp < cutoff)
+    return statement
+
+
+def rollup_expired_partitions(engine, cutoff_month: date) -> Dict[str, int]:
+    """Roll up and drop every monthly partition that ends on or before cutoff_month"""
+    counts = {"partitions_dropped": 0, "daily_rows_upserted": 0}
+    with engine.connect() as conn:
+        partitions = list_monthly_partitions(conn)
+
+    for name, month in sorted(partitions.items(), key=lambda item: item[1]):
+        if add_months(month, 1) > cutoff_month:
+            continue
+        partition = table(name, column('user_id'), column('action'), column('timestamp'))
+        with engine.begin() as conn:
+            counts["daily_rows_upserted"] += _upsert_daily(conn, _daily_aggregate(partition))
+            conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        counts["partitions_dropped"] += 1
+        print(f"✅ Rolled up and dropped activity partition {name}")
+    return counts
+
+
+def rollup_expired_rows(engine, cutoff: datetime) -> Dict[str, int]:
+    """Roll up and delete remaining raw rows older than cutoff"""
+    activities = UserActivity.__table__
+    with engine.begin() as conn:
+        upserted = _upsert_daily(conn, _daily_aggregate(activities, cutoff))
+        deleted = conn.execute(activities.delete().where(activities.c.timestamp < cutoff)).rowcount
+    if deleted:
+        print(f"✅ Rolled up and deleted {deleted} activity rows older than {cutoff.date()}")
+    return {"daily_rows_upserted": upserted, "rows_deleted": deleted}
+
+
+def run_activity_maintenance(engine, retention_months: int = ACTIVITY_RETENTION_MONTHS,
+                             months_ahead: int = ACTIVITY_PARTITION_MONTHS_AHEAD,
+                             today: date = None) -> Dict[str, int]:
+    """Create upcoming partitions and roll up everything past the retention window"""
+    today = today or datetime.utcnow().date()
+    cutoff_month = add_months(month_start(today), -retention_months)
+    counts = {"partitions_created": 0, "partitions_dropped": 0, "daily_rows_upserted": 0, "rows_deleted": 0}
+
+    with engine.begin() as conn:
+        partitioned = is_partitioned(conn)
+        if partitioned:
+            counts["partitions_created"] = len(create_monthly_partitions(
+                conn, month_start(today), add_months(month_start(today), months_ahead)
+            ))
+
+    if partitioned:
+        for key, value in rollup_expired_partitions(engine, cutoff_month).items():
+            counts[key] += value
+    for key, value in rollup_expired_rows(engine, datetime.combine(cutoff_month, datetime.min.time())).items():
+        counts[key] += value
+    return counts
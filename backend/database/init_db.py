@@ -7,7 +7,12 @@ from datetime import datetime
 # Add the parent directory to Python path so we can import models
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database.models import create_tables, test_connection, get_db_session, create_user, create_user_activity
+from database.models import test_connection, get_db_session, create_user, create_user_activity
+from database import migrations
+from database.activity_maintenance import (
+    ACTIVITY_PARTITION_MONTHS_AHEAD, ACTIVITY_RETENTION_MONTHS, run_activity_maintenance
+)
+from database.market_prices import refresh_market_prices
 
 def init_database():
     """Initialize the database with tables and sample data if needed"""
@@ -20,13 +25,10 @@ def init_database():
     
     print("✅ Database connection successful")
     
-    # Create tables
-    if not create_tables():
-        print("❌ Failed to create database tables")
+    # Create tables and indexes through the migrations
+    if not upgrade_database():
         return False
     
-    print("✅ Database tables created successfully")
-    
     # Create a sample user for testing if none exists
     try:
         db = get_db_session()
@@ -68,6 +70,89 @@ def init_database():
     print("🎉 Database initialization completed successfully!")
     return True
 
+def _get_engine():
+    from database.models import engine
+    if engine is None:
+        print("❌ Database connection failed. Please check your DATABASE_URL.")
+    return engine
+
+def upgrade_database(target=None):
+    """Apply pending migrations up to target (default: latest)"""
+    engine = _get_engine()
+    if engine is None:
+        return False
+    
+    try:
+        count = migrations.upgrade(engine, target)
+        print(f"✅ Applied {count} migration(s); schema is at version {max(migrations.applied_versions(engine), default=0)}")
+        return True
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+
+def downgrade_database(target=None):
+    """Revert migrations down to target (default: one step back)"""
+    engine = _get_engine()
+    if engine is None:
+        return False
+    
+    try:
+        count = migrations.downgrade(engine, target)
+        print(f"✅ Reverted {count} migration(s); schema is at version {max(migrations.applied_versions(engine), default=0)}")
+        return True
+    except Exception as e:
+        print(f"❌ Downgrade failed: {e}")
+        return False
+
+def check_database():
+    """Report pending migrations, index differences and drift from shared/schema.ts"""
+    problems = migrations.check_schema_drift()
+    
+    engine = _get_engine()
+    if engine is not None:
+        try:
+            problems += [f"migration {migration.version:04d}_{migration.name} is pending"
+                         for migration in migrations.pending_migrations(engine)]
+            problems += migrations.check_indexes(engine)
+        except Exception as e:
+            problems.append(f"could not inspect the live schema: {e}")
+    else:
+        problems.append("live schema not checked")
+    
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print("✅ Models, shared/schema.ts and the live schema agree")
+    return not problems
+
+def maintain_activities(retention_months=ACTIVITY_RETENTION_MONTHS, months_ahead=ACTIVITY_PARTITION_MONTHS_AHEAD):
+    """Create upcoming user_activities partitions and roll up rows past the retention window"""
+    engine = _get_engine()
+    if engine is None:
+        return False
+    
+    try:
+        counts = run_activity_maintenance(engine, retention_months, months_ahead)
+        print(f"✅ Activity maintenance done: {counts}")
+        return True
+    except Exception as e:
+        print(f"❌ Activity maintenance failed: {e}")
+        return False
+
+def refresh_market_price_table(full=False):
+    """Recompute the market_price_daily groups touched by changed listings (or all of them)"""
+    engine = _get_engine()
+    if engine is None:
+        return False
+    
+    try:
+        counts = refresh_market_prices(engine, full=full)
+        print(f"✅ Market price refresh done: {counts}")
+        return True
+    except Exception as e:
+        print(f"❌ Market price refresh failed: {e}")
+        return False
+
 def reset_database():
     """Drop all tables and recreate them (WARNING: This will delete all data!)"""
     print("⚠️  WARNING: This will delete all data in the database!")
@@ -82,10 +167,11 @@ def reset_database():
         
         print("Dropping all tables...")
         Base.metadata.drop_all(bind=engine)
+        migrations.schema_migrations.drop(bind=engine, checkfirst=True)
         print("✅ All tables dropped")
         
         print("Recreating tables...")
-        Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
         print("✅ All tables recreated")
         
         print("🎉 Database reset completed successfully!")
@@ -99,13 +185,36 @@ if __name__ == '__main__':
     import argparse
     
     parser = argparse.ArgumentParser(description='Database management utility')
-    parser.add_argument('command', choices=['init', 'reset'], help='Command to run')
+    parser.add_argument('command', choices=['init', 'upgrade', 'downgrade', 'check', 'maintain-activities', 'refresh-market-prices', 'reset'], help='Command to run')
+    parser.add_argument('--to', type=int, default=None, dest='target',
+                        help='Target migration version for upgrade/downgrade')
+    parser.add_argument('--retention-months', type=int, default=ACTIVITY_RETENTION_MONTHS,
+                        help='Months of raw user activity to keep (maintain-activities)')
+    parser.add_argument('--months-ahead', type=int, default=ACTIVITY_PARTITION_MONTHS_AHEAD,
+                        help='Months of user activity partitions to create ahead (maintain-activities)')
+    parser.add_argument('--full', action='store_true',
+                        help='Rebuild every group instead of only the changed ones (refresh-market-prices)')
     
     args = parser.parse_args()
     
     if args.command == 'init':
         success = init_database()
         sys.exit(0 if success else 1)
+    elif args.command == 'upgrade':
+        success = upgrade_database(args.target)
+        sys.exit(0 if success else 1)
+    elif args.command == 'downgrade':
+        success = downgrade_database(args.target)
+        sys.exit(0 if success else 1)
+    elif args.command == 'check':
+        success = check_database()
+        sys.exit(0 if success else 1)
+    elif args.command == 'maintain-activities':
+        success = maintain_activities(args.retention_months, args.months_ahead)
+        sys.exit(0 if success else 1)
+    elif args.command == 'refresh-market-prices':
+        success = refresh_market_price_table(args.full)
+        sys.exit(0 if success else 1)
     elif args.command == 'reset':
         success = reset_database()
         sys.exit(0 if success else 1)
\ No newline at end of file
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+Batched view and inquiry counters for marketplace listings.
+
+Counting each page view with its own UPDATE would take a row lock on the
+listing and write a new version of the whole row every time, so views of
+a popular listing would queue behind each other and bloat the table.
+Instead, each worker adds increments to an in-memory map of
+listing_id -> (views, inquiries). A background thread folds the map into
+listings every LISTING_COUNTER_FLUSH_INTERVAL_MS, with one batched UPDATE
+that touches each listing at most once, or sooner once
+LISTING_COUNTER_MAX_PENDING listings are waiting.
+
+Counts read from listings are eventually consistent: they trail by up to
+one flush interval. Increments that fail to flush are merged back and
+retried on the next flush; those still pending when the process dies are
+lost, which is acceptable for popularity counters. While the database is
+unreachable the map is capped at LISTING_COUNTER_MAX_TRACKED listings:
+increments for further listings are dropped (and counted) rather than let
+views of arbitrary ids grow it without bound.
+"""
+
+import atexit
+import os
+import threading
+from typing import Any, Dict
+
+from .models import get_db_session, increment_listing_counters
+
+LISTING_COUNTER_FLUSH_INTERVAL_MS = float(os.environ.get('LISTING_COUNTER_FLUSH_INTERVAL_MS', '5000'))
+LISTING_COUNTER_MAX_PENDING = int(os.environ.get('LISTING_COUNTER_MAX_PENDING', '10000'))
+LISTING_COUNTER_MAX_TRACKED = int(os.environ.get('LISTING_COUNTER_MAX_TRACKED', '50000'))
+
+
+class ListingCounterBuffer:
+    """Accumulates listing view and inquiry increments and writes them in batches"""
+
+    def __init__(self, flush_interval_ms: float = LISTING_COUNTER_FLUSH_INTERVAL_MS,
+                 max_pending: int = LISTING_COUNTER_MAX_PENDING,
+                 max_tracked: int = LISTING_COUNTER_MAX_TRACKED):
+        self.flush_interval = max(1.0, flush_interval_ms) / 1000.0
+        self.max_pending = max(1, max_pending)
+        self.max_tracked = max(self.max_pending, max_tracked)
+
+        # listing_id -> [views, inquiries]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        # Statistics
+        self._increments = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._listings_flushed = 0
+        self._dropped_counts = 0
+
+        atexit.register(self.flush)
+
+    def _ensure_worker(self):
+        """Start the flush thread, restarting it in forked gunicorn workers"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Counts gathered before a fork belong to the parent process
+                self._pending = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='listing-counters', daemon=True)
+            self._thread.start()
+
+    def increment(self, listing_id: int, views: int = 0, inquiries: int = 0):
+        """Add to a listing's counters; raises ValueError on bad input"""
+        if not listing_id or listing_id <= 0:
+            raise ValueError("Valid listing_id is required")
+        if views < 0 or inquiries < 0:
+            raise ValueError("Counter increments must not be negative")
+        self._ensure_worker()
+        with self._lock:
+            self._increments += 1
+            self._add_pending(listing_id, views, inquiries)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def _add_pending(self, listing_id: int, views: int, inquiries: int):
+        """Add to the pending map, dropping listings past max_tracked (lock held)"""
+        counts = self._pending.get(listing_id)
+        if counts is None:
+            if len(self._pending) >= self.max_tracked:
+                self._dropped_counts += views + inquiries
+                return
+            counts = self._pending[listing_id] = [0, 0]
+        counts[0] += views
+        counts[1] += inquiries
+
+    def add_view(self, listing_id: int):
+        self.increment(listing_id, views=1)
+
+    def add_inquiry(self, listing_id: int):
+        self.increment(listing_id, inquiries=1)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every pending increment in this process now"""
+        if self._pid != os.getpid():
+            return
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            db = get_db_session()
+            try:
+                if not db:
+                    raise RuntimeError("Database session not available")
+                updated = increment_listing_counters(db, pending)
+                with self._lock:
+                    self._flushes += 1
+                    self._listings_flushed += updated
+            except Exception as e:
+                print(f"❌ Listing counter flush of {len(pending)} listings failed, retrying later: {e}")
+                with self._lock:
+                    self._failed_flushes += 1
+                    for listing_id, (views, inquiries) in pending.items():
+                        self._add_pending(listing_id, views, inquiries)
+            finally:
+                if db:
+                    db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending listings and flush counters for health checks"""
+        with self._lock:
+            return {
+                "flush_interval_ms": self.flush_interval * 1000.0,
+                "pending_listings": len(self._pending),
+                "max_pending": self.max_pending,
+                "max_tracked": self.max_tracked,
+                "dropped_counts": self._dropped_counts,
+                "increments": self._increments,
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "listings_flushed": self._listings_flushed
+            }
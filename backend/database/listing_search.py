@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Server-side search over marketplace listings.
+
+search_listings() filters on status, crop, market, seller, price and
+quantity range, sorts by price, recency or views, and keyset-paginates on
+(sort column, id), so every page costs the same however deep a buyer
+scrolls. Each sort order is served by one of the
+ix_listings_status_<column>_id indexes. Crop and market are matched as
+case-insensitive substrings, because listings carry an emoji prefix
+('🌾 Wheat'); on PostgreSQL the pg_trgm GIN indexes from migration 0004
+serve those ILIKE '%...%' filters.
+"""
+
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+from .models import Listing
+
+LISTING_STATUSES = ('active', 'sold', 'expired')
+
+# sort name -> (column, descending)
+LISTING_SORTS = {
+    'recent': (Listing.posted_at, True),
+    'price_asc': (Listing.price_per_kg, False),
+    'price_desc': (Listing.price_per_kg, True),
+    'views': (Listing.views, True),
+}
+DEFAULT_LISTING_SORT = 'recent'
+MAX_LISTING_PAGE_SIZE = 100
+
+
+def _encode_sort_value(value) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _decode_sort_value(sort: str, value) -> Any:
+    if sort == 'recent':
+        return datetime.fromisoformat(value)
+    if sort in ('price_asc', 'price_desc'):
+        return Decimal(value)
+    return int(value)
+
+
+def encode_listing_cursor(sort: str, listing: Listing) -> str:
+    """Opaque cursor pointing just past a listing in the given sort order"""
+    column, _ = LISTING_SORTS[sort]
+    payload = json.dumps([sort, _encode_sort_value(getattr(listing, column.key)), listing.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_listing_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """Parse a cursor from encode_listing_cursor for the same sort, raising ValueError if it does not fit"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, listing_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if cursor_sort != sort:
+            raise ValueError
+        return _decode_sort_value(sort, value), int(listing_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _parse_amount(name: str, value) -> Optional[Decimal]:
+    if value is None or value == '':
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a number")
+    # NaN and Infinity parse, but cannot be compared or used as a bound
+    if not amount.is_finite():
+        raise ValueError(f"{name} must be a number")
+    if amount < 0:
+        raise ValueError(f"{name} must not be negative")
+    return amount
+
+
+def search_listings(db, crop: str = None, market: str = None, status: str = 'active', user_id: int = None,
+                    min_price=None, max_price=None, min_quantity_kg=None, max_quantity_kg=None,
+                    sort: str = DEFAULT_LISTING_SORT, limit: int = 20,
+                    cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of listings matching the filters
+    Returns (listings as dicts, next_cursor or None); raises ValueError on bad filters or cursor
+    """
+    if not db:
+        return [], None
+    if sort not in LISTING_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(LISTING_SORTS)}")
+    if status not in LISTING_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(LISTING_STATUSES)}")
+    if limit <= 0:
+        limit = 20
+    limit = min(limit, MAX_LISTING_PAGE_SIZE)
+
+    query = db.query(Listing).filter(Listing.status == status)
+    if crop and crop.strip():
+        query = query.filter(Listing.crop.icontains(crop.strip(), autoescape=True))
+    if market and market.strip():
+        query = query.filter(Listing.market.icontains(market.strip(), autoescape=True))
+    if user_id:
+        query = query.filter(Listing.user_id == user_id)
+
+    min_price = _parse_amount('min_price', min_price)
+    max_price = _parse_amount('max_price', max_price)
+    if min_price is not None:
+        query = query.filter(Listing.price_per_kg >= min_price)
+    if max_price is not None:
+        query = query.filter(Listing.price_per_kg <= max_price)
+    min_quantity_kg = _parse_amount('min_quantity_kg', min_quantity_kg)
+    max_quantity_kg = _parse_amount('max_quantity_kg', max_quantity_kg)
+    if min_quantity_kg is not None:
+        query = query.filter(Listing.quantity_kg >= min_quantity_kg)
+    if max_quantity_kg is not None:
+        query = query.filter(Listing.quantity_kg <= max_quantity_kg)
+
+    column, descending = LISTING_SORTS[sort]
+    if cursor:
+        value, listing_id = decode_listing_cursor(cursor, sort)
+        keyset = tuple_(column, Listing.id)
+        query = query.filter(keyset < (value, listing_id) if descending else keyset > (value, listing_id))
+    if descending:
+        query = query.order_by(column.desc(), Listing.id.desc())
+    else:
+        query = query.order_by(column.asc(), Listing.id.asc())
+
+    # One extra row is fetched to tell whether another page follows
+    listings = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(listings) > limit:
+        listings = listings[:limit]
+        next_cursor = encode_listing_cursor(sort, listings[-1])
+    return [listing.to_dict() for listing in listings], next_cursor
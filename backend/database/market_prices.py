@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+Precomputed market price statistics per crop, market and day.
+
+market_price_daily holds one row per (crop, market, kind, day) with the
+listing count, min, max, median and volume-weighted average price per kg:
+- kind 'listed': asking price_per_kg of the listings posted that day
+- kind 'sold': realised price of the listings sold that day, i.e.
+  sold_price / quantity_kg, or price_per_kg when the quantity is unknown
+
+Dashboards read only these rows, so their cost does not grow with the
+listing history. refresh_market_prices() is incremental: it finds the
+listings updated since the last run (ix_listings_updated_at), and
+recomputes just the (crop, market, kind, day) groups they belong to from
+their source rows (ix_listings_crop_market_posted_at / _sold_date).
+Medians cannot be merged from partial aggregates, so a group is always
+recomputed whole. The scan starts MARKET_PRICE_REFRESH_OVERLAP_SECONDS
+before the previous run, to catch transactions that committed late;
+recomputing a group twice is harmless.
+
+Deleted listings, and edits to a listing's crop or market, leave stale
+groups behind until a full rebuild. Run the refresh every few minutes
+and a full rebuild nightly, e.g. from cron:
+
+    cd backend && python database/init_db.py refresh-market-prices
+    cd backend && python database/init_db.py refresh-market-prices --full
+"""
+
+import os
+import statistics
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, select
+
+from .models import Listing, MarketPriceDaily, RefreshWatermark
+
+MARKET_PRICE_REFRESH_OVERLAP_SECONDS = int(os.environ.get('MARKET_PRICE_REFRESH_OVERLAP_SECONDS', '300'))
+MAX_MARKET_PRICE_DAYS = 365
+
+LISTED = 'listed'
+SOLD = 'sold'
+MARKET_PRICE_KINDS = (LISTED, SOLD)
+_WATERMARK_NAME = 'market_price_daily'
+_CENTS = Decimal('0.01')
+
+_SOURCE_COLUMNS = (
+    Listing.crop, Listing.market, Listing.status, Listing.price_per_kg, Listing.quantity_kg,
+    Listing.posted_at, Listing.sold_price, Listing.sold_date
+)
+
+
+def sold_price_per_kg(row) -> Decimal:
+    """Realised price per kg of a sold listing"""
+    if row.sold_price is not None and row.quantity_kg:
+        return Decimal(row.sold_price) / Decimal(row.quantity_kg)
+    return Decimal(row.price_per_kg)
+
+
+def _points(row) -> List[Tuple[Tuple[str, str, str, date], Tuple[Decimal, Optional[Decimal]]]]:
+    """The (group key, (price, quantity_kg)) contributions of one listing row"""
+    quantity = Decimal(row.quantity_kg) if row.quantity_kg is not None else None
+    points = []
+    if row.posted_at is not None:
+        points.append(((row.crop, row.market, LISTED, row.posted_at.date()), (Decimal(row.price_per_kg), quantity)))
+    if row.status == 'sold' and row.sold_date is not None:
+        points.append(((row.crop, row.market, SOLD, row.sold_date.date()), (sold_price_per_kg(row), quantity)))
+    return points
+
+
+def summarize_prices(points: List[Tuple[Decimal, Optional[Decimal]]]) -> Dict[str, Any]:
+    """Count, min, max, median and VWAP of (price, quantity_kg) points"""
+    prices = [price for price, _ in points]
+    weighted = [(price, quantity) for price, quantity in points if quantity]
+    total_quantity = sum((quantity for _, quantity in weighted), Decimal(0))
+    vwap = None
+    if total_quantity:
+        vwap = (sum(price * quantity for price, quantity in weighted) / total_quantity).quantize(_CENTS)
+    return {
+        "listing_count": len(prices),
+        "min_price": min(prices).quantize(_CENTS),
+        "max_price": max(prices).quantize(_CENTS),
+        "median_price": Decimal(statistics.median(prices)).quantize(_CENTS),
+        "vwap": vwap,
+        "total_quantity_kg": total_quantity.quantize(_CENTS)
+    }
+
+
+def _group_points(conn, key: Tuple[str, str, str, date]) -> List[Tuple[Decimal, Optional[Decimal]]]:
+    """Every point of one group, read through the (crop, market, day) indexes"""
+    crop, market, kind, day = key
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    day_column = Listing.posted_at if kind == LISTED else Listing.sold_date
+    rows = conn.execute(
+        select(*_SOURCE_COLUMNS).where(
+            Listing.crop == crop, Listing.market == market, day_column >= start, day_column < end
+        )
+    )
+    return [point for row in rows for point_key, point in _points(row) if point_key == key]
+
+
+def _write_group(conn, key: Tuple[str, str, str, date], points, now: datetime):
+    crop, market, kind, day = key
+    table = MarketPriceDaily.__table__
+    conn.execute(table.delete().where(
+        table.c.crop == crop, table.c.market == market, table.c.kind == kind, table.c.day == day
+    ))
+    if points:
+        conn.execute(table.insert().values(crop=crop, market=market, kind=kind, day=day, refreshed_at=now,
+                                           **summarize_prices(points)))
+
+
+def _set_watermark(conn, watermark: datetime):
+    table = RefreshWatermark.__table__
+    conn.execute(table.delete().where(table.c.name == _WATERMARK_NAME))
+    conn.execute(table.insert().values(name=_WATERMARK_NAME, watermark=watermark, updated_at=datetime.utcnow()))
+
+
+def refresh_market_prices(engine, full: bool = False) -> Dict[str, int]:
+    """Bring market_price_daily up to date; full=True rebuilds it from every listing"""
+    started_at = datetime.utcnow()
+    with engine.begin() as conn:
+        if full:
+            groups = defaultdict(list)
+            scanned = 0
+            for row in conn.execute(select(*_SOURCE_COLUMNS)):
+                scanned += 1
+                for key, point in _points(row):
+                    groups[key].append(point)
+            conn.execute(MarketPriceDaily.__table__.delete())
+            for key, points in groups.items():
+                _write_group(conn, key, points, started_at)
+            _set_watermark(conn, started_at)
+            print(f"✅ Rebuilt market prices: {len(groups)} groups")
+            return {"groups_refreshed": len(groups), "listings_scanned": scanned}
+
+        watermark = conn.execute(
+            select(RefreshWatermark.watermark).where(RefreshWatermark.name == _WATERMARK_NAME)
+        ).scalar()
+        changed = select(*_SOURCE_COLUMNS)
+        if watermark is not None:
+            changed = changed.where(
+                Listing.updated_at > watermark - timedelta(seconds=MARKET_PRICE_REFRESH_OVERLAP_SECONDS)
+            )
+        keys = set()
+        scanned = 0
+        for row in conn.execute(changed):
+            scanned += 1
+            keys.update(key for key, _ in _points(row))
+
+        for key in sorted(keys):
+            _write_group(conn, key, _group_points(conn, key), started_at)
+        _set_watermark(conn, started_at)
+    if keys:
+        print(f"✅ Refreshed {len(keys)} market price groups from {scanned} changed listings")
+    return {"groups_refreshed": len(keys), "listings_scanned": scanned}
+
+
+def get_market_prices(db, crop: str = None, market: str = None, kind: str = SOLD, days: int = 30,
+                      today: date = None) -> List[Dict[str, Any]]:
+    """
+    Daily price series and a window summary for each matching (crop, market)
+    crop and market match case-insensitive substrings; raises ValueError on bad arguments
+    """
+    if not db:
+        return []
+    if kind not in MARKET_PRICE_KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(MARKET_PRICE_KINDS)}")
+    if days <= 0 or days > MAX_MARKET_PRICE_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_MARKET_PRICE_DAYS}")
+
+    today = today or datetime.utcnow().date()
+    conditions = [MarketPriceDaily.kind == kind, MarketPriceDaily.day > today - timedelta(days=days)]
+    if crop and crop.strip():
+        conditions.append(MarketPriceDaily.crop.icontains(crop.strip(), autoescape=True))
+    if market and market.strip():
+        conditions.append(MarketPriceDaily.market.icontains(market.strip(), autoescape=True))
+    rows = db.query(MarketPriceDaily).filter(and_(*conditions))\
+             .order_by(MarketPriceDaily.crop, MarketPriceDaily.market, MarketPriceDaily.day).all()
+
+    series = defaultdict(list)
+    for row in rows:
+        series[(row.crop, row.market)].append(row)
+
+    results = []
+    for (crop_name, market_name), daily in series.items():
+        weighted = [row for row in daily if row.vwap is not None and row.total_quantity_kg]
+        total_quantity = sum((row.total_quantity_kg for row in weighted), Decimal(0))
+        vwap = None
+        if total_quantity:
+            vwap = float((sum(row.vwap * row.total_quantity_kg for row in weighted) / total_quantity).quantize(_CENTS))
+        results.append({
+            "crop": crop_name,
+            "market": market_name,
+            "kind": kind,
+            "summary": {
+                "days_with_data": len(daily),
+                "listing_count": sum(row.listing_count for row in daily),
+                "min_price": float(min(row.min_price for row in daily)),
+                "max_price": float(max(row.max_price for row in daily)),
+                "vwap": vwap,
+                "latest_median_price": float(daily[-1].median_price),
+                "total_quantity_kg": float(total_quantity)
+            },
+            "daily": [row.to_dict() for row in daily]
+        })
+    return results
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+
+"""
+Versioned schema migrations and schema checks.
+
+Applied versions are recorded in the schema_migrations table. Each
+migration is a list of steps, run in order by upgrade() and undone in
+reverse by downgrade(). Steps are written to be idempotent (IF NOT EXISTS /
+IF EXISTS), so a migration interrupted halfway can simply be run again.
+
+Indexes are built with CREATE INDEX CONCURRENTLY on PostgreSQL, which does
+not block writes but cannot run inside a transaction; those steps run on
+an autocommit connection, and an INVALID index left behind by a failed
+concurrent build is dropped and rebuilt.
+
+check_indexes() compares the indexes declared on the models with the live
+database, and check_schema_drift() compares the models with the Drizzle
+schema in shared/schema.ts, which defines the same tables for the frontend
+tooling.
+
+    cd backend && python database/init_db.py upgrade
+    cd backend && python database/init_db.py check
+"""
+
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Integer, JSON, LargeBinary, MetaData, Numeric, String, Table, Text,
+    bindparam, inspect, select, text, update
+)
+
+from .activity_maintenance import (
+    ACTIVITY_PARTITION_MONTHS_AHEAD, add_months, create_monthly_partitions, is_partitioned, month_start
+)
+from .models import Base, normalize_phone, parse_posted_date, parse_quantity_kg
+
+SCHEMA_TS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              'shared', 'schema.ts')
+
+_migration_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', DateTime, default=datetime.utcnow, nullable=False)
+)
+
+
+class Step:
+    """One migration step; apply() and revert() get the engine"""
+
+    def apply(self, engine):
+        raise NotImplementedError
+
+    def revert(self, engine):
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return self.__class__.__name__
+
+
+class CreateTables(Step):
+    """Create every model table that does not exist yet"""
+
+    def apply(self, engine):
+        Base.metadata.create_all(bind=engine)
+
+    def revert(self, engine):
+        raise RuntimeError("The baseline migration cannot be downgraded; use 'init_db.py reset' instead")
+
+    def describe(self) -> str:
+        return "create missing tables"
+
+
+class CreateTable(Step):
+    """Create (or on revert drop) one model table"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def apply(self, engine):
+        Base.metadata.tables[self.name].create(bind=engine, checkfirst=True)
+
+    def revert(self, engine):
+        Base.metadata.tables[self.name].drop(bind=engine, checkfirst=True)
+
+    def describe(self) -> str:
+        return f"table {self.name}"
+
+
+class AddColumn(Step):
+    """Add (or on revert drop) one model column, as nullable, if it is missing"""
+
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+
+    def _exists(self, engine) -> bool:
+        return self.column in {column['name'] for column in inspect(engine).get_columns(self.table)}
+
+    def apply(self, engine):
+        if self._exists(engine):
+            return
+        column_type = Base.metadata.tables[self.table].c[self.column].type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN {self.column} {column_type}"))
+
+    def revert(self, engine):
+        if not self._exists(engine):
+            return
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {self.table} DROP COLUMN {self.column}"))
+
+    def describe(self) -> str:
+        return f"column {self.table}.{self.column}"
+
+
+class SQL(Step):
+    """Raw SQL in a transaction, optionally PostgreSQL only"""
+
+    def __init__(self, upgrade_sql: str, downgrade_sql: Optional[str] = None, postgresql_only: bool = False):
+        self.upgrade_sql = upgrade_sql
+        self.downgrade_sql = downgrade_sql
+        self.postgresql_only = postgresql_only
+
+    def _run(self, engine, statement: Optional[str]):
+        if not statement or (self.postgresql_only and engine.dialect.name != 'postgresql'):
+            return
+        with engine.begin() as conn:
+            conn.execute(text(statement))
+
+    def apply(self, engine):
+        self._run(engine, self.upgrade_sql)
+
+    def revert(self, engine):
+        self._run(engine, self.downgrade_sql)
+
+    def describe(self) -> str:
+        return ' '.join(self.upgrade_sql.split())[:80]
+
+
+class CreateIndex(Step):
+    """CREATE INDEX, CONCURRENTLY on PostgreSQL"""
+
+    def __init__(self, name: str, table: str, columns: List[str], using: Optional[str] = None,
+                 unique: bool = False, postgresql_only: bool = False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.using = using
+        self.unique = unique
+        self.postgresql_only = postgresql_only
+
+    def apply(self, engine):
+        if self.postgresql_only and engine.dialect.name != 'postgresql':
+            return
+        unique = 'UNIQUE ' if self.unique else ''
+        columns = ', '.join(self.columns)
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE {unique}INDEX IF NOT EXISTS {self.name} ON {self.table} ({columns})"))
+            return
+
+        using = f" USING {self.using}" if self.using else ''
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would skip
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": self.name}).first()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+            conn.execute(text(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table}{using} ({columns})"
+            ))
+
+    def revert(self, engine):
+        if self.postgresql_only and engine.dialect.name != 'postgresql':
+            return
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {self.name}"))
+            return
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+
+    def describe(self) -> str:
+        return f"index {self.name} on {self.table} ({', '.join(self.columns)})"
+
+
+class PartitionUserActivities(Step):
+    """
+    Rebuild user_activities as a table range-partitioned by month on timestamp (PostgreSQL)
+
+    The rows are copied into the new table in one transaction, which holds an
+    exclusive lock on user_activities until it commits. The primary key becomes
+    (id, timestamp), since a partitioned table's unique keys must include the
+    partition key, and the id sequence is carried over. Indexes are created on
+    the parent without CONCURRENTLY, which partitioned tables do not support;
+    each partition gets its own local copy. Other databases only get the
+    plain timestamp index.
+    """
+
+    _COLUMNS = 'id, user_id, action, data, "timestamp"'
+    _INDEXES = (
+        'CREATE INDEX IF NOT EXISTS ix_user_activities_user_id_timestamp ON user_activities (user_id, "timestamp")',
+        'CREATE INDEX IF NOT EXISTS ix_user_activities_timestamp_brin ON user_activities USING brin ("timestamp")'
+    )
+
+    def _create_table(self, conn, primary_key: str, partition_clause: str = ''):
+        conn.execute(text(f"""
+            CREATE TABLE user_activities (
+                id INTEGER NOT NULL DEFAULT nextval('user_activities_id_seq'),
+                user_id INTEGER NOT NULL REFERENCES users (id),
+                action VARCHAR(100) NOT NULL,
+                data JSON,
+                "timestamp" TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                PRIMARY KEY ({primary_key})
+            ){partition_clause}
+        """))
+        conn.execute(text("ALTER SEQUENCE user_activities_id_seq OWNED BY user_activities.id"))
+
+    def _swap(self, conn, old_name: str, primary_key: str, partition_clause: str = '', before_copy=None):
+        """Rename user_activities to old_name, recreate it, copy the rows across and drop old_name"""
+        conn.execute(text(f"ALTER TABLE user_activities RENAME TO {old_name}"))
+        conn.execute(text(f"ALTER TABLE {old_name} RENAME CONSTRAINT user_activities_pkey TO {old_name}_pkey"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_user_activities_user_id_timestamp"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_user_activities_timestamp_brin"))
+        self._create_table(conn, primary_key, partition_clause)
+        if before_copy:
+            before_copy(conn, old_name)
+        conn.execute(text(f"INSERT INTO user_activities ({self._COLUMNS}) SELECT {self._COLUMNS} FROM {old_name}"))
+        conn.execute(text(f"DROP TABLE {old_name}"))
+        for statement in self._INDEXES:
+            conn.execute(text(statement))
+
+    @staticmethod
+    def _create_partitions(conn, old_name: str):
+        conn.execute(text("CREATE TABLE user_activities_default PARTITION OF user_activities DEFAULT"))
+        oldest = conn.execute(text(f'SELECT min("timestamp") FROM {old_name}')).scalar()
+        this_month = month_start(datetime.utcnow().date())
+        first_month = month_start(oldest.date()) if oldest else this_month
+        create_monthly_partitions(conn, first_month, add_months(this_month, ACTIVITY_PARTITION_MONTHS_AHEAD))
+
+    def apply(self, engine):
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_activities_timestamp_brin '
+                                  'ON user_activities ("timestamp")'))
+            return
+        with engine.begin() as conn:
+            if is_partitioned(conn):
+                return
+            self._swap(conn, 'user_activities_unpartitioned', 'id, "timestamp"',
+                       ' PARTITION BY RANGE ("timestamp")', self._create_partitions)
+
+    def revert(self, engine):
+        if engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text("DROP INDEX IF EXISTS ix_user_activities_timestamp_brin"))
+            return
+        with engine.begin() as conn:
+            if not is_partitioned(conn):
+                return
+            self._swap(conn, 'user_activities_partitioned', 'id')
+            # The plain table had no BRIN index before this migration
+            conn.execute(text("DROP INDEX IF EXISTS ix_user_activities_timestamp_brin"))
+
+    def describe(self) -> str:
+        return "partition user_activities by month on timestamp"
+
+
+class BackfillListingFields(Step):
+    """Fill listings.quantity_kg and posted_at from the free-text quantity and posted_date"""
+
+    BATCH_SIZE = 1000
+
+    def apply(self, engine):
+        listings = Base.metadata.tables['listings']
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(listings.c.id, listings.c.quantity, listings.c.posted_date, listings.c.created_at)
+                    .where(listings.c.id > last_id, listings.c.posted_at.is_(None))
+                    .order_by(listings.c.id).limit(self.BATCH_SIZE)
+                ).all()
+                if not rows:
+                    return
+                # Relative dates ('3 days ago') are resolved against when the listing was created
+                conn.execute(
+                    update(listings).where(listings.c.id == bindparam('listing_id')),
+                    [{"listing_id": row.id, "quantity_kg": parse_quantity_kg(row.quantity),
+                      "posted_at": parse_posted_date(row.posted_date, row.created_at)} for row in rows]
+                )
+            last_id = rows[-1].id
+
+    def revert(self, engine):
+        pass  # The columns themselves are dropped by the AddColumn steps
+
+    def describe(self) -> str:
+        return "parse listings.quantity and posted_date"
+
+
+class NormalizeUserPhones(Step):
+    """Rewrite users.phone saved before normalisation ('98765 43210', '919876543210') to the +91 form"""
+
+    def apply(self, engine):
+        users = Base.metadata.tables['users']
+        with engine.begin() as conn:
+            rows = conn.execute(select(users.c.id, users.c.phone)).all()
+            taken = {row.phone for row in rows}
+            changes = []
+            skipped = 0
+            for row in rows:
+                normalized = normalize_phone(row.phone)
+                if not normalized or normalized == row.phone:
+                    continue
+                if normalized in taken:
+                    skipped += 1  # Another account already holds the canonical number
+                    continue
+                taken.add(normalized)
+                changes.append({"user_id": row.id, "phone": normalized})
+            if changes:
+                conn.execute(update(users).where(users.c.id == bindparam('user_id')), changes)
+        if skipped:
+            print(f"⚠️ {skipped} phone number(s) left as stored because the normalised number is already in use")
+
+    def revert(self, engine):
+        pass  # The original spellings are not kept; normalised numbers stay valid
+
+    def describe(self) -> str:
+        return "normalise users.phone"
+
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: List[Step]):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+
+MIGRATIONS = [
+    Migration(1, 'baseline', [
+        CreateTables()
+    ]),
+    Migration(2, 'query_indexes', [
+        CreateIndex('ix_diagnoses_user_id_created_at', 'diagnoses', ['user_id', 'created_at', 'id']),
+        CreateIndex('ix_user_activities_user_id_timestamp', 'user_activities', ['user_id', 'timestamp']),
+        CreateIndex('ix_listings_status_crop_market', 'listings', ['status', 'crop', 'market'])
+    ]),
+    Migration(3, 'partition_user_activities', [
+        CreateTable('user_activity_daily'),
+        PartitionUserActivities()
+    ]),
+    Migration(4, 'listing_search', [
+        AddColumn('listings', 'quantity_kg'),
+        AddColumn('listings', 'posted_at'),
+        BackfillListingFields(),
+        SQL("ALTER TABLE listings ALTER COLUMN posted_at SET NOT NULL",
+            "ALTER TABLE listings ALTER COLUMN posted_at DROP NOT NULL", postgresql_only=True),
+        CreateIndex('ix_listings_status_price_id', 'listings', ['status', 'price_per_kg', 'id']),
+        CreateIndex('ix_listings_status_posted_at_id', 'listings', ['status', 'posted_at', 'id']),
+        CreateIndex('ix_listings_status_views_id', 'listings', ['status', 'views', 'id']),
+        SQL("CREATE EXTENSION IF NOT EXISTS pg_trgm", postgresql_only=True),
+        CreateIndex('ix_listings_crop_trgm', 'listings', ['crop gin_trgm_ops'], using='gin', postgresql_only=True),
+        CreateIndex('ix_listings_market_trgm', 'listings', ['market gin_trgm_ops'], using='gin',
+                    postgresql_only=True)
+    ]),
+    Migration(5, 'market_price_daily', [
+        CreateTable('market_price_daily'),
+        CreateTable('refresh_watermarks'),
+        CreateIndex('ix_market_price_daily_day', 'market_price_daily', ['day']),
+        CreateIndex('ix_listings_updated_at', 'listings', ['updated_at']),
+        CreateIndex('ix_listings_crop_market_posted_at', 'listings', ['crop', 'market', 'posted_at']),
+        CreateIndex('ix_listings_crop_market_sold_date', 'listings', ['crop', 'market', 'sold_date'])
+    ]),
+    Migration(6, 'diagnosis_top_k', [
+        AddColumn('diagnoses', 'top_k')
+    ]),
+    Migration(7, 'chat_conversations', [
+        CreateTable('chat_conversations')
+    ]),
+    Migration(8, 'normalize_user_phones', [
+        NormalizeUserPhones()
+    ]),
+]
+
+
+def _ensure_migrations_table(engine):
+    _migration_metadata.create_all(bind=engine)
+
+
+def applied_versions(engine) -> List[int]:
+    """Versions recorded in schema_migrations, oldest first"""
+    _ensure_migrations_table(engine)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(schema_migrations.select().order_by(schema_migrations.c.version))]
+
+
+def pending_migrations(engine) -> List[Migration]:
+    applied = set(applied_versions(engine))
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def warn_if_pending(engine):
+    """Print a warning at startup when the schema is behind the code"""
+    try:
+        pending = pending_migrations(engine)
+    except Exception as e:
+        print(f"⚠️ Could not check schema migrations: {e}")
+        return
+    if pending:
+        names = ', '.join(f"{migration.version:04d}_{migration.name}" for migration in pending)
+        print(f"⚠️ Pending schema migrations: {names} - run 'python database/init_db.py upgrade'")
+
+
+def upgrade(engine, target: Optional[int] = None) -> int:
+    """Apply pending migrations up to target (default: latest); returns how many were applied"""
+    count = 0
+    for migration in pending_migrations(engine):
+        if target is not None and migration.version > target:
+            break
+        print(f"⬆️  Applying migration {migration.version:04d}_{migration.name}")
+        for step in migration.steps:
+            print(f"   - {step.describe()}")
+            step.apply(engine)
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+            ))
+        count += 1
+    return count
+
+
+def downgrade(engine, target: Optional[int] = None) -> int:
+    """Revert applied migrations down to target (default: one step back); returns how many were reverted"""
+    applied = applied_versions(engine)
+    if not applied:
+        return 0
+    if target is None:
+        target = applied[-2] if len(applied) > 1 else 0
+
+    by_version = {migration.version: migration for migration in MIGRATIONS}
+    count = 0
+    for version in reversed(applied):
+        if version <= target:
+            break
+        migration = by_version.get(version)
+        if migration is None:
+            raise RuntimeError(f"Migration {version} is applied but not defined in this code")
+        print(f"⬇️  Reverting migration {migration.version:04d}_{migration.name}")
+        for step in reversed(migration.steps):
+            print(f"   - {step.describe()}")
+            step.revert(engine)
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.delete().where(schema_migrations.c.version == version))
+        count += 1
+    return count
+
+
+def declared_indexes() -> Dict[str, Tuple[str, Tuple[str, ...]]]:
+    """index name -> (table, columns) for every index declared on the models"""
+    indexes = {}
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            indexes[index.name] = (table.name, tuple(column.name for column in index.columns))
+    return indexes
+
+
+def check_indexes(engine) -> List[str]:
+    """Differences between the declared indexes and the live database"""
+    problems = []
+    inspector = inspect(engine)
+    live_tables = set(inspector.get_table_names())
+    live = {}
+    for table_name in {table for table, _ in declared_indexes().values()}:
+        if table_name not in live_tables:
+            problems.append(f"table {table_name} does not exist")
+            continue
+        for index in inspector.get_indexes(table_name):
+            live[index['name']] = (table_name, tuple(index['column_names']))
+
+    for name, (table_name, columns) in declared_indexes().items():
+        if table_name not in live_tables:
+            continue
+        if name not in live:
+            problems.append(f"index {name} on {table_name} ({', '.join(columns)}) is missing")
+        elif live[name][1] != columns:
+            problems.append(f"index {name} covers ({', '.join(live[name][1])}), declared ({', '.join(columns)})")
+    return problems
+
+
+# Drizzle column builders mapped to coarse type families shared with SQLAlchemy
+_DRIZZLE_TYPES = {
+    'serial': 'integer', 'integer': 'integer', 'varchar': 'string', 'text': 'text', 'decimal': 'numeric',
+    'timestamp': 'datetime', 'date': 'date', 'json': 'json', 'jsonb': 'json', 'boolean': 'boolean', 'bytea': 'binary'
+}
+
+_TABLE_RE = re.compile(r"export const (\w+) = pgTable\('(\w+)', \{(.*?)\n\}(.*?)\);", re.S)
+_COLUMN_RE = re.compile(r"^\s*(\w+): (\w+)\('(\w+)'(.*?),?$", re.M)
+_INDEX_RE = re.compile(r"(?:uniqueIndex|index)\('(\w+)'\)\.(?:on\(|using\('\w+',\s*)([^)]*)\)")
+
+
+def _sqlalchemy_type_family(column) -> str:
+    column_type = column.type
+    if isinstance(column_type, Text):
+        return 'text'
+    if isinstance(column_type, String):
+        return 'string'
+    if isinstance(column_type, Boolean):
+        return 'boolean'
+    if isinstance(column_type, Integer):
+        return 'integer'
+    if isinstance(column_type, Numeric):
+        return 'numeric'
+    if isinstance(column_type, DateTime):
+        return 'datetime'
+    if isinstance(column_type, Date):
+        return 'date'
+    if isinstance(column_type, JSON):
+        return 'json'
+    if isinstance(column_type, LargeBinary):
+        return 'binary'
+    return column_type.__class__.__name__.lower()
+
+
+def parse_drizzle_schema(source: str) -> Dict[str, Dict]:
+    """
+    Tables from a Drizzle schema file:
+    table -> {"columns": {name: (type family, not_null)}, "indexes": {name: columns}}
+    """
+    tables = {}
+    for _, table_name, body, extras in _TABLE_RE.findall(source):
+        columns = {}
+        property_to_column = {}
+        for property_name, builder, column_name, modifiers in _COLUMN_RE.findall(body):
+            family = _DRIZZLE_TYPES.get(builder, builder)
+            not_null = '.notNull()' in modifiers or '.primaryKey()' in modifiers
+            columns[column_name] = (family, not_null)
+            property_to_column[property_name] = column_name
+
+        indexes = {}
+        for index_name, on_args in _INDEX_RE.findall(extras):
+            index_columns = [arg.strip().split('.')[-1] for arg in on_args.split(',') if arg.strip()]
+            indexes[index_name] = tuple(property_to_column.get(column, column) for column in index_columns)
+        tables[table_name] = {"columns": columns, "indexes": indexes}
+    return tables
+
+
+def check_schema_drift(schema_path: str = SCHEMA_TS_PATH) -> List[str]:
+    """Differences between the SQLAlchemy models and shared/schema.ts"""
+    try:
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            drizzle_tables = parse_drizzle_schema(f.read())
+    except OSError as e:
+        return [f"cannot read {schema_path}: {e}"]
+
+    problems = []
+    model_tables = {table.name: table for table in Base.metadata.sorted_tables}
+    for table_name in sorted(set(model_tables) - set(drizzle_tables)):
+        problems.append(f"table {table_name} is in the models but not in schema.ts")
+    for table_name in sorted(set(drizzle_tables) - set(model_tables)):
+        problems.append(f"table {table_name} is in schema.ts but not in the models")
+
+    for table_name in sorted(set(model_tables) & set(drizzle_tables)):
+        table = model_tables[table_name]
+        drizzle = drizzle_tables[table_name]
+        model_columns = {column.name: (_sqlalchemy_type_family(column), not column.nullable) for column in table.columns}
+
+        for column_name in sorted(set(model_columns) - set(drizzle["columns"])):
+            problems.append(f"{table_name}.{column_name} is in the models but not in schema.ts")
+        for column_name in sorted(set(drizzle["columns"]) - set(model_columns)):
+            problems.append(f"{table_name}.{column_name} is in schema.ts but not in the models")
+        for column_name in sorted(set(model_columns) & set(drizzle["columns"])):
+            model_family, model_not_null = model_columns[column_name]
+            drizzle_family, drizzle_not_null = drizzle["columns"][column_name]
+            if model_family != drizzle_family:
+                problems.append(f"{table_name}.{column_name} is {model_family} in the models, {drizzle_family} in schema.ts")
+            if model_not_null != drizzle_not_null:
+                problems.append(f"{table_name}.{column_name} is {'NOT NULL' if model_not_null else 'nullable'} in the models, "
+                                f"{'NOT NULL' if drizzle_not_null else 'nullable'} in schema.ts")
+
+        model_indexes = {index.name: tuple(column.name for column in index.columns) for index in table.indexes}
+        for index_name in sorted(set(model_indexes) - set(drizzle["indexes"])):
+            problems.append(f"index {index_name} is in the models but not in schema.ts")
+        for index_name in sorted(set(drizzle["indexes"]) - set(model_indexes)):
+            problems.append(f"index {index_name} is in schema.ts but not in the models")
+        for index_name in sorted(set(model_indexes) & set(drizzle["indexes"])):
+            if model_indexes[index_name] != drizzle["indexes"][index_name]:
+                problems.append(f"index {index_name} columns differ between the models and schema.ts")
+    return problems
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, Numeric, ForeignKey, JSON, text
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, Date, Boolean, Numeric, ForeignKey, JSON, LargeBinary, text, insert, update, bindparam, UniqueConstraint, Index, tuple_, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.dialects.postgresql import UUID
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import base64
+import json
+import re
+import struct
 import uuid
 import os
 from dotenv import load_dotenv
@@ -48,6 +54,20 @@ class User(Base):
 
 class Listing(Base):
     __tablename__ = 'listings'
+    __table_args__ = (
+        # Marketplace browsing filters on status first, then crop and market
+        Index('ix_listings_status_crop_market', 'status', 'crop', 'market'),
+        # One index per search sort order, with id as the keyset tie-breaker
+        Index('ix_listings_status_price_id', 'status', 'price_per_kg', 'id'),
+        Index('ix_listings_status_posted_at_id', 'status', 'posted_at', 'id'),
+        Index('ix_listings_status_views_id', 'status', 'views', 'id'),
+        # Substring search on crop and market uses pg_trgm GIN indexes that only
+        # exist on PostgreSQL and are created by migration 0004, not declared here
+        # Market price refresh: changed listings, then all listings of one (crop, market, day)
+        Index('ix_listings_updated_at', 'updated_at'),
+        Index('ix_listings_crop_market_posted_at', 'crop', 'market', 'posted_at'),
+        Index('ix_listings_crop_market_sold_date', 'crop', 'market', 'sold_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -61,6 +81,9 @@ class Listing(Base):
     total_price = Column(Numeric(12, 2), nullable=False)
     status = Column(String(20), default='active', nullable=False)  # active, sold, expired
     posted_date = Column(String(50), nullable=False)
+    # Parsed from the free-text quantity and posted_date by create_listing
+    quantity_kg = Column(Numeric(12, 2))
+    posted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     sold_date = Column(DateTime)
     sold_price = Column(Numeric(12, 2))
     buyer = Column(String(255))
@@ -84,6 +107,8 @@ class Listing(Base):
             'total_price': float(self.total_price) if self.total_price else None,
             'status': self.status,
             'posted_date': self.posted_date,
+            'quantity_kg': float(self.quantity_kg) if self.quantity_kg is not None else None,
+            'posted_at': self.posted_at.isoformat() if self.posted_at else None,
             'sold_date': self.sold_date.isoformat() if self.sold_date else None,
             'sold_price': float(self.sold_price) if self.sold_price else None,
             'buyer': self.buyer,
@@ -93,6 +118,10 @@ class Listing(Base):
 
 class Diagnosis(Base):
     __tablename__ = 'diagnoses'
+    __table_args__ = (
+        # Serves per-user history newest first, with id as the keyset tie-breaker
+        Index('ix_diagnoses_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -102,6 +131,8 @@ class Diagnosis(Base):
     treatment = Column(Text, nullable=False)
     date = Column(DateTime, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Top-k (label id, calibrated probability) pairs, packed with pack_top_k
+    top_k = Column(LargeBinary, nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="diagnoses")
@@ -115,7 +146,8 @@ class Diagnosis(Base):
             'confidence': self.confidence,
             'treatment': self.treatment,
             'date': self.date.isoformat() if self.date else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'top_k': unpack_top_k(self.top_k)
         }
 
 class AdvisoryRecord(Base):
@@ -144,7 +176,17 @@ class AdvisoryRecord(Base):
         }
 
 class UserActivity(Base):
+    """
+    Append-only activity log. On PostgreSQL migration 0003 turns this into a table
+    range-partitioned by month on timestamp, with primary key (id, timestamp);
+    old months are rolled up into UserActivityDaily (see activity_maintenance.py)
+    """
     __tablename__ = 'user_activities'
+    __table_args__ = (
+        Index('ix_user_activities_user_id_timestamp', 'user_id', 'timestamp'),
+        # Timestamps arrive in order, so a BRIN index covers time ranges at a tiny fraction of a btree's size
+        Index('ix_user_activities_timestamp_brin', 'timestamp', postgresql_using='brin'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -164,6 +206,123 @@ class UserActivity(Base):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
 
+class UserActivityDaily(Base):
+    """Per-user daily activity counts that replace raw UserActivity rows past the retention window"""
+    __tablename__ = 'user_activity_daily'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    action = Column(String(100), primary_key=True)
+    event_count = Column(Integer, nullable=False)
+    first_at = Column(DateTime, nullable=False)
+    last_at = Column(DateTime, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'day': self.day.isoformat() if self.day else None,
+            'action': self.action,
+            'event_count': self.event_count,
+            'first_at': self.first_at.isoformat() if self.first_at else None,
+            'last_at': self.last_at.isoformat() if self.last_at else None
+        }
+
+class TreatmentCacheEntry(Base):
+    __tablename__ = 'treatment_cache'
+    __table_args__ = (
+        UniqueConstraint('disease_key', 'prompt_version', name='uq_treatment_cache_disease_version'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    disease_key = Column(String(255), nullable=False)
+    prompt_version = Column(Integer, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'disease_key': self.disease_key,
+            'prompt_version': self.prompt_version,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class ChatConversation(Base):
+    """
+    Chat memory of one user, maintained by conversation_memory.py
+    turns holds the latest messages verbatim, summary everything older; revision guards concurrent writers
+    """
+    __tablename__ = 'chat_conversations'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    summary = Column(Text)
+    turns = Column(JSON, nullable=False)
+    revision = Column(Integer, nullable=False)
+    # Running token totals over every chat request of the user
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'summary': self.summary,
+            'turns': self.turns,
+            'revision': self.revision,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class MarketPriceDaily(Base):
+    """
+    Price statistics per (crop, market, kind, day), maintained by database/market_prices.py
+    kind 'listed' covers asking prices of listings posted that day, 'sold' the
+    realised prices of listings sold that day; prices are per kg
+    """
+    __tablename__ = 'market_price_daily'
+    __table_args__ = (
+        Index('ix_market_price_daily_day', 'day'),
+    )
+    
+    crop = Column(String(100), primary_key=True)
+    market = Column(String(255), primary_key=True)
+    kind = Column(String(10), primary_key=True)
+    day = Column(Date, primary_key=True)
+    listing_count = Column(Integer, nullable=False)
+    min_price = Column(Numeric(10, 2), nullable=False)
+    max_price = Column(Numeric(10, 2), nullable=False)
+    median_price = Column(Numeric(10, 2), nullable=False)
+    # Volume-weighted average over the listings whose quantity could be parsed
+    vwap = Column(Numeric(10, 2))
+    total_quantity_kg = Column(Numeric(14, 2), nullable=False)
+    refreshed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'crop': self.crop,
+            'market': self.market,
+            'kind': self.kind,
+            'day': self.day.isoformat() if self.day else None,
+            'listing_count': self.listing_count,
+            'min_price': float(self.min_price) if self.min_price is not None else None,
+            'max_price': float(self.max_price) if self.max_price is not None else None,
+            'median_price': float(self.median_price) if self.median_price is not None else None,
+            'vwap': float(self.vwap) if self.vwap is not None else None,
+            'total_quantity_kg': float(self.total_quantity_kg) if self.total_quantity_kg is not None else None
+        }
+
+class RefreshWatermark(Base):
+    """How far an incremental refresh job has read its source table"""
+    __tablename__ = 'refresh_watermarks'
+    
+    name = Column(String(100), primary_key=True)
+    watermark = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
 # Database configuration and session management
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
@@ -174,7 +333,7 @@ DB_AVAILABLE = False
 
 def _ensure_ssl_in_database_url(database_url: str) -> str:
     """Ensure DATABASE_URL includes proper SSL configuration for Supabase"""
-    if not database_url:
+    if not database_url or not database_url.startswith(('postgres://', 'postgresql')):
         return database_url
     
     # Add SSL mode for Supabase/PostgreSQL if not present
@@ -184,6 +343,20 @@ def _ensure_ssl_in_database_url(database_url: str) -> str:
     
     return database_url
 
+def _use_explicit_sqlite_transactions(sqlite_engine):
+    """
+    Let SQLAlchemy emit BEGIN itself on SQLite (local development)
+    pysqlite otherwise starts transactions lazily, so releasing a savepoint (see save_chat_conversation)
+    would commit the whole transaction
+    """
+    @event.listens_for(sqlite_engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
 def _initialize_database():
     """Initialize database connection with proper error handling"""
     global engine, SessionLocal, DB_AVAILABLE
@@ -206,6 +379,8 @@ def _initialize_database():
             pool_pre_ping=True,  # Enable connection health checks
             echo=False  # Set to True for SQL debugging
         )
+        if engine.dialect.name == 'sqlite':
+            _use_explicit_sqlite_transactions(engine)
         
         # Create session factory
         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -309,8 +484,39 @@ def _validate_user_input(name: str, phone: str, location: str, state: str) -> li
     
     return errors
 
-def create_user(db, name: str, phone: str, location: str, state: str, avatar: str = None) -> User:
-    """Create a new user with proper validation and error handling"""
+def normalize_phone(phone: str) -> str:
+    """
+    Canonical form of a phone number accepted by _validate_user_input
+    10-digit and 91-prefixed Indian numbers become +91XXXXXXXXXX; other numbers are only stripped of separators
+    """
+    if not phone:
+        return ''
+    cleaned = phone.strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+    if cleaned.startswith('+'):
+        return cleaned
+    if len(cleaned) == 12 and cleaned.startswith('91') and cleaned.isdigit():
+        return '+' + cleaned
+    if len(cleaned) == 10 and cleaned.isdigit():
+        return '+91' + cleaned
+    return cleaned
+
+def phone_variants(phone: str) -> list:
+    """Stored spellings that normalise to the same number, for rows saved before normalisation"""
+    normalized = normalize_phone(phone)
+    variants = [normalized]
+    if normalized.startswith('+91') and len(normalized) == 13:
+        variants += [normalized[1:], normalized[3:]]
+    stripped = (phone or '').strip()
+    if stripped and stripped not in variants:
+        variants.append(stripped)
+    return variants
+
+def create_user(db, name: str, phone: str, location: str, state: str, avatar: str = None,
+                commit: bool = True) -> User:
+    """
+    Create a new user with proper validation and error handling
+    With commit=False the row is only flushed and the caller's transaction owns it
+    """
     if not db:
         raise RuntimeError("Database session not available")
     
@@ -322,14 +528,22 @@ def create_user(db, name: str, phone: str, location: str, state: str, avatar: st
     try:
         user = User(
             name=name.strip(),
-            phone=phone.strip(),
+            phone=normalize_phone(phone),
             location=location.strip(),
             state=state.strip(),
             avatar=avatar
         )
         db.add(user)
+        
+        # Cached "unknown phone" answers for this number are now wrong
+        from .user_cache import invalidate_user_cache
+        if not commit:
+            db.flush()
+            invalidate_user_cache(db, phone=user.phone)
+            return user
         db.commit()
         db.refresh(user)
+        invalidate_user_cache(phone=user.phone)
         
         # Create a detached copy of the user object that can be used outside the session
         user_copy = User(
@@ -365,7 +579,7 @@ def get_user_by_phone(db, phone: str) -> User:
         return None
         
     try:
-        return db.query(User).filter(User.phone == phone.strip()).first()
+        return db.query(User).filter(User.phone.in_(phone_variants(phone))).first()
     except Exception as e:
         print(f"Error querying user by phone: {e}")
         return None
@@ -383,13 +597,137 @@ def get_user_by_id(db, user_id: int) -> User:
         print(f"Error querying user by ID: {e}")
         return None
 
-def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str, 
-                    confidence: int, treatment: str, date: datetime = None) -> Diagnosis:
-    """Create a new diagnosis record with proper error handling"""
+# Quantity units sellers type, in kilograms
+QUANTITY_UNITS_KG = {
+    '': Decimal('1'), 'kg': Decimal('1'), 'kgs': Decimal('1'), 'kilo': Decimal('1'), 'kilos': Decimal('1'),
+    'kilogram': Decimal('1'), 'kilograms': Decimal('1'),
+    'g': Decimal('0.001'), 'gm': Decimal('0.001'), 'gms': Decimal('0.001'), 'gram': Decimal('0.001'),
+    'grams': Decimal('0.001'),
+    'q': Decimal('100'), 'qtl': Decimal('100'), 'qtls': Decimal('100'), 'quintal': Decimal('100'),
+    'quintals': Decimal('100'),
+    't': Decimal('1000'), 'ton': Decimal('1000'), 'tons': Decimal('1000'), 'tonne': Decimal('1000'),
+    'tonnes': Decimal('1000')
+}
+_QUANTITY_RE = re.compile(r'^\s*(\d[\d,]*(?:\.\d+)?)\s*([a-z]*)\.?\s*$')
+_RELATIVE_DATE_RE = re.compile(r'^(\d+|an?)\s+(minute|min|hour|hr|day|week|month)s?\s+ago$')
+_RELATIVE_DATE_UNITS = {
+    'minute': timedelta(minutes=1), 'min': timedelta(minutes=1), 'hour': timedelta(hours=1),
+    'hr': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(weeks=1), 'month': timedelta(days=30)
+}
+_POSTED_DATE_FORMATS = ('%d %b %Y', '%d %B %Y', '%b %d, %Y', '%B %d, %Y', '%d/%m/%Y', '%d-%m-%Y')
+
+def parse_quantity_kg(quantity: str):
+    """Kilograms in a free-text quantity such as '50 kg', '2 quintal' or '1.5 tonnes'; None if unrecognised"""
+    match = _QUANTITY_RE.match((quantity or '').lower())
+    if not match or match.group(2) not in QUANTITY_UNITS_KG:
+        return None
+    try:
+        # Commas are digit grouping ('1,000 kg' or '1,00,000 kg')
+        amount = Decimal(match.group(1).replace(',', ''))
+        return (amount * QUANTITY_UNITS_KG[match.group(2)]).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+def parse_posted_date(posted_date: str, now: datetime = None) -> datetime:
+    """
+    Timestamp for a free-text posted date: 'Just now', 'yesterday', '3 days ago', ISO dates or '15 Jan 2024'
+    Anything unrecognised is taken to mean now
+    """
+    now = now or datetime.utcnow()
+    value = (posted_date or '').strip().lower()
+    if value in ('', 'just now', 'now', 'today'):
+        return now
+    if value == 'yesterday':
+        return now - timedelta(days=1)
+    match = _RELATIVE_DATE_RE.match(value)
+    if match:
+        count = 1 if match.group(1) in ('a', 'an') else int(match.group(1))
+        try:
+            return now - count * _RELATIVE_DATE_UNITS[match.group(2)]
+        except OverflowError:
+            return now  # '99999 months ago' is before year 1
+    try:
+        parsed = datetime.fromisoformat(posted_date.strip().replace('Z', '+00:00'))
+        # Stored naive in UTC like every other timestamp column
+        return parsed.replace(tzinfo=None) - (parsed.utcoffset() or timedelta(0))
+    except (ValueError, OverflowError):
+        pass
+    for date_format in _POSTED_DATE_FORMATS:
+        try:
+            return datetime.strptime(posted_date.strip(), date_format)
+        except ValueError:
+            continue
+    return now
+
+def create_listing(db, user_id: int, crop: str, quantity: str, price_per_kg, market: str,
+                   transport: str = 'No', posted_date: str = 'Just now', total_price=None,
+                   commit: bool = True) -> Listing:
+    """
+    Create a marketplace listing, filling quantity_kg and posted_at from the free-text fields
+    total_price defaults to quantity_kg * price_per_kg
+    With commit=False the row is only flushed and the caller's transaction owns it
+    """
     if not db:
         raise RuntimeError("Database session not available")
     
     # Validate input
+    if not user_id or user_id <= 0:
+        raise ValueError("Valid user_id is required")
+    if not crop or not crop.strip():
+        raise ValueError("Crop is required")
+    if not market or not market.strip():
+        raise ValueError("Market is required")
+    if not quantity or not quantity.strip():
+        raise ValueError("Quantity is required")
+    try:
+        price_per_kg = Decimal(str(price_per_kg))
+    except InvalidOperation:
+        raise ValueError("price_per_kg must be a number")
+    if not price_per_kg.is_finite():
+        raise ValueError("price_per_kg must be a number")
+    if price_per_kg <= 0:
+        raise ValueError("price_per_kg must be positive")
+    
+    quantity_kg = parse_quantity_kg(quantity)
+    if total_price is None:
+        if quantity_kg is None:
+            raise ValueError("total_price is required when the quantity is not in a known unit")
+        try:
+            total_price = (quantity_kg * price_per_kg).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise ValueError("quantity and price_per_kg are too large")
+    
+    try:
+        listing = Listing(
+            user_id=user_id,
+            crop=crop.strip(),
+            quantity=quantity.strip(),
+            quantity_kg=quantity_kg,
+            price_per_kg=price_per_kg,
+            market=market.strip(),
+            transport=transport,
+            total_price=total_price,
+            status='active',
+            posted_date=posted_date,
+            posted_at=parse_posted_date(posted_date)
+        )
+        db.add(listing)
+        if not commit:
+            db.flush()
+            return listing
+        db.commit()
+        db.refresh(listing)
+        return listing
+        
+    except Exception as e:
+        try:
+            db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
+def _validate_diagnosis_input(user_id: int, crop_name: str, diagnosis: str, confidence: int, treatment: str):
+    """Validate diagnosis parameters, raising ValueError on the first problem"""
     if not user_id or user_id <= 0:
         raise ValueError("Valid user_id is required")
     if not crop_name or not crop_name.strip():
@@ -400,6 +738,41 @@ def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str,
         raise ValueError("Confidence must be between 0 and 100")
     if not treatment or not treatment.strip():
         raise ValueError("Treatment is required")
+
+# Packed top-k: a version byte, then one little-endian (uint16 label id, float32 probability) per entry
+_TOP_K_VERSION = 1
+_TOP_K_ENTRY = struct.Struct('<Hf')
+
+def pack_top_k(entries) -> bytes:
+    """Pack (label_id, probability) pairs, highest first, into the diagnoses.top_k column; None if there are none"""
+    entries = list(entries)
+    if not entries:
+        return None
+    packed = bytearray([_TOP_K_VERSION])
+    for label_id, probability in entries:
+        packed += _TOP_K_ENTRY.pack(int(label_id), float(probability))
+    return bytes(packed)
+
+def unpack_top_k(packed: bytes) -> list:
+    """The [{"label_id", "probability"}] entries of a pack_top_k value, or None"""
+    if not packed:
+        return None
+    packed = bytes(packed)
+    if packed[0] != _TOP_K_VERSION or (len(packed) - 1) % _TOP_K_ENTRY.size:
+        return None
+    return [
+        {"label_id": label_id, "probability": round(probability, 6)}
+        for label_id, probability in _TOP_K_ENTRY.iter_unpack(packed[1:])
+    ]
+
+def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str, 
+                    confidence: int, treatment: str, date: datetime = None, top_k: bytes = None) -> Diagnosis:
+    """Create a new diagnosis record with proper error handling"""
+    if not db:
+        raise RuntimeError("Database session not available")
+    
+    # Validate input
+    _validate_diagnosis_input(user_id, crop_name, diagnosis, confidence, treatment)
     
     try:
         if date is None:
@@ -411,7 +784,8 @@ def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str,
             diagnosis=diagnosis.strip(),
             confidence=confidence,
             treatment=treatment.strip(),
-            date=date
+            date=date,
+            top_k=top_k
         )
         db.add(diagnosis_record)
         db.commit()
@@ -426,7 +800,8 @@ def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str,
             confidence=diagnosis_record.confidence,
             treatment=diagnosis_record.treatment,
             date=diagnosis_record.date,
-            created_at=diagnosis_record.created_at
+            created_at=diagnosis_record.created_at,
+            top_k=diagnosis_record.top_k
         )
         return diagnosis_copy
         
@@ -437,6 +812,67 @@ def create_diagnosis(db, user_id: int, crop_name: str, diagnosis: str,
             pass  # Rollback might fail if connection is lost
         raise RuntimeError(f"Database error: {str(e)}")
 
+def bulk_create_diagnoses(db, records: list, activity_action: str = "plant_diagnosis", commit: bool = True) -> list:
+    """
+    Insert many diagnoses, plus one activity row each, in a single transaction
+    Each record is a dict with user_id, crop_name, diagnosis, confidence, treatment and optional date and top_k
+    With commit=False the caller owns the transaction and must commit it
+    Returns the new diagnosis ids in the same order as records
+    """
+    if not db:
+        raise RuntimeError("Database session not available")
+    if not records:
+        return []
+    
+    now = datetime.utcnow()
+    diagnosis_rows = []
+    for record in records:
+        _validate_diagnosis_input(record.get('user_id'), record.get('crop_name'), record.get('diagnosis'),
+                                  record.get('confidence', 0), record.get('treatment'))
+        diagnosis_rows.append({
+            'user_id': record['user_id'],
+            'crop_name': record['crop_name'].strip(),
+            'diagnosis': record['diagnosis'].strip(),
+            'confidence': record['confidence'],
+            'treatment': record['treatment'].strip(),
+            'date': record.get('date') or now,
+            'created_at': now,
+            'top_k': record.get('top_k')
+        })
+    
+    try:
+        # Multi-row INSERT ... RETURNING, ids come back in parameter order
+        diagnosis_ids = db.execute(
+            insert(Diagnosis).returning(Diagnosis.id, sort_by_parameter_order=True),
+            diagnosis_rows
+        ).scalars().all()
+        
+        activity_rows = [
+            {
+                'user_id': row['user_id'],
+                'action': activity_action,
+                'data': {
+                    "diagnosis_id": diagnosis_id,
+                    "crop_name": row['crop_name'],
+                    "diagnosis": row['diagnosis'],
+                    "confidence": row['confidence']
+                },
+                'timestamp': now
+            }
+            for row, diagnosis_id in zip(diagnosis_rows, diagnosis_ids)
+        ]
+        db.execute(insert(UserActivity), activity_rows)
+        if commit:
+            db.commit()
+        return list(diagnosis_ids)
+        
+    except Exception as e:
+        try:
+            db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
 def get_user_diagnoses(db, user_id: int, limit: int = 50):
     """Get recent diagnoses for a user with proper error handling"""
     if not db:
@@ -453,8 +889,80 @@ def get_user_diagnoses(db, user_id: int, limit: int = 50):
         print(f"Error querying user diagnoses: {e}")
         return []
 
-def create_user_activity(db, user_id: int, action: str, data: dict = None):
-    """Log user activity with proper error handling"""
+# Columns returned by the diagnosis history API, serialized without building ORM objects
+DIAGNOSIS_HISTORY_COLUMNS = (
+    Diagnosis.id, Diagnosis.user_id, Diagnosis.crop_name, Diagnosis.diagnosis,
+    Diagnosis.confidence, Diagnosis.treatment, Diagnosis.date, Diagnosis.created_at, Diagnosis.top_k
+)
+
+def _diagnosis_row_to_dict(row) -> dict:
+    """Same shape as Diagnosis.to_dict(), from a DIAGNOSIS_HISTORY_COLUMNS row"""
+    return {
+        'id': row.id,
+        'user_id': row.user_id,
+        'crop_name': row.crop_name,
+        'diagnosis': row.diagnosis,
+        'confidence': row.confidence,
+        'treatment': row.treatment,
+        'date': row.date.isoformat() if row.date else None,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'top_k': unpack_top_k(row.top_k)
+    }
+
+def encode_diagnosis_cursor(created_at: datetime, diagnosis_id: int) -> str:
+    """Opaque cursor pointing just past a diagnosis in newest-first order"""
+    payload = json.dumps([created_at.isoformat(), diagnosis_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_diagnosis_cursor(cursor: str) -> tuple:
+    """Parse a cursor from encode_diagnosis_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, diagnosis_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(diagnosis_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def find_user_diagnoses(db, user_id: int, limit: int = 50, cursor: str = None):
+    """
+    Check that a user exists and get one page of their diagnoses, newest first, in one round trip
+    Pages are keyset-paginated on (created_at, id) and served by ix_diagnoses_user_id_created_at
+    Returns (user_exists, diagnoses as dicts, next_cursor or None)
+    """
+    if not db:
+        return False, [], None
+    if not user_id or user_id <= 0:
+        return False, [], None
+    if limit <= 0:
+        limit = 50
+    
+    join_condition = Diagnosis.user_id == User.id
+    if cursor:
+        created_at, diagnosis_id = decode_diagnosis_cursor(cursor)
+        join_condition = and_(join_condition, tuple_(Diagnosis.created_at, Diagnosis.id) < (created_at, diagnosis_id))
+    
+    # users LEFT JOIN diagnoses: no rows means no user, one all-NULL diagnosis means no (more) diagnoses
+    # One extra row is fetched to tell whether another page follows
+    rows = db.query(User.id.label('owner_id'), *DIAGNOSIS_HISTORY_COLUMNS)\
+             .outerjoin(Diagnosis, join_condition)\
+             .filter(User.id == user_id)\
+             .order_by(Diagnosis.created_at.desc(), Diagnosis.id.desc())\
+             .limit(limit + 1).all()
+    if not rows:
+        return False, [], None
+    
+    rows = [row for row in rows if row.id is not None]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_diagnosis_cursor(rows[-1].created_at, rows[-1].id)
+    return True, [_diagnosis_row_to_dict(row) for row in rows], next_cursor
+
+def create_user_activity(db, user_id: int, action: str, data: dict = None, commit: bool = True):
+    """
+    Log user activity with proper error handling
+    With commit=False the row is only flushed and the caller's transaction owns it
+    """
     if not db:
         raise RuntimeError("Database session not available")
     
@@ -471,6 +979,9 @@ def create_user_activity(db, user_id: int, action: str, data: dict = None):
             data=data
         )
         db.add(activity)
+        if not commit:
+            db.flush()
+            return activity
         db.commit()
         db.refresh(activity)
         return activity
@@ -482,6 +993,194 @@ def create_user_activity(db, user_id: int, action: str, data: dict = None):
             pass  # Rollback might fail if connection is lost
         raise RuntimeError(f"Database error: {str(e)}")
 
+def bulk_create_user_activities(db, activities: list, commit: bool = True) -> int:
+    """
+    Insert many activity rows with one multi-row insert
+    Each activity is a dict with user_id, action, optional data and optional timestamp
+    With commit=False the caller owns the transaction and must commit it
+    Returns the number of rows inserted
+    """
+    if not db:
+        raise RuntimeError("Database session not available")
+    if not activities:
+        return 0
+    
+    now = datetime.utcnow()
+    activity_rows = []
+    for activity in activities:
+        if not activity.get('user_id') or activity['user_id'] <= 0:
+            raise ValueError("Valid user_id is required")
+        if not activity.get('action') or not activity['action'].strip():
+            raise ValueError("Action is required")
+        activity_rows.append({
+            'user_id': activity['user_id'],
+            'action': activity['action'].strip(),
+            'data': activity.get('data'),
+            'timestamp': activity.get('timestamp') or now
+        })
+    
+    try:
+        db.execute(insert(UserActivity), activity_rows)
+        if commit:
+            db.commit()
+        return len(activity_rows)
+        
+    except Exception as e:
+        try:
+            db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
+def increment_listing_counters(db, deltas: dict, commit: bool = True) -> int:
+    """
+    Add accumulated view and inquiry counts to listings with one batched UPDATE
+    deltas maps listing_id -> (views, inquiries); rows are updated in id order so
+    concurrent flushes from several workers lock them in the same order
+    With commit=False the caller owns the transaction and must commit it
+    Returns the number of listings in the batch
+    """
+    if not db:
+        raise RuntimeError("Database session not available")
+    rows = [{'listing_id': listing_id, 'views_delta': views, 'inquiries_delta': inquiries}
+            for listing_id, (views, inquiries) in sorted(deltas.items()) if views or inquiries]
+    if not rows:
+        return 0
+    
+    listings = Listing.__table__
+    statement = update(listings).where(listings.c.id == bindparam('listing_id')).values(
+        views=listings.c.views + bindparam('views_delta'),
+        inquiries=listings.c.inquiries + bindparam('inquiries_delta'),
+        # A view is not an edit, so keep updated_at as it is
+        updated_at=listings.c.updated_at
+    )
+    try:
+        db.execute(statement, rows)
+        if commit:
+            db.commit()
+        return len(rows)
+        
+    except Exception as e:
+        try:
+            db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
+def get_cached_treatment(db, disease_key: str, prompt_version: int):
+    """Get (payload, expires_at) of an unexpired cached treatment bundle, or None"""
+    if not db or not disease_key:
+        return None
+        
+    try:
+        entry = db.query(TreatmentCacheEntry.payload, TreatmentCacheEntry.expires_at).filter(
+            TreatmentCacheEntry.disease_key == disease_key,
+            TreatmentCacheEntry.prompt_version == prompt_version,
+            TreatmentCacheEntry.expires_at > datetime.utcnow()
+        ).first()
+        return (entry.payload, entry.expires_at) if entry else None
+    except Exception as e:
+        print(f"Error querying treatment cache: {e}")
+        return None
+
+def upsert_cached_treatment(db, disease_key: str, prompt_version: int, payload: dict, expires_at: datetime,
+                            commit: bool = True):
+    """
+    Insert or replace the cached treatment bundle for a disease and prompt version
+    With commit=False the caller owns the transaction and must commit it
+    """
+    if not db:
+        raise RuntimeError("Database session not available")
+    if not disease_key:
+        raise ValueError("Disease key is required")
+    
+    try:
+        entry = db.query(TreatmentCacheEntry).filter(
+            TreatmentCacheEntry.disease_key == disease_key,
+            TreatmentCacheEntry.prompt_version == prompt_version
+        ).first()
+        if entry is None:
+            entry = TreatmentCacheEntry(disease_key=disease_key, prompt_version=prompt_version)
+            db.add(entry)
+        entry.payload = payload
+        entry.created_at = datetime.utcnow()
+        entry.expires_at = expires_at
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+        
+    except Exception as e:
+        try:
+            db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
+def get_chat_conversation(db, user_id: int):
+    """Get the stored chat memory of a user as a dict, or None"""
+    if not db or not user_id:
+        return None
+        
+    try:
+        entry = db.query(ChatConversation).filter(ChatConversation.user_id == user_id).first()
+        return entry.to_dict() if entry else None
+    except Exception as e:
+        print(f"Error querying chat conversation: {e}")
+        return None
+
+def save_chat_conversation(db, user_id: int, summary: str, turns: list, revision: int,
+                           prompt_tokens: int = 0, completion_tokens: int = 0, commit: bool = True) -> bool:
+    """
+    Write a user's chat memory if the stored row is still at revision (0: no row yet)
+    Token counts are added to the user's running totals
+    The write runs in a savepoint, so when another writer got there first (False) or it fails, only this
+    write is rolled back and a caller's transaction (commit=False) keeps its other work
+    """
+    if not db:
+        raise RuntimeError("Database session not available")
+    if not user_id or user_id <= 0:
+        raise ValueError("Valid user_id is required")
+    
+    now = datetime.utcnow()
+    savepoint = db.begin_nested()
+    try:
+        if revision == 0:
+            db.execute(insert(ChatConversation).values(
+                user_id=user_id, summary=summary, turns=turns, revision=1,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, updated_at=now
+            ))
+        else:
+            result = db.execute(
+                update(ChatConversation)
+                .where(ChatConversation.user_id == user_id, ChatConversation.revision == revision)
+                .values(summary=summary, turns=turns, revision=revision + 1,
+                        prompt_tokens=ChatConversation.prompt_tokens + prompt_tokens,
+                        completion_tokens=ChatConversation.completion_tokens + completion_tokens,
+                        updated_at=now)
+            )
+            if result.rowcount == 0:
+                savepoint.rollback()
+                return False
+        savepoint.commit()
+        if commit:
+            db.commit()
+        return True
+        
+    except IntegrityError:
+        # The row was created concurrently (or the user does not exist)
+        savepoint.rollback()
+        return False
+    except Exception as e:
+        try:
+            if savepoint.is_active:
+                savepoint.rollback()
+            if commit:
+                db.rollback()
+        except:
+            pass  # Rollback might fail if connection is lost
+        raise RuntimeError(f"Database error: {str(e)}")
+
 def test_connection():
     """Test live database connection"""
     if not DB_AVAILABLE:
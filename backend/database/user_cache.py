@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+"""
+Read-through cache for user profile lookups by id and by phone number.
+
+Profiles are cached as to_dict() payloads in two tiers:
+- an in-process LRU with a TTL and an entry cap
+- an optional on-disk tier (USER_CACHE_DIR) shared by all gunicorn workers
+  on the host. Profiles hold names and phone numbers, so the directory is
+  created 0700 and every file 0600, and each worker sweeps out expired files
+  every USER_CACHE_DISK_SWEEP_SECONDS, keeping at most
+  USER_CACHE_DISK_MAX_ENTRIES files
+
+Unknown phone numbers are cached too (negative entries), with a shorter
+USER_CACHE_NEGATIVE_TTL_SECONDS, because clients poll for numbers that have
+not registered yet. create_user invalidates the entries for the new user's
+phone once its transaction commits. Phone numbers are normalised before
+they are used as keys, so '98765 43210', '919876543210' and
+'+91-98765-43210' share one entry.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+from .models import User, normalize_phone, phone_variants
+
+USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '3600'))
+USER_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('USER_CACHE_NEGATIVE_TTL_SECONDS', '30'))
+USER_CACHE_DIR = os.environ.get('USER_CACHE_DIR')
+USER_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('USER_CACHE_DISK_MAX_ENTRIES', '50000'))
+USER_CACHE_DISK_SWEEP_SECONDS = float(os.environ.get('USER_CACHE_DISK_SWEEP_SECONDS', '300'))
+
+# Serialized marker for "no such user"
+_NEGATIVE = 'null'
+
+# Temp files older than this were left by a worker that died mid-write
+_STALE_TEMP_SECONDS = 3600
+
+
+class UserProfileCache:
+    """Two-tier LRU/TTL cache of user profiles keyed on id and normalised phone"""
+
+    def __init__(self, max_entries: int = USER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = USER_CACHE_TTL_SECONDS,
+                 negative_ttl_seconds: int = USER_CACHE_NEGATIVE_TTL_SECONDS,
+                 disk_dir: Optional[str] = USER_CACHE_DIR,
+                 disk_max_entries: int = USER_CACHE_DISK_MAX_ENTRIES,
+                 disk_sweep_seconds: float = USER_CACHE_DISK_SWEEP_SECONDS,
+                 enabled: bool = USER_CACHE_ENABLED):
+        self.enabled = enabled and max_entries > 0
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_sweep_seconds = disk_sweep_seconds
+
+        # key -> (expires_at, serialized profile or _NEGATIVE)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._negative_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._disk_evictions = 0
+        self._next_sweep = 0.0
+        self._sweeping = False
+
+        if self.enabled and self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, mode=0o700, exist_ok=True)
+                os.chmod(self.disk_dir, 0o700)
+            except OSError as e:
+                print(f"⚠️ User cache directory unavailable, using memory only: {e}")
+                self.disk_dir = None
+
+    def get(self, key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return (found, profile); found with a None profile is a cached 'no such user'"""
+        if not self.enabled:
+            return False, None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, serialized = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    if serialized == _NEGATIVE:
+                        self._negative_hits += 1
+                    else:
+                        self._hits += 1
+                    return True, json.loads(serialized)
+                del self._entries[key]
+
+        disk_entry = self._read_disk(key, now)
+        with self._lock:
+            if disk_entry is None:
+                self._misses += 1
+                return False, None
+            self._disk_hits += 1
+            self._store(key, disk_entry[1], disk_entry[0])
+        return True, json.loads(disk_entry[1])
+
+    def set(self, key: str, profile: Optional[Dict[str, Any]]):
+        """Cache a profile, or None for a user that does not exist"""
+        if not self.enabled:
+            return
+
+        if profile is None:
+            serialized = _NEGATIVE
+            expires_at = time.time() + self.negative_ttl_seconds
+        else:
+            serialized = json.dumps(profile, separators=(',', ':'))
+            expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, serialized, expires_at)
+        self._write_disk(key, serialized, expires_at)
+
+    def invalidate(self, *keys: str):
+        """Drop keys from both tiers"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._invalidations += len(keys)
+        for key in keys:
+            if self.disk_dir:
+                try:
+                    os.remove(self._disk_path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"⚠️ User cache disk invalidation failed: {e}")
+
+    def _store(self, key: str, serialized: str, expires_at: float):
+        """Insert into the memory tier and evict LRU entries past the cap (lock held)"""
+        self._entries.pop(key, None)
+        self._entries[key] = (expires_at, serialized)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, digest[:2], f"{digest}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        """(expires_at, serialized) from the shared tier, or None"""
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                expires_at, serialized = json.load(f)
+            if expires_at <= now:
+                os.remove(path)
+                return None
+            return expires_at, serialized
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ User cache disk read failed: {e}")
+            return None
+
+    def _write_disk(self, key: str, serialized: str, expires_at: float):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            # Write to a temp file and rename so other workers never read a partial entry;
+            # mkstemp creates it 0600 and the rename keeps that mode
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump([expires_at, serialized], f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ User cache disk write failed: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        self._maybe_sweep_disk()
+
+    def _maybe_sweep_disk(self):
+        """Start a background sweep of the disk tier if this worker has not run one recently"""
+        now = time.time()
+        with self._lock:
+            if self._sweeping or now < self._next_sweep:
+                return
+            self._sweeping = True
+            self._next_sweep = now + self.disk_sweep_seconds
+        threading.Thread(target=self._sweep_disk, name='user-cache-sweep', daemon=True).start()
+
+    def _sweep_disk(self):
+        """
+        Delete expired and stale temp files, then the oldest entries past disk_max_entries
+        A file older than ttl_seconds has expired whatever its kind, so the files are not opened
+        """
+        now = time.time()
+        entries = []
+        removed = 0
+        try:
+            for directory, _, filenames in os.walk(self.disk_dir):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    try:
+                        modified_at = os.path.getmtime(path)
+                        if filename.endswith('.tmp'):
+                            if modified_at + _STALE_TEMP_SECONDS <= now:
+                                os.remove(path)
+                        elif modified_at + self.ttl_seconds <= now:
+                            os.remove(path)
+                            removed += 1
+                        else:
+                            entries.append((modified_at, path))
+                    except FileNotFoundError:
+                        continue  # Removed by another worker's read or sweep
+
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.disk_max_entries)]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    continue
+        except OSError as e:
+            print(f"⚠️ User cache disk sweep failed: {e}")
+        finally:
+            with self._lock:
+                self._disk_evictions += removed
+                self._sweeping = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters for health checks"""
+        with self._lock:
+            lookups = self._hits + self._negative_hits + self._disk_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "negative_hits": self._negative_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "disk_evictions": self._disk_evictions,
+                "hit_rate": round((self._hits + self._negative_hits + self._disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_tier": bool(self.disk_dir)
+            }
+
+
+user_cache = UserProfileCache()
+
+
+def _id_key(user_id: int) -> str:
+    return f"id:{user_id}"
+
+
+def _phone_key(phone: str) -> str:
+    return f"phone:{normalize_phone(phone)}"
+
+
+def _remember(profile: Dict[str, Any]):
+    user_cache.set(_id_key(profile['id']), profile)
+    user_cache.set(_phone_key(profile['phone']), profile)
+
+
+def get_cached_user_by_id(db, user_id: int) -> Optional[Dict[str, Any]]:
+    """User profile dict by id, read through the cache"""
+    if not user_id or user_id <= 0:
+        return None
+    found, profile = user_cache.get(_id_key(user_id))
+    if found:
+        return profile
+    if not db:
+        return None
+
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+    except Exception as e:
+        # Not cached: a failed query says nothing about whether the user exists
+        print(f"Error querying user by ID: {e}")
+        return None
+    if user is None:
+        user_cache.set(_id_key(user_id), None)
+        return None
+    profile = user.to_dict()
+    _remember(profile)
+    return profile
+
+
+def get_cached_user_by_phone(db, phone: str, use_negative: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    User profile dict by phone number in any accepted format, read through the cache
+    use_negative=False re-checks the database when the cache says the phone is unknown
+    """
+    if not phone or not phone.strip():
+        return None
+    key = _phone_key(phone)
+    found, profile = user_cache.get(key)
+    if found and (profile is not None or use_negative):
+        return profile
+    if not db:
+        return None
+
+    try:
+        user = db.query(User).filter(User.phone.in_(phone_variants(phone))).first()
+    except Exception as e:
+        print(f"Error querying user by phone: {e}")
+        return None
+    if user is None:
+        user_cache.set(key, None)
+        return None
+    profile = user.to_dict()
+    _remember(profile)
+    return profile
+
+
+def invalidate_user_cache(db=None, user_id: int = None, phone: str = None):
+    """
+    Drop cached entries for a user now and, when a session is given, again after it commits
+    The second pass removes entries a concurrent reader cached before the write was visible
+    """
+    keys = []
+    if user_id:
+        keys.append(_id_key(user_id))
+    if phone:
+        keys.append(_phone_key(phone))
+    if not keys:
+        return
+
+    user_cache.invalidate(*keys)
+    if db is not None:
+        event.listen(db, 'after_commit', lambda session: user_cache.invalidate(*keys), once=True)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+Write-behind buffer for diagnosis and activity rows.
+
+Request handlers hand rows to the buffer and return straight away; a
+background thread gathers rows from every request in the worker and writes
+them every WRITE_BUFFER_FLUSH_INTERVAL_MS, or as soon as
+WRITE_BUFFER_FLUSH_MAX_ROWS are waiting, as multi-row inserts in one
+transaction. When the pending queue is full, callers wait up to
+WRITE_BUFFER_ENQUEUE_TIMEOUT_MS for room (back-pressure).
+
+Rows that cannot be written, because the database is down or the queue
+stayed full, are appended to a JSON-lines spool file in
+WRITE_BUFFER_SPOOL_DIR and fsynced. The spool is replayed after the next
+successful flush by whichever worker gets to it first.
+"""
+
+import atexit
+import base64
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from .models import get_db_session, bulk_create_diagnoses, bulk_create_user_activities, _validate_diagnosis_input
+
+WRITE_BUFFER_FLUSH_INTERVAL_MS = float(os.environ.get('WRITE_BUFFER_FLUSH_INTERVAL_MS', '200'))
+WRITE_BUFFER_FLUSH_MAX_ROWS = int(os.environ.get('WRITE_BUFFER_FLUSH_MAX_ROWS', '500'))
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', '10000'))
+WRITE_BUFFER_ENQUEUE_TIMEOUT_MS = float(os.environ.get('WRITE_BUFFER_ENQUEUE_TIMEOUT_MS', '50'))
+WRITE_BUFFER_SPOOL_DIR = os.environ.get('WRITE_BUFFER_SPOOL_DIR', '/tmp/kisanmitra-write-spool')
+
+DIAGNOSIS = 'diagnosis'
+ACTIVITY = 'activity'
+
+# Datetime fields that are stored as ISO strings in the spool, and binary ones stored as base64
+_DATETIME_FIELDS = ('date', 'timestamp')
+_BINARY_FIELDS = ('top_k',)
+
+
+def _encode_value(key: str, value: Any) -> Any:
+    if key in _DATETIME_FIELDS and isinstance(value, datetime):
+        return value.isoformat()
+    if key in _BINARY_FIELDS and isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def _encode_row(kind: str, row: Dict[str, Any]) -> str:
+    encoded = {key: _encode_value(key, value) for key, value in row.items()}
+    return json.dumps({"kind": kind, "row": encoded}) + "\n"
+
+
+def _decode_row(line: str) -> Tuple[str, Dict[str, Any]]:
+    entry = json.loads(line)
+    row = entry["row"]
+    for key in _DATETIME_FIELDS:
+        if isinstance(row.get(key), str):
+            row[key] = datetime.fromisoformat(row[key])
+    for key in _BINARY_FIELDS:
+        if isinstance(row.get(key), str):
+            row[key] = base64.b64decode(row[key])
+    return entry["kind"], row
+
+
+class WriteBehindBuffer:
+    """Batches diagnosis and activity inserts off the request path"""
+
+    def __init__(self, flush_interval_ms: float = WRITE_BUFFER_FLUSH_INTERVAL_MS,
+                 flush_max_rows: int = WRITE_BUFFER_FLUSH_MAX_ROWS,
+                 max_pending: int = WRITE_BUFFER_MAX_PENDING,
+                 enqueue_timeout_ms: float = WRITE_BUFFER_ENQUEUE_TIMEOUT_MS,
+                 spool_dir: Optional[str] = WRITE_BUFFER_SPOOL_DIR):
+        self.flush_interval = max(1.0, flush_interval_ms) / 1000.0
+        self.flush_max_rows = max(1, flush_max_rows)
+        self.max_pending = max(1, max_pending)
+        self.enqueue_timeout = max(0.0, enqueue_timeout_ms) / 1000.0
+        self.spool_dir = spool_dir
+
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Statistics
+        self._enqueued = 0
+        self._written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._spooled = 0
+        self._replayed = 0
+        self._backpressure_waits = 0
+        self._rejected = 0
+
+        atexit.register(self.flush)
+
+    def _ensure_worker(self):
+        """Start the flush thread, restarting it in forked gunicorn workers"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Rows queued before a fork belong to the parent process
+                self._queue = queue.Queue(maxsize=self.max_pending)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='db-write-buffer', daemon=True)
+            self._thread.start()
+
+    def add_diagnosis(self, user_id: int, crop_name: str, diagnosis: str, confidence: int,
+                      treatment: str, date: datetime = None, top_k: bytes = None):
+        """Queue one diagnosis (plus its plant_diagnosis activity row); raises ValueError on bad input"""
+        _validate_diagnosis_input(user_id, crop_name, diagnosis, confidence, treatment)
+        self._put(DIAGNOSIS, {
+            "user_id": user_id,
+            "crop_name": crop_name,
+            "diagnosis": diagnosis,
+            "confidence": confidence,
+            "treatment": treatment,
+            "date": date or datetime.utcnow(),
+            "top_k": top_k
+        })
+
+    def add_activity(self, user_id: int, action: str, data: dict = None):
+        """Queue one user activity row; raises ValueError on bad input"""
+        if not user_id or user_id <= 0:
+            raise ValueError("Valid user_id is required")
+        if not action or not action.strip():
+            raise ValueError("Action is required")
+        self._put(ACTIVITY, {"user_id": user_id, "action": action, "data": data, "timestamp": datetime.utcnow()})
+
+    def _put(self, kind: str, row: Dict[str, Any]):
+        self._ensure_worker()
+        with self._lock:
+            self._enqueued += 1
+        try:
+            self._queue.put_nowait((kind, row))
+            return
+        except queue.Full:
+            pass
+
+        # Back-pressure: wait briefly for the flush thread, then spool rather than drop
+        with self._lock:
+            self._backpressure_waits += 1
+        try:
+            self._queue.put((kind, row), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._spool([(kind, row)])
+
+    def _collect_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            with self._flush_lock:
+                if self._write(batch):
+                    self._replay_spool()
+
+    def flush(self):
+        """Write everything queued in this process now; used at shutdown"""
+        if self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            with self._flush_lock:
+                self._write(batch)
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """Insert a batch in one transaction; spool it if that fails. Returns True on success"""
+        diagnoses = [row for kind, row in batch if kind == DIAGNOSIS]
+        activities = [row for kind, row in batch if kind == ACTIVITY]
+
+        db = get_db_session()
+        if not db:
+            self._spool(batch)
+            return False
+        try:
+            bulk_create_diagnoses(db, diagnoses, commit=False)
+            bulk_create_user_activities(db, activities, commit=False)
+            db.commit()
+            with self._lock:
+                self._flushes += 1
+                self._written += len(batch)
+            return True
+        except Exception as e:
+            try:
+                db.rollback()
+            except Exception:
+                pass  # Rollback might fail if connection is lost
+            with self._lock:
+                self._failed_flushes += 1
+            if isinstance(e, ValueError) or isinstance(e.__context__, IntegrityError):
+                # Bad rows (e.g. an unknown user_id) would fail forever, so isolate them
+                print(f"⚠️ Write buffer flush of {len(batch)} rows rejected, retrying row by row: {e}")
+                db.close()
+                return self._write_rows_individually(batch)
+            print(f"❌ Write buffer flush of {len(batch)} rows failed, spooling: {e}")
+            self._spool(batch)
+            return False
+        finally:
+            db.close()
+
+    def _write_rows_individually(self, batch: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """Write rows one transaction each, dropping only the ones the database rejects"""
+        if len(batch) == 1:
+            with self._lock:
+                self._rejected += 1
+            print(f"❌ Dropping {batch[0][0]} row the database rejected: {batch[0][1]}")
+            return True
+        written_all = True
+        for item in batch:
+            written_all = self._write([item]) and written_all
+        return written_all
+
+    def _spool_path(self) -> str:
+        return os.path.join(self.spool_dir, f"spool-{os.getpid()}.jsonl")
+
+    def _spool(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        """Append rows to this process's spool file and fsync it"""
+        if not self.spool_dir:
+            print(f"⚠️ No WRITE_BUFFER_SPOOL_DIR configured - dropping {len(batch)} rows")
+            return
+        try:
+            with self._spool_lock:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                while True:
+                    f = open(self._spool_path(), 'a', encoding='utf-8')
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        # Another worker may have claimed the file for replay while we waited for the lock
+                        if os.fstat(f.fileno()).st_ino == os.stat(self._spool_path()).st_ino:
+                            f.writelines(_encode_row(kind, row) for kind, row in batch)
+                            f.flush()
+                            os.fsync(f.fileno())
+                            break
+                    except FileNotFoundError:
+                        pass
+                    finally:
+                        f.close()
+            with self._lock:
+                self._spooled += len(batch)
+        except OSError as e:
+            print(f"❌ Could not spool {len(batch)} rows, they are lost: {e}")
+
+    def _replay_spool(self):
+        """Write spooled rows from any worker back to the database (flush lock held)"""
+        if not self.spool_dir:
+            return
+        for spool_path in glob.glob(os.path.join(self.spool_dir, 'spool-*.jsonl')):
+            # Claiming a file by renaming it keeps two workers from replaying it twice
+            claimed_path = f"{spool_path}.replay-{os.getpid()}"
+            try:
+                with self._spool_lock:
+                    os.rename(spool_path, claimed_path)
+                with open(claimed_path, 'r', encoding='utf-8') as f:
+                    # Wait for a writer that opened the file before the rename to finish
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    rows = [_decode_row(line) for line in f if line.strip()]
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not read write buffer spool {spool_path}: {e}")
+                continue
+
+            for start in range(0, len(rows), self.flush_max_rows):
+                chunk = rows[start:start + self.flush_max_rows]
+                # A failed chunk is spooled again by _write
+                if self._write(chunk):
+                    with self._lock:
+                        self._replayed += len(chunk)
+            os.remove(claimed_path)
+            print(f"✅ Replayed {len(rows)} spooled rows from {os.path.basename(spool_path)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and flush counters for health checks"""
+        with self._lock:
+            return {
+                "flush_interval_ms": self.flush_interval * 1000.0,
+                "flush_max_rows": self.flush_max_rows,
+                "queue_depth": self._queue.qsize(),
+                "max_pending": self.max_pending,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "average_rows_per_flush": round(self._written / self._flushes, 2) if self._flushes else 0,
+                "backpressure_waits": self._backpressure_waits,
+                "spooled": self._spooled,
+                "replayed": self._replayed,
+                "rejected": self._rejected
+            }
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""
+Content-addressed cache of diagnosis results.
+
+Results are keyed on a hash of the exact normalised 224x224 RGB pixels that
+are fed to the model, so re-uploads of the same photo skip inference, while
+any other photo (a retake of the same leaf included) is diagnosed afresh.
+Keys are scoped to a namespace naming the inference backend, model and
+calibration, so switching backends or recalibrating never serves results
+produced by the previous setup.
+
+There are two tiers:
+- an in-process LRU with a TTL, an entry cap and a memory cap
+- an optional on-disk tier (DIAGNOSIS_CACHE_DIR) shared by all gunicorn
+  workers on the host, swept every DIAGNOSIS_CACHE_DISK_SWEEP_SECONDS for
+  expired files and capped at DIAGNOSIS_CACHE_DISK_MAX_ENTRIES
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+DIAGNOSIS_CACHE_ENABLED = os.environ.get('DIAGNOSIS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DIAGNOSIS_CACHE_MAX_ENTRIES = int(os.environ.get('DIAGNOSIS_CACHE_MAX_ENTRIES', '5000'))
+DIAGNOSIS_CACHE_MAX_BYTES = int(os.environ.get('DIAGNOSIS_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+DIAGNOSIS_CACHE_TTL_SECONDS = int(os.environ.get('DIAGNOSIS_CACHE_TTL_SECONDS', str(24 * 3600)))
+DIAGNOSIS_CACHE_DIR = os.environ.get('DIAGNOSIS_CACHE_DIR')
+DIAGNOSIS_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('DIAGNOSIS_CACHE_DISK_MAX_ENTRIES', '50000'))
+DIAGNOSIS_CACHE_DISK_SWEEP_SECONDS = float(os.environ.get('DIAGNOSIS_CACHE_DISK_SWEEP_SECONDS', '300'))
+
+MODEL_INPUT_SIZE = (224, 224)
+
+# Temp files older than this were left by a worker that died mid-write
+_STALE_TEMP_SECONDS = 3600
+
+
+def image_cache_key(image: Image.Image) -> str:
+    """Hash of the normalised 224x224 RGB pixels of an image"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size != MODEL_INPUT_SIZE:
+        image = image.resize(MODEL_INPUT_SIZE, Image.Resampling.LANCZOS)
+    return hashlib.sha256(image.tobytes()).hexdigest()
+
+
+class DiagnosisCache:
+    """
+    Two-tier LRU/TTL cache of diagnosis results keyed on image_cache_key()
+    namespace identifies what produced the results (see InferenceBackend.cache_namespace)
+    """
+
+    def __init__(self, namespace: str = '',
+                 max_entries: int = DIAGNOSIS_CACHE_MAX_ENTRIES,
+                 max_bytes: int = DIAGNOSIS_CACHE_MAX_BYTES,
+                 ttl_seconds: int = DIAGNOSIS_CACHE_TTL_SECONDS,
+                 disk_dir: Optional[str] = DIAGNOSIS_CACHE_DIR,
+                 disk_max_entries: int = DIAGNOSIS_CACHE_DISK_MAX_ENTRIES,
+                 disk_sweep_seconds: float = DIAGNOSIS_CACHE_DISK_SWEEP_SECONDS,
+                 enabled: bool = DIAGNOSIS_CACHE_ENABLED):
+        self.enabled = enabled and max_entries > 0
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_sweep_seconds = disk_sweep_seconds
+
+        # key -> (expires_at, serialized result)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._disk_errors = 0
+        self._disk_evictions = 0
+        self._next_sweep = 0.0
+        self._sweeping = False
+
+        if self.enabled and self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Diagnosis cache directory unavailable, using memory only: {e}")
+                self.disk_dir = None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result for key, or None"""
+        if not self.enabled:
+            return None
+
+        key = self._scoped(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, serialized = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return json.loads(serialized)
+                self._remove(key)
+                self._expirations += 1
+
+        serialized = self._read_disk(key, now)
+        with self._lock:
+            if serialized is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._store(key, serialized, now)
+        return json.loads(serialized)
+
+    def set(self, key: str, result: Dict[str, Any]):
+        """Cache a diagnosis result in memory and, if configured, on disk"""
+        if not self.enabled:
+            return
+
+        key = self._scoped(key)
+        serialized = json.dumps(result, separators=(',', ':'))
+        with self._lock:
+            self._store(key, serialized, time.time())
+        self._write_disk(key, serialized)
+
+    def _scoped(self, key: str) -> str:
+        """The image key combined with the namespace"""
+        if not self.namespace:
+            return key
+        return hashlib.sha256(f"{self.namespace}\n{key}".encode('utf-8')).hexdigest()
+
+    def _store(self, key: str, serialized: str, now: float):
+        """Insert into the memory tier and evict LRU entries past the caps (lock held)"""
+        if key in self._entries:
+            self._remove(key)
+        if len(serialized) > self.max_bytes:
+            return
+        self._entries[key] = (now + self.ttl_seconds, serialized)
+        self._bytes += len(serialized)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self._evictions += 1
+
+    def _remove(self, key: str):
+        """Drop an entry from the memory tier (lock held)"""
+        _, serialized = self._entries.pop(key)
+        self._bytes -= len(serialized)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_seconds <= now:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            with self._lock:
+                self._disk_errors += 1
+            print(f"⚠️ Diagnosis cache disk read failed: {e}")
+            return None
+
+    def _write_disk(self, key: str, serialized: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so other workers never read a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(serialized)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            with self._lock:
+                self._disk_errors += 1
+            print(f"⚠️ Diagnosis cache disk write failed: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        self._maybe_sweep_disk()
+
+    def _maybe_sweep_disk(self):
+        """Start a background sweep of the disk tier if this worker has not run one recently"""
+        now = time.time()
+        with self._lock:
+            if self._sweeping or now < self._next_sweep:
+                return
+            self._sweeping = True
+            self._next_sweep = now + self.disk_sweep_seconds
+        threading.Thread(target=self._sweep_disk, name='diagnosis-cache-sweep', daemon=True).start()
+
+    def _sweep_disk(self):
+        """Delete expired and stale temp files, then the oldest entries past disk_max_entries"""
+        now = time.time()
+        entries = []
+        removed = 0
+        try:
+            for directory, _, filenames in os.walk(self.disk_dir):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    try:
+                        modified_at = os.path.getmtime(path)
+                        if filename.endswith('.tmp'):
+                            if modified_at + _STALE_TEMP_SECONDS <= now:
+                                os.remove(path)
+                        elif modified_at + self.ttl_seconds <= now:
+                            os.remove(path)
+                            removed += 1
+                        else:
+                            entries.append((modified_at, path))
+                    except FileNotFoundError:
+                        continue  # Removed by another worker's read or sweep
+
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.disk_max_entries)]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    continue
+        except OSError as e:
+            with self._lock:
+                self._disk_errors += 1
+            print(f"⚠️ Diagnosis cache disk sweep failed: {e}")
+        finally:
+            with self._lock:
+                self._disk_evictions += removed
+                self._sweeping = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters for health checks"""
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "disk_errors": self._disk_errors,
+                "disk_evictions": self._disk_evictions,
+                "hit_rate": round((self._hits + self._disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_tier": bool(self.disk_dir)
+            }
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+Gunicorn settings for the backend APIs.
+
+    cd backend && gunicorn -c gunicorn.conf.py plant_diagnosis_api:app
+
+SERVER_MODE=sync (default) uses threaded workers, sized for CPU work.
+SERVER_MODE=async uses gevent workers so slow Hugging Face, Gemini and
+OpenAI calls do not pin a worker each (see async_mode.py).
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+# Same .env the apps load, so the worker class matches the app's SERVER_MODE
+load_dotenv()
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'sync').lower()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+
+if SERVER_MODE == 'async':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('ASYNC_WORKER_CONNECTIONS', '1000'))
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', '4'))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+Streaming image fetcher for image_url diagnoses.
+
+Downloads go through one pooled keep-alive session per worker process with
+connect/read timeouts and an overall deadline, enforced on every socket
+read. The body is streamed in chunks into PIL's incremental
+ImageFile.Parser, so decoding runs while the download is still in
+progress, and the download is aborted as soon as it is known to be too
+large: from Content-Length, from the running byte count, or from the image
+dimensions once the header has been parsed.
+"""
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageFile
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib3.util.retry import Retry
+
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.environ.get('IMAGE_FETCH_CONNECT_TIMEOUT', '5'))
+IMAGE_FETCH_READ_TIMEOUT = float(os.environ.get('IMAGE_FETCH_READ_TIMEOUT', '15'))
+IMAGE_FETCH_TOTAL_TIMEOUT = float(os.environ.get('IMAGE_FETCH_TOTAL_TIMEOUT', '30'))
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get('IMAGE_FETCH_MAX_BYTES', str(15 * 1024 * 1024)))
+IMAGE_FETCH_MAX_PIXELS = int(os.environ.get('IMAGE_FETCH_MAX_PIXELS', str(50 * 1000 * 1000)))
+IMAGE_FETCH_POOL_SIZE = int(os.environ.get('IMAGE_FETCH_POOL_SIZE', '20'))
+IMAGE_FETCH_CHUNK_SIZE = 64 * 1024
+
+
+class ImageFetchError(Exception):
+    """Raised when an image URL cannot be fetched or decoded"""
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_fetch_session() -> requests.Session:
+    """Return this process's pooled keep-alive session, creating it on first use"""
+    global _session, _session_pid
+
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            # Retry connection failures only; a slow origin should not be hit twice
+            retries = Retry(total=1, connect=1, read=0, status=0, backoff_factor=0.2, allowed_methods=['GET'])
+            adapter = HTTPAdapter(pool_connections=IMAGE_FETCH_POOL_SIZE,
+                                  pool_maxsize=IMAGE_FETCH_POOL_SIZE,
+                                  max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept': 'image/*'})
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+
+def _iter_body(response: requests.Response, deadline: float):
+    """
+    Yield body chunks as they arrive. Each socket read is capped at the time left before the deadline,
+    so an origin trickling a few bytes at a time cannot hold the download open past it
+    """
+    raw = response.raw
+    sock = getattr(raw.connection, 'sock', None)
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ImageFetchError(f"Image download took longer than {IMAGE_FETCH_TOTAL_TIMEOUT}s")
+        if sock is not None:
+            sock.settimeout(min(IMAGE_FETCH_READ_TIMEOUT, remaining))
+        try:
+            # read1 returns whatever has arrived instead of waiting for a full chunk
+            chunk = raw.read1(IMAGE_FETCH_CHUNK_SIZE, decode_content=True)
+        except Urllib3Error as e:
+            if time.monotonic() >= deadline:
+                raise ImageFetchError(f"Image download took longer than {IMAGE_FETCH_TOTAL_TIMEOUT}s")
+            raise ImageFetchError(f"Could not fetch image: {e}")
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_image(image_url: str) -> Image.Image:
+    """Download and decode an image from an http(s) URL within the configured limits"""
+    if not image_url.lower().startswith(('http://', 'https://')):
+        raise ImageFetchError("image_url must be an http or https URL")
+
+    deadline = time.monotonic() + IMAGE_FETCH_TOTAL_TIMEOUT
+    try:
+        response = get_fetch_session().get(
+            image_url,
+            stream=True,
+            timeout=(IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)
+        )
+    except requests.exceptions.RequestException as e:
+        raise ImageFetchError(f"Could not fetch image: {e}")
+
+    try:
+        response.raise_for_status()
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > IMAGE_FETCH_MAX_BYTES:
+            raise ImageFetchError(f"Image is too large ({content_length} bytes)")
+
+        parser = ImageFile.Parser()
+        received = 0
+        header_checked = False
+        for chunk in _iter_body(response, deadline):
+            received += len(chunk)
+            if received > IMAGE_FETCH_MAX_BYTES:
+                raise ImageFetchError(f"Image exceeds {IMAGE_FETCH_MAX_BYTES} bytes")
+
+            parser.feed(chunk)
+
+            # Once the header is parsed the dimensions are known; reject huge images early
+            if not header_checked and parser.image is not None:
+                header_checked = True
+                width, height = parser.image.size
+                if width * height > IMAGE_FETCH_MAX_PIXELS:
+                    raise ImageFetchError(f"Image dimensions {width}x{height} are too large")
+
+        return parser.close()
+
+    except ImageFetchError:
+        raise
+    except requests.exceptions.RequestException as e:
+        raise ImageFetchError(f"Could not fetch image: {e}")
+    except OSError as e:
+        raise ImageFetchError(f"Could not decode image: {e}")
+    finally:
+        response.close()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Image preprocessing shared by every diagnose entry point.
+
+All sources (base64 JSON, image URL, multipart upload) go through the same
+single pass: decode with JPEG DCT-domain downscaling (PIL draft mode), convert
+to RGB and resize to the 224x224 model input. The result is a
+PreprocessedImage; backends pull whichever representation they need from it
+(JPEG bytes for the remote API, a pixel array for the local engine), so the
+local path never round-trips through a JPEG encode.
+"""
+
+import binascii
+import io
+from typing import BinaryIO
+
+from PIL import Image
+
+from diagnosis_cache import image_cache_key
+
+MODEL_INPUT_SIZE = (224, 224)
+REMOTE_JPEG_QUALITY = 95
+
+# Above this ratio between source and target size, resize first reduces the
+# image with a cheap box filter before the LANCZOS pass (see Image.resize)
+RESIZE_REDUCING_GAP = 3.0
+
+
+class PreprocessedImage:
+    """A model-sized RGB image with lazily computed encodings"""
+
+    __slots__ = ('image', 'source_size', '_jpeg_bytes', '_cache_key')
+
+    def __init__(self, image: Image.Image, source_size=None):
+        self.image = image
+        self.source_size = source_size or image.size
+        self._jpeg_bytes = None
+        self._cache_key = None
+
+    def jpeg_bytes(self) -> bytes:
+        """JPEG encoding for backends that take an encoded image"""
+        if self._jpeg_bytes is None:
+            buffer = io.BytesIO()
+            self.image.save(buffer, format='JPEG', quality=REMOTE_JPEG_QUALITY)
+            self._jpeg_bytes = buffer.getvalue()
+        return self._jpeg_bytes
+
+    def cache_key(self) -> str:
+        """Diagnosis cache key of the normalised pixels"""
+        if self._cache_key is None:
+            self._cache_key = image_cache_key(self.image)
+        return self._cache_key
+
+
+def decode_base64_payload(base64_data: str) -> bytes:
+    """
+    Decode a base64 image, with or without a data URL prefix.
+    The payload is sliced through a memoryview, so the (multi-megabyte)
+    base64 text is not copied again just to strip the prefix.
+    """
+    encoded = base64_data.encode('ascii') if isinstance(base64_data, str) else base64_data
+    view = memoryview(encoded)
+    comma = encoded.find(b',', 0, 256)
+    if comma != -1:
+        view = view[comma + 1:]
+    try:
+        return binascii.a2b_base64(view)
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image data: {e}")
+
+
+def preprocess_image(image: Image.Image) -> PreprocessedImage:
+    """Downscale an opened (not yet loaded) image to the model input in one pass"""
+    source_size = image.size
+
+    # For JPEGs, let libjpeg decode at 1/2, 1/4 or 1/8 scale in the DCT domain,
+    # so a 12MP photo is never materialised at full resolution
+    image.draft('RGB', MODEL_INPUT_SIZE)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # CRITICAL: Resize to exactly 224x224 for MobileNetV2 model
+    if image.size != MODEL_INPUT_SIZE:
+        image = image.resize(MODEL_INPUT_SIZE, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+
+    return PreprocessedImage(image, source_size)
+
+
+def preprocess_image_bytes(image_data: bytes) -> PreprocessedImage:
+    """Preprocess an encoded image held in memory"""
+    return preprocess_image(Image.open(io.BytesIO(image_data)))
+
+
+def preprocess_image_stream(stream: BinaryIO) -> PreprocessedImage:
+    """Preprocess an encoded image from a file-like object such as an upload"""
+    return preprocess_image(Image.open(stream))
+
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+"""
+Pluggable inference backends for the plant disease classifier.
+
+Two backends are available, selected with the INFERENCE_BACKEND setting:
+- "huggingface": the remote Hugging Face Inference API (original behaviour)
+- "local": an in-process ONNX Runtime session running the same
+  mobilenet_v2_1.0_224-plant-disease-identification weights on the CPU
+
+Backends take a PreprocessedImage (see image_preprocessing.py) and pull the
+representation they need from it. Both return predictions in the Hugging Face format, a list of
+{"label": str, "score": float} dicts sorted by score, so the rest of the
+diagnosis pipeline does not care which one produced them.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from circuit_breaker import CircuitBreaker, TokenBucket, CircuitOpenError, RateLimitedError, HALF_OPEN
+from confidence import (
+    CONFIDENCE_TOP_K, LOW_CONFIDENCE_THRESHOLD, calibrate_probabilities, is_low_confidence, load_temperature
+)
+from label_registry import LabelRegistry
+from metrics import record_upstream_error, upstream_request_seconds
+
+try:
+    import numpy as np
+    import onnxruntime as ort
+    LOCAL_INFERENCE_AVAILABLE = True
+except ImportError:
+    np = None
+    ort = None
+    LOCAL_INFERENCE_AVAILABLE = False
+
+# Hugging Face API configuration - Using your specific plant disease detection model
+HF_API_URL = os.environ.get(
+    'HF_API_URL',
+    "https://api-inference.huggingface.co/models/linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification"
+)
+HF_TOKEN = os.environ.get('HF_TOKEN')
+HF_CONNECT_TIMEOUT = float(os.environ.get('HF_CONNECT_TIMEOUT', '5'))
+HF_READ_TIMEOUT = float(os.environ.get('HF_READ_TIMEOUT', '30'))
+
+# Shared breaker and per-worker rate limit for the Hugging Face API
+hf_circuit_breaker = CircuitBreaker(
+    'huggingface',
+    failure_threshold=int(os.environ.get('HF_BREAKER_FAILURE_THRESHOLD', '3')),
+    recovery_timeout=float(os.environ.get('HF_BREAKER_RECOVERY_SECONDS', '10')),
+    max_recovery_timeout=float(os.environ.get('HF_BREAKER_MAX_RECOVERY_SECONDS', '300'))
+)
+hf_rate_limiter = TokenBucket(
+    rate_per_second=float(os.environ.get('HF_RATE_LIMIT_PER_SECOND', '0')),  # 0 = unlimited
+    burst=int(os.environ.get('HF_RATE_LIMIT_BURST', '10'))
+)
+
+# Backend selection and local model location
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'huggingface').lower()
+LOCAL_MODEL_DIR = os.environ.get(
+    'LOCAL_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'plant-disease')
+)
+LOCAL_MODEL_THREADS = int(os.environ.get('LOCAL_MODEL_THREADS', '0'))  # 0 = let ONNX Runtime decide
+
+# id2label of linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification.
+# Used when the exported model directory does not ship a config.json.
+MODEL_LABELS = (
+    "Apple Scab",
+    "Apple with Black Rot",
+    "Cedar Apple Rust",
+    "Healthy Apple",
+    "Healthy Blueberry Plant",
+    "Cherry with Powdery Mildew",
+    "Healthy Cherry Plant",
+    "Corn (Maize) with Cercospora and Gray Leaf Spot",
+    "Corn (Maize) with Common Rust",
+    "Corn (Maize) with Northern Leaf Blight",
+    "Healthy Corn (Maize) Plant",
+    "Grape with Black Rot",
+    "Grape with Esca (Black Measles)",
+    "Grape with Isariopsis Leaf Spot",
+    "Healthy Grape Plant",
+    "Orange with Citrus Greening",
+    "Peach with Bacterial Spot",
+    "Healthy Peach Plant",
+    "Bell Pepper with Bacterial Spot",
+    "Healthy Bell Pepper Plant",
+    "Potato with Early Blight",
+    "Potato with Late Blight",
+    "Healthy Potato Plant",
+    "Healthy Raspberry Plant",
+    "Healthy Soybean Plant",
+    "Squash with Powdery Mildew",
+    "Strawberry with Leaf Scorch",
+    "Healthy Strawberry Plant",
+    "Tomato with Bacterial Spot",
+    "Tomato with Early Blight",
+    "Tomato with Late Blight",
+    "Tomato with Leaf Mold",
+    "Tomato with Septoria Leaf Spot",
+    "Tomato with Spider Mites or Two-spotted Spider Mite",
+    "Tomato with Target Spot",
+    "Tomato Yellow Leaf Curl Virus",
+    "Tomato Mosaic Virus",
+    "Healthy Tomato Plant",
+)
+
+
+# Every label the classifier can emit, indexed once; the local backend adds its config.json labels
+label_registry = LabelRegistry(MODEL_LABELS)
+
+# Fitted offline with `python confidence.py fit`; 1.0 (raw scores) until a calibration file exists
+confidence_temperature = load_temperature(os.path.join(LOCAL_MODEL_DIR, 'calibration.json'))
+
+
+def load_model_labels(model_dir: str = LOCAL_MODEL_DIR) -> List[str]:
+    """Load the classifier's labels from config.json, falling back to MODEL_LABELS"""
+    config_path = os.path.join(model_dir, 'config.json')
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            id2label = json.load(f).get('id2label') or {}
+        if id2label:
+            return [id2label[key] for key in sorted(id2label, key=int)]
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not read model labels from {config_path}: {e}")
+    return list(MODEL_LABELS)
+
+
+def get_disease_with_highest_probability(predictions: Any) -> Dict[str, Any]:
+    """
+    Extract the disease with highest probability from predictions
+    """
+    # Handle different response formats from HuggingFace API
+    if isinstance(predictions, dict):
+        if 'error' in predictions:
+            return {"error": predictions['error']}
+        # If it's a single prediction dict, convert to list
+        predictions = [predictions]
+    
+    if not predictions or not isinstance(predictions, list):
+        return {"error": "No valid predictions received"}
+    
+    # Temperature-scale the scores (see confidence.py) and keep the top k, highest first
+    probabilities = calibrate_probabilities([float(p.get('score', 0) or 0) for p in predictions],
+                                            confidence_temperature, len(MODEL_LABELS))
+    ranked = sorted(zip(predictions, probabilities), key=lambda item: item[1], reverse=True)[:CONFIDENCE_TOP_K]
+
+    # Display name and healthy flag are precomputed per label (see label_registry.py)
+    labels = [label_registry.describe(prediction.get('label', 'Unknown Disease')) for prediction, _ in ranked]
+    top_k = [
+        {
+            "disease": label.display_name,
+            "confidence": int(round(probability * 100)),
+            "probability": round(probability, 6),
+            "label_id": label.index
+        }
+        for label, (_, probability) in zip(labels, ranked)
+    ]
+    is_healthy = labels[0].is_healthy
+
+    return {
+        "disease": top_k[0]['disease'],
+        "confidence": top_k[0]['confidence'],
+        "status": "healthy" if is_healthy else "not_healthy",
+        "is_healthy": is_healthy,
+        "low_confidence": is_low_confidence(top_k[0]['confidence']),
+        "all_predictions": top_k
+    }
+
+
+class InferenceBackend:
+    """Base class for classifier backends"""
+
+    name = 'base'
+    supports_batching = False
+
+    def predict(self, image) -> List[Dict[str, Any]]:
+        """Classify one PreprocessedImage and return HF-style predictions"""
+        raise NotImplementedError
+
+    def predict_batch(self, batch: List[Any]) -> List[List[Dict[str, Any]]]:
+        """Classify several images; backends that can run a real batch override this"""
+        return [self.predict(image) for image in batch]
+
+    def describe(self) -> Dict[str, Any]:
+        """Short description of the backend for health checks"""
+        return {"backend": self.name}
+
+    def model_version(self) -> str:
+        """Identifies the model behind this backend; changes when the model does"""
+        return ''
+
+    def cache_namespace(self) -> str:
+        """Diagnosis cache namespace: backend, model and calibration that produce the results"""
+        return (f"{self.name}|{self.model_version()}|temperature={confidence_temperature}"
+                f"|threshold={LOW_CONFIDENCE_THRESHOLD}|top_k={CONFIDENCE_TOP_K}")
+
+
+def _retry_after_seconds(response) -> Optional[float]:
+    """Cooldown hinted by a Hugging Face error: Retry-After, or the model's estimated load time"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    try:
+        estimated_time = response.json().get('estimated_time')
+        return float(estimated_time) if estimated_time else None
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def query_huggingface_api(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Query the Hugging Face Inference API with proper format
+    Never sleeps: failures open the circuit breaker and later calls fail fast
+    until its cooldown has passed, then one probe call checks for recovery
+    """
+    if not hf_rate_limiter.try_acquire():
+        record_upstream_error('huggingface', 'rate_limited')
+        raise RateLimitedError("Hugging Face API rate limit reached")
+    if not hf_circuit_breaker.allow_request():
+        record_upstream_error('huggingface', 'circuit_open')
+        raise CircuitOpenError("Hugging Face API circuit is open")
+
+    # Send raw image bytes with correct content type
+    api_headers = {
+        "Authorization": f"Bearer {HF_TOKEN}",
+        "Content-Type": "application/octet-stream"  # Critical for image data!
+    }
+    # The recovery probe is allowed to wait for a cold model to load
+    if hf_circuit_breaker.state == HALF_OPEN:
+        api_headers["x-wait-for-model"] = "true"
+
+    try:
+        with upstream_request_seconds.time(upstream='huggingface'):
+            response = requests.post(HF_API_URL, headers=api_headers, data=image_bytes,
+                                     timeout=(HF_CONNECT_TIMEOUT, HF_READ_TIMEOUT))
+    except requests.exceptions.RequestException as e:
+        hf_circuit_breaker.record_failure()
+        record_upstream_error('huggingface', 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection')
+        raise Exception(f"Error calling Hugging Face API: {str(e)}")
+    
+    if response.status_code >= 400:
+        record_upstream_error('huggingface', f"http_{response.status_code}")
+
+    if response.status_code == 503 or response.status_code == 429 or response.status_code >= 500:
+        # Model loading, rate limited or server error: back off for the hinted time
+        hf_circuit_breaker.record_failure(retry_after=_retry_after_seconds(response))
+        raise Exception(f"Hugging Face API unavailable ({response.status_code}): {response.text[:500]}")
+
+    if response.status_code >= 400:
+        # Client errors say nothing about the health of the service
+        hf_circuit_breaker.record_success()
+        raise Exception(f"Hugging Face API rejected the request ({response.status_code}): {response.text[:500]}")
+
+    hf_circuit_breaker.record_success()
+    return response.json()
+
+
+class HuggingFaceBackend(InferenceBackend):
+    """Remote backend calling the Hugging Face Inference API"""
+
+    name = 'huggingface'
+
+    def predict(self, image) -> List[Dict[str, Any]]:
+        return query_huggingface_api(image.jpeg_bytes())
+
+    def model_version(self) -> str:
+        return HF_API_URL
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "url": HF_API_URL,
+            "token_configured": bool(HF_TOKEN),
+            "circuit_breaker": hf_circuit_breaker.stats(),
+            "rate_limiter": hf_rate_limiter.stats()
+        }
+
+
+class LocalOnnxBackend(InferenceBackend):
+    """
+    In-process CPU backend running the exported MobileNetV2 with ONNX Runtime.
+
+    The model directory is the output of:
+        optimum-cli export onnx --model linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification backend/models/plant-disease/
+    and is loaded once, when the backend is created at worker start.
+    """
+
+    name = 'local'
+    supports_batching = True
+
+    def __init__(self, model_dir: str = LOCAL_MODEL_DIR):
+        if not LOCAL_INFERENCE_AVAILABLE:
+            raise RuntimeError("numpy and onnxruntime are required for the local inference backend")
+
+        model_path = os.path.join(model_dir, 'model.onnx')
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"ONNX model not found at {model_path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if LOCAL_MODEL_THREADS > 0:
+            options.intra_op_num_threads = LOCAL_MODEL_THREADS
+
+        self.model_dir = model_dir
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.labels = load_model_labels(model_dir)
+        label_registry.register_labels(self.labels)
+
+        # Normalisation used by MobileNetV2ImageProcessor for this checkpoint
+        mean, std = [0.5, 0.5, 0.5], [0.5, 0.5, 0.5]
+        try:
+            with open(os.path.join(model_dir, 'preprocessor_config.json'), 'r', encoding='utf-8') as f:
+                processor_config = json.load(f)
+            mean = processor_config.get('image_mean', mean)
+            std = processor_config.get('image_std', std)
+        except (OSError, ValueError):
+            pass
+        self.mean = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1)
+        self.std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+
+    def _to_tensor(self, image):
+        """Normalise a 224x224 PreprocessedImage into a 1x3x224x224 float32 tensor"""
+        pixels = np.asarray(image.image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return ((pixels - self.mean) / self.std)[np.newaxis, ...]
+
+    def _softmax_to_predictions(self, logits) -> List[Dict[str, Any]]:
+        """Turn one row of logits into HF-style predictions for every class, sorted by score"""
+        exp = np.exp(logits - logits.max())
+        probabilities = exp / exp.sum()
+        order = np.argsort(probabilities)[::-1]
+        return [
+            {"label": self.labels[i] if i < len(self.labels) else f"LABEL_{i}", "score": float(probabilities[i])}
+            for i in order
+        ]
+
+    def logits(self, image):
+        """Raw logits for one image, used to fit the confidence temperature"""
+        return self.session.run(None, {self.input_name: self._to_tensor(image)})[0][0]
+
+    def predict(self, image) -> List[Dict[str, Any]]:
+        return self._softmax_to_predictions(self.logits(image))
+
+    def predict_batch(self, batch: List[Any]) -> List[List[Dict[str, Any]]]:
+        tensor = np.concatenate([self._to_tensor(image) for image in batch], axis=0)
+        logits = self.session.run(None, {self.input_name: tensor})[0]
+        return [self._softmax_to_predictions(row) for row in logits]
+
+    def model_version(self) -> str:
+        # A re-exported model.onnx gets a new size or modification time
+        model_stat = os.stat(os.path.join(self.model_dir, 'model.onnx'))
+        return f"{self.model_dir}:{model_stat.st_size}:{model_stat.st_mtime_ns}"
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model_dir": self.model_dir, "labels": len(self.labels)}
+
+
+def create_inference_backend(backend_name: Optional[str] = None) -> InferenceBackend:
+    """
+    Create the configured inference backend.
+    Falls back to the Hugging Face backend if the local model cannot be loaded.
+    """
+    backend_name = (backend_name or INFERENCE_BACKEND).lower()
+
+    if backend_name == 'local':
+        try:
+            backend = LocalOnnxBackend()
+            print(f"✅ Local inference backend loaded from {backend.model_dir}")
+            return backend
+        except Exception as e:
+            print(f"⚠️ Could not load local inference backend: {e}")
+            print("⚠️ Falling back to Hugging Face Inference API")
+    elif backend_name != 'huggingface':
+        print(f"⚠️ Unknown INFERENCE_BACKEND '{backend_name}', using Hugging Face Inference API")
+
+    return HuggingFaceBackend()
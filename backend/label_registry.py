@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Label registry for the plant disease classifier.
+
+Every label the model can emit is indexed once, when the inference backend
+is set up, under its raw form, its normalised form ('Tomato_with_Late_Blight',
+'tomato with late blight') and its LABEL_<n> id. Each entry holds the
+display name, crop, healthy flag and treatment advice, so turning a
+prediction into a result is a dict lookup instead of regex and string work
+on every request.
+
+Names that are not model labels (demo results, free text from clients) go
+through one precompiled matcher over the treatment keywords. Keywords only
+match whole words, so 'rust' matches 'Wheat Rust' but not 'crust'. When
+several keywords match, the first one in TREATMENTS wins, as before.
+"""
+
+import re
+from typing import Dict, Iterable, Optional
+
+# Basic treatment recommendations based on common diseases, in priority order
+TREATMENTS = {
+    "late blight": "Apply copper-based fungicides. Remove affected leaves. Improve air circulation. Avoid overhead watering.",
+    "early blight": "Use fungicides containing chlorothalonil. Practice crop rotation. Remove plant debris after harvest.",
+    "powdery mildew": "Apply sulfur or neem oil. Increase air circulation. Avoid overhead watering. Remove affected parts.",
+    "bacterial spot": "Use copper-based bactericides. Avoid overhead irrigation. Practice crop rotation. Remove infected plants.",
+    "mosaic virus": "Remove infected plants immediately. Control aphid vectors. Use virus-resistant varieties.",
+    "rust": "Apply fungicides with propiconazole. Improve air circulation. Avoid overhead watering.",
+    "black rot": "Use copper-based fungicides. Practice crop rotation. Remove infected plant parts promptly.",
+    "scab": "Apply fungicides during wet weather. Improve air circulation. Remove fallen leaves.",
+    "healthy": "Plant appears healthy. Continue current care practices. Monitor regularly for any changes."
+}
+DEFAULT_TREATMENT = (
+    "Consult with a local agricultural expert for specific treatment recommendations. "
+    "Monitor the plant closely and remove any affected parts."
+)
+
+# Crops of the PlantVillage classes, as they appear in the labels
+CROPS = (
+    "Apple", "Blueberry", "Cherry", "Corn (Maize)", "Grape", "Orange", "Peach", "Bell Pepper",
+    "Potato", "Raspberry", "Soybean", "Squash", "Strawberry", "Tomato"
+)
+
+_LABEL_PREFIX_RE = re.compile(r'^LABEL_\d+_?', re.IGNORECASE)
+_LABEL_ID_RE = re.compile(r'^LABEL_(\d+)$', re.IGNORECASE)
+_TREATMENT_PRIORITY = {keyword: index for index, keyword in enumerate(TREATMENTS)}
+_TREATMENT_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(keyword) for keyword in sorted(TREATMENTS, key=len, reverse=True)) + r')\b'
+)
+_CROPS_BY_KEY = {crop.lower(): crop for crop in CROPS}
+_CROP_RE = re.compile(r'\b(?:' + '|'.join(re.escape(key) for key in _CROPS_BY_KEY) + r')(?!\w)')
+
+
+def normalize_label(label: str) -> str:
+    """Lookup key for a label or disease name, so 'Tomato_with_Late_Blight' and 'Tomato With Late Blight' match"""
+    key = _LABEL_PREFIX_RE.sub('', label or '')
+    return ' '.join(key.replace('_', ' ').lower().split())
+
+
+def display_name(label: str) -> str:
+    """User-facing name of a raw label, without technical prefixes"""
+    name = _LABEL_PREFIX_RE.sub('', label).replace('_', ' ')
+    return ' '.join(word.capitalize() for word in name.split())
+
+
+def match_treatment_key(text: str) -> Optional[str]:
+    """The highest-priority TREATMENTS keyword found as whole words in text"""
+    matches = _TREATMENT_RE.findall(normalize_label(text))
+    if not matches:
+        return None
+    return min(matches, key=_TREATMENT_PRIORITY.__getitem__)
+
+
+class LabelInfo:
+    """Everything a diagnosis result needs to know about one label"""
+
+    __slots__ = ('label', 'index', 'display_name', 'crop', 'is_healthy', 'treatment_key', 'treatment')
+
+    def __init__(self, label: str, index: Optional[int] = None):
+        self.label = label
+        self.index = index
+        self.display_name = display_name(label)
+        lowered = label.lower()
+        self.is_healthy = 'healthy' in lowered or 'normal' in lowered
+        crop = _CROP_RE.search(normalize_label(label))
+        self.crop = _CROPS_BY_KEY[crop.group(0)] if crop else None
+        self.treatment_key = match_treatment_key(label)
+        self.treatment = TREATMENTS[self.treatment_key] if self.treatment_key else DEFAULT_TREATMENT
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "label": self.label,
+            "display_name": self.display_name,
+            "crop": self.crop,
+            "is_healthy": self.is_healthy,
+            "treatment_key": self.treatment_key
+        }
+
+
+class LabelRegistry:
+    """Raw label, normalised label and LABEL_<n> id -> LabelInfo"""
+
+    def __init__(self, labels: Iterable[str] = ()):
+        self._by_raw = {}
+        self._by_key = {}
+        self.register_labels(labels)
+
+    def register_labels(self, labels: Iterable[str]):
+        """Index a model's labels in id order; re-registering a label keeps its first entry"""
+        by_raw = dict(self._by_raw)
+        by_key = dict(self._by_key)
+        for index, label in enumerate(labels):
+            info = by_raw.get(label) or LabelInfo(label, index)
+            by_raw.setdefault(label, info)
+            by_raw.setdefault(f"LABEL_{index}", info)
+            by_key.setdefault(normalize_label(label), info)
+        # Swap whole dicts so concurrent lookups never see a half-built index
+        self._by_raw, self._by_key = by_raw, by_key
+
+    def lookup(self, name: str) -> Optional[LabelInfo]:
+        """The entry for a model label in any of its spellings, or None"""
+        if not name:
+            return None
+        info = self._by_raw.get(name)
+        if info is not None:
+            return info
+        label_id = _LABEL_ID_RE.match(name)
+        if label_id:
+            return self._by_raw.get(f"LABEL_{int(label_id.group(1))}")
+        return self._by_key.get(normalize_label(name))
+
+    def label_at(self, index: int) -> Optional[LabelInfo]:
+        """The entry for the model output at index"""
+        return self._by_raw.get(f"LABEL_{index}")
+
+    def describe(self, name: str) -> LabelInfo:
+        """The registered entry for name, or one derived from it on the spot"""
+        return self.lookup(name) or LabelInfo(name)
+
+    def treatment_for(self, disease_name: str) -> str:
+        info = self.lookup(disease_name)
+        if info is not None:
+            return info.treatment
+        key = match_treatment_key(disease_name or '')
+        return TREATMENTS[key] if key else DEFAULT_TREATMENT
+
+    def __len__(self) -> int:
+        return len(self._by_key)
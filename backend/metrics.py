@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+
+"""
+Latency histograms, counters and a Prometheus text-format /metrics endpoint.
+
+Counters and histograms are kept in memory per worker process. When
+METRICS_DIR is set, every worker also writes its values there as a small
+JSON snapshot every METRICS_SNAPSHOT_INTERVAL_SECONDS, and /metrics sums
+the snapshots of all live workers on the host, so a scrape that lands on
+any one worker sees the whole server. When a worker's process is gone, its
+last snapshot is folded into a retired-workers total (metrics-retired.json)
+that is added to every scrape, so the merged counters and histograms never
+go down, which Prometheus would read as a counter reset.
+
+Gauges are not merged: they come from collector callbacks (pool sizes,
+cache stats) that the serving worker evaluates at scrape time, labelled
+with its pid.
+
+    with stage_timer('preprocess'):
+        image = preprocess_image(...)
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Response, g, request
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL_SECONDS', '5'))
+
+# Seconds; spans a cache hit (sub-millisecond) to a cold upstream model (tens of seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Tokens and characters per chat prompt or reply; spans a one-line question to a prompt at the memory budget
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+CHAR_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total: Dict, values: Dict):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values: Dict) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {key: list(entry) for key, entry in self._values.items()}
+
+    @staticmethod
+    def merge(total: Dict, values: Dict):
+        for key, entry in values.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], entry)]
+            else:
+                total[key] = list(entry)
+
+    def render(self, values: Dict) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.labelnames + ('le',)
+        for key, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                labels = _format_labels(bucket_labels, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of this process, plus gauge collectors evaluated at scrape time"""
+
+    def __init__(self, metrics_dir: Optional[str] = METRICS_DIR,
+                 snapshot_interval: float = METRICS_SNAPSHOT_INTERVAL_SECONDS):
+        self.metrics_dir = metrics_dir
+        self.snapshot_interval = max(0.5, snapshot_interval)
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        if self.metrics_dir:
+            try:
+                os.makedirs(self.metrics_dir, exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Metrics directory unavailable, serving this worker's metrics only: {e}")
+                self.metrics_dir = None
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, Any], float]]]):
+        """collector() yields (name, documentation, labels, value) gauge samples"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    # Cross-worker snapshots
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.metrics_dir, f"metrics-{pid}.json")
+
+    def _retired_path(self) -> str:
+        return os.path.join(self.metrics_dir, 'metrics-retired.json')
+
+    def _write_json(self, path: str, payload: Dict[str, Any]):
+        """Write to a temp file and rename so a scrape never reads a partial file"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.metrics_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def ensure_snapshot_thread(self):
+        """Start the snapshot writer, restarting it in forked gunicorn workers"""
+        if not self.metrics_dir:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Values recorded before a fork belong to the parent process
+                for metric in self._metrics.values():
+                    metric.reset()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._snapshot_loop, name='metrics-snapshot', daemon=True)
+            self._thread.start()
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        if not self.metrics_dir:
+            return
+        with self._lock:
+            metrics = list(self._metrics.values())
+        payload = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in metrics}
+        try:
+            self._write_json(self._snapshot_path(os.getpid()), payload)
+        except OSError as e:
+            print(f"⚠️ Metrics snapshot write failed: {e}")
+
+    def _retire_snapshot(self, path: str):
+        """
+        Fold a dead worker's last snapshot into the retired total and delete it
+        Workers scrape concurrently, so this runs under an exclusive lock and only the first one folds it
+        """
+        with open(os.path.join(self.metrics_dir, 'metrics-retired.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                return  # Already folded by another worker
+            except ValueError:
+                snapshot = {}
+            retired = self._read_retired()
+            for metric_name, samples in snapshot.items():
+                metric = self._metrics.get(metric_name)
+                if metric is None:
+                    continue
+                total = {tuple(key): value for key, value in retired.get(metric_name, [])}
+                metric.merge(total, {tuple(key): value for key, value in samples})
+                retired[metric_name] = [[list(key), value] for key, value in total.items()]
+            self._write_json(self._retired_path(), retired)
+            os.remove(path)
+
+    def _read_retired(self) -> Dict[str, Any]:
+        try:
+            with open(self._retired_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Metrics retired total unreadable: {e}")
+            return {}
+
+    def _read_snapshots(self) -> List[Dict[str, Any]]:
+        """Snapshots of the other live workers on this host, then the total of the retired ones"""
+        snapshots = []
+        for name in os.listdir(self.metrics_dir):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                pid = int(name[len('metrics-'):-len('.json')])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            path = os.path.join(self.metrics_dir, name)
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    self._retire_snapshot(path)
+                except OSError as e:
+                    print(f"⚠️ Metrics snapshot of dead worker {pid} not retired: {e}")
+                continue
+            except PermissionError:
+                pass  # Alive, owned by another user
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        snapshots.append(self._read_retired())
+        return snapshots
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        snapshots = self._read_snapshots() if self.metrics_dir else []
+        lines = []
+        for metric in metrics:
+            values = metric.snapshot()
+            for snapshot in snapshots:
+                metric.merge(values, {tuple(key): value for key, value in snapshot.get(metric.name, [])})
+            lines.extend(metric.render(values))
+
+        gauges = {}
+        for collector in collectors:
+            try:
+                for name, documentation, labels, value in collector():
+                    if value is None:
+                        continue
+                    gauges.setdefault(name, (documentation, []))[1].append((labels, value))
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+        pid = str(os.getpid())
+        for name, (documentation, samples) in gauges.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                labels = dict(labels, pid=pid)
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(float(value))}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+diagnosis_stage_seconds = registry.histogram(
+    'kisanmitra_diagnosis_stage_seconds', 'Time spent in each stage of a plant diagnosis', ('stage',)
+)
+http_request_seconds = registry.histogram(
+    'kisanmitra_http_request_seconds', 'HTTP request latency by route', ('method', 'route', 'status')
+)
+upstream_request_seconds = registry.histogram(
+    'kisanmitra_upstream_request_seconds', 'Latency of calls to upstream providers', ('upstream',)
+)
+upstream_errors_total = registry.counter(
+    'kisanmitra_upstream_errors_total', 'Failed or rejected calls to upstream providers', ('upstream', 'reason')
+)
+
+chat_tokens = registry.histogram(
+    'kisanmitra_chat_tokens', 'Prompt and completion tokens per chat request', ('upstream', 'kind'), TOKEN_BUCKETS
+)
+chat_prompt_chars = registry.histogram(
+    'kisanmitra_chat_prompt_chars', 'Length of the prompt sent per chat request', ('upstream',), CHAR_BUCKETS
+)
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time one diagnosis pipeline stage"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    with diagnosis_stage_seconds.time(stage=stage):
+        yield
+
+
+def record_upstream_error(upstream: str, reason: str):
+    if METRICS_ENABLED:
+        upstream_errors_total.inc(upstream=upstream, reason=reason)
+
+def record_chat_usage(upstream: str, usage: Dict[str, Any]):
+    """Observe the prompt length and token counts of one chat request (see conversation_memory.chat_usage)"""
+    if not METRICS_ENABLED:
+        return
+    chat_prompt_chars.observe(usage['prompt_chars'], upstream=upstream)
+    chat_tokens.observe(usage['prompt_tokens'], upstream=upstream, kind='prompt')
+    chat_tokens.observe(usage['completion_tokens'], upstream=upstream, kind='completion')
+
+def stats_gauges(prefix: str, stats: Optional[Dict[str, Any]], documentation: str,
+                 labels: Optional[Dict[str, str]] = None):
+    """Gauge samples for the numeric fields of a component's stats() dict"""
+    for key, value in (stats or {}).items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            yield f"{prefix}_{key}", documentation, labels or {}, value
+
+
+def _start_request_timer():
+    g.metrics_started_at = time.perf_counter()
+    registry.ensure_snapshot_thread()
+
+
+def _observe_request(response):
+    started_at = g.pop('metrics_started_at', None)
+    if started_at is not None and request.endpoint != 'metrics':
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started_at,
+                                     method=request.method, route=route, status=response.status_code)
+    return response
+
+
+def init_metrics(app):
+    """Register the request timing hooks and the /metrics endpoint on a Flask app"""
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
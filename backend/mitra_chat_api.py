@@ -5,12 +5,27 @@ import os
 from datetime import datetime
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before local modules read their settings at import
 load_dotenv()
 
+from async_mode import init_async_mode
+from sse import wants_event_stream, format_sse, sse_response, close_upstream
+from conversation_memory import conversation_memory, chat_messages, chat_usage, parse_user_id
+from metrics import init_metrics, record_chat_usage
+from request_session import init_request_session
+
+# Async serving mode (gevent) must be set up before any provider client connects
+init_async_mode()
+
 app = Flask(__name__)
 CORS(app)
 
+# One database session and transaction per request (chat memory), always returned to the pool
+init_request_session(app)
+
+# Request latency and chat token histograms, served on /metrics
+init_metrics(app)
+
 # Set up OpenAI client
 api_key = os.getenv('OPENAI_API_KEY')  # Only use OpenAI API key
 client = OpenAI(api_key=api_key) if api_key else None
@@ -42,8 +57,96 @@ You can help with:
 
 Remember: You are a helpful friend to the farmer, not just an information source."""
 
+def describe_openai_error(e: Exception):
+    """Map an OpenAI error to a client-facing message and status code"""
+    error_str = str(e).lower()
+    if "authentication" in error_str:
+        return 'Invalid OpenAI API key', 401
+    elif "rate_limit" in error_str:
+        return 'API rate limit exceeded. Please try again later.', 429
+    elif "openai" in error_str:
+        return f'OpenAI API error: {str(e)}', 500
+    else:
+        return 'Internal server error', 500
+
+def openai_chat_usage(messages: list, reply: str, usage=None):
+    """Prompt length and token counts of an OpenAI chat call, from its usage block when present"""
+    prompt = '\n'.join(message['content'] for message in messages)
+    if usage is None:
+        return chat_usage(prompt, reply)
+    return chat_usage(prompt, reply, usage.prompt_tokens, usage.completion_tokens)
+
+def summarize_with_openai(prompt: str) -> str:
+    """Model call conversation_memory uses to fold old turns into the running summary"""
+    response = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=400,
+        temperature=0.3
+    )
+    return response.choices[0].message.content
+
+def remember_chat(user_id: int, user_message: str, bot_response: str, usage: dict):
+    """Track the request's token usage and add the exchange to the user's conversation memory"""
+    record_chat_usage('openai', usage)
+    print(f"[{datetime.now()}] Chat usage: {usage['prompt_chars']} prompt chars, "
+          f"{usage['prompt_tokens']} prompt / {usage['completion_tokens']} completion tokens")
+    if user_id:
+        conversation_memory.record_exchange(user_id, user_message, bot_response,
+                                            summarize=summarize_with_openai, usage=usage)
+
+def stream_chat_events(user_message: str, messages: list, user_id: int = None):
+    """
+    Generate SSE events for an OpenAI reply as tokens arrive
+    If the client disconnects, the generator is closed and the upstream stream is closed with it
+    """
+    stream = None
+    finished = False
+    parts = []
+    reported_usage = None
+    try:
+        stream = client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                reported_usage = chunk.usage
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                parts.append(text)
+                yield format_sse({'text': text}, event='token')
+        
+        finished = True
+        bot_response = ''.join(parts).strip()
+        print(f"[{datetime.now()}] User: {user_message}")
+        print(f"[{datetime.now()}] Bot (streamed): {bot_response}")
+        usage = openai_chat_usage(messages, bot_response, reported_usage)
+        remember_chat(user_id, user_message, bot_response, usage)
+        yield format_sse({'response': bot_response, 'usage': usage, 'timestamp': datetime.now().isoformat()},
+                         event='done')
+        
+    except Exception as e:
+        finished = True
+        print(f"Error in streaming chat: {str(e)}")
+        message, status = describe_openai_error(e)
+        yield format_sse({'error': message, 'status': status}, event='error')
+    finally:
+        if stream is not None and not finished:
+            close_upstream(stream)
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    """
+    Chat with the farming assistant
+    Returns JSON by default, or streams tokens over SSE when the client asks for it (see sse.py)
+    """
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
@@ -51,16 +154,21 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Message is required'}), 400
         
-        if not client.api_key:
+        if not client or not client.api_key:
             return jsonify({'error': 'OpenAI API key not configured'}), 500
+        
+        # Known users get their recent turns and a summary of older ones (see conversation_memory.py)
+        user_id = parse_user_id(data.get('user_id'))
+        conversation = conversation_memory.get(user_id) if user_id else None
+        messages = chat_messages(FARMING_SYSTEM_PROMPT, conversation, user_message)
+        
+        if wants_event_stream(request, data):
+            return sse_response(stream_chat_events(user_message, messages, user_id))
             
         # Create chat completion with OpenAI
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": FARMING_SYSTEM_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
+            messages=messages,
             max_tokens=500,
             temperature=0.7
         )
@@ -71,22 +179,20 @@ def chat():
         print(f"[{datetime.now()}] User: {user_message}")
         print(f"[{datetime.now()}] Bot: {bot_response}")
         
+        usage = openai_chat_usage(messages, bot_response, response.usage)
+        remember_chat(user_id, user_message, bot_response, usage)
+        
         return jsonify({
             'response': bot_response,
+            'usage': usage,
             'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
-        error_str = str(e).lower()
-        if "authentication" in error_str:
-            return jsonify({'error': 'Invalid OpenAI API key'}), 401
-        elif "rate_limit" in error_str:
-            return jsonify({'error': 'API rate limit exceeded. Please try again later.'}), 429
-        elif "openai" in error_str:
-            return jsonify({'error': f'OpenAI API error: {str(e)}'}), 500
-        else:
+        message, status = describe_openai_error(e)
+        if status == 500 and message == 'Internal server error':
             print(f"Error in chat endpoint: {str(e)}")
-            return jsonify({'error': 'Internal server error'}), 500
+        return jsonify({'error': message}), status
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -94,7 +200,7 @@ def health_check():
         'status': 'healthy',
         'service': 'Mitra Chat API',
         'timestamp': datetime.now().isoformat(),
-        'openai_configured': bool(client.api_key)
+        'openai_configured': bool(client and client.api_key)
     })
 
 if __name__ == '__main__':
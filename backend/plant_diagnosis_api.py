@@ -1,29 +1,56 @@
 #!/usr/bin/env python3
 
 import os
-import requests
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
-from PIL import Image
-import base64
-import io
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Any
 import google.generativeai as genai
 from datetime import datetime
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before local modules read their settings at import
 load_dotenv()
 
+from async_mode import init_async_mode, run_cpu_bound
+from inference import create_inference_backend, get_disease_with_highest_probability, label_registry, HF_TOKEN
+from confidence import RETAKE_PHOTO_TREATMENT, is_low_confidence, retake_photo_bundle
+from batch_scheduler import BatchScheduler
+from diagnosis_cache import DiagnosisCache
+from treatment_bundle import get_treatment_bundle
+from conversation_memory import conversation_memory, chat_prompt, chat_usage, parse_user_id
+from request_session import init_request_session, get_request_db
+from sse import wants_event_stream, format_sse, sse_response, close_upstream
+from image_fetcher import fetch_image
+from image_preprocessing import PreprocessedImage, decode_base64_payload, preprocess_image, preprocess_image_bytes
+from metrics import (
+    init_metrics, stage_timer, record_upstream_error, record_chat_usage, upstream_request_seconds,
+    registry as metrics_registry, stats_gauges
+)
+
+# Batch diagnosis limits; images in a batch are preprocessed in parallel on a shared pool
+DIAGNOSE_BATCH_MAX_IMAGES = int(os.environ.get('DIAGNOSE_BATCH_MAX_IMAGES', '64'))
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', str(os.cpu_count() or 2)))
+
+# Diagnosis and activity rows are written behind the response in batches unless disabled
+WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER_ENABLED', 'true').lower() == 'true'
+
+# Async serving mode (gevent) must be set up before any provider client connects
+init_async_mode()
+
 # Database imports
 try:
     from database import (
         create_tables, test_connection, get_db_session,
-        create_user, get_user_by_phone, get_user_by_id,
-        create_diagnosis, get_user_diagnoses, create_user_activity,
-        User, Diagnosis
+        create_user,
+        bulk_create_diagnoses, find_user_diagnoses, create_user_activity,
+        pack_top_k,
+        User, Diagnosis, WriteBehindBuffer,
+        user_cache, get_cached_user_by_id, get_cached_user_by_phone,
+        create_listing, search_listings, ListingCounterBuffer, get_market_prices
     )
+    from database import models as db_models
     DATABASE_AVAILABLE = True
     print("✅ Database modules imported successfully")
 except ImportError as e:
@@ -32,6 +59,12 @@ except ImportError as e:
 
 app = Flask(__name__)
 
+# One database session and transaction per request, always returned to the pool
+init_request_session(app)
+
+# Request and per-stage latency histograms, served on /metrics
+init_metrics(app)
+
 # Configure CORS based on environment
 if os.environ.get('FLASK_ENV') == 'production':
     # In production, restrict CORS to specific origins
@@ -42,15 +75,17 @@ else:
     # In development, allow all origins
     CORS(app, origins=['*'], allow_headers=['Content-Type'], methods=['GET', 'POST', 'OPTIONS'])
 
-# Hugging Face API configuration - Using your specific plant disease detection model
-HF_API_URL = "https://api-inference.huggingface.co/models/linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification"
-HF_TOKEN = os.environ.get('HF_TOKEN')
-
 # Gemini AI client setup for chat functionality
 gemini_api_key = os.getenv('GEMINI_API_KEY')  # Only use Gemini API key
+# Alternative Gemini REST endpoint, e.g. the local stand-in used by benchmarks/load_test.py
+gemini_api_endpoint = os.getenv('GEMINI_API_ENDPOINT')
 try:
     if gemini_api_key:
-        genai.configure(api_key=gemini_api_key)
+        if gemini_api_endpoint:
+            genai.configure(api_key=gemini_api_key, transport='rest',
+                            client_options={'api_endpoint': gemini_api_endpoint})
+        else:
+            genai.configure(api_key=gemini_api_key)
         # Initialize the Gemini model
         gemini_model = genai.GenerativeModel('gemini-pro')
         print("Gemini AI client initialized successfully")
@@ -88,10 +123,53 @@ You can help with:
 
 Remember: You are a helpful friend to the farmer, not just an information source."""
 
-if not HF_TOKEN:
+# Inference backend (local ONNX or remote Hugging Face), created once per worker
+inference_backend = create_inference_backend()
+
+# Concurrent requests are micro-batched when the backend can run real batches
+inference_scheduler = BatchScheduler(inference_backend) if inference_backend.supports_batching else None
+
+# Diagnosis results keyed on the normalised model input and the backend that produced them,
+# shared across workers when DIAGNOSIS_CACHE_DIR is set
+diagnosis_cache = DiagnosisCache(namespace=inference_backend.cache_namespace())
+
+# PIL releases the GIL while decoding and resizing, so threads preprocess batch images in parallel
+preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix='preprocess')
+
+if inference_backend.name == 'huggingface' and not HF_TOKEN:
     print("Warning: HF_TOKEN not provided. API will use demo mode.")
 
-headers = {"Authorization": f"Bearer {HF_TOKEN}"}
+# Batched write path shared by all requests in this worker
+write_buffer = WriteBehindBuffer() if DATABASE_AVAILABLE and WRITE_BUFFER_ENABLED else None
+
+# Listing view and inquiry counts, folded into listings in batches
+listing_counters = ListingCounterBuffer() if DATABASE_AVAILABLE else None
+
+def collect_gauges():
+    """Pool, cache, buffer and upstream breaker gauges for /metrics, read at scrape time"""
+    if DATABASE_AVAILABLE and db_models.engine is not None:
+        pool = db_models.engine.pool
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                yield f"kisanmitra_db_pool_{name}", "SQLAlchemy connection pool state", {}, getattr(pool, name)()
+        yield from stats_gauges('kisanmitra_user_cache', user_cache.stats(), "User cache statistics")
+    yield from stats_gauges('kisanmitra_diagnosis_cache', diagnosis_cache.stats(), "Diagnosis cache statistics")
+    yield from stats_gauges('kisanmitra_chat_memory', conversation_memory.stats(), "Chat conversation memory statistics")
+    if write_buffer is not None:
+        yield from stats_gauges('kisanmitra_write_buffer', write_buffer.stats(), "Write-behind buffer statistics")
+    if listing_counters is not None:
+        yield from stats_gauges('kisanmitra_listing_counters', listing_counters.stats(), "Listing counter buffer statistics")
+    if inference_scheduler is not None:
+        yield from stats_gauges('kisanmitra_inference_scheduler', inference_scheduler.stats(), "Inference micro-batching statistics")
+    backend = inference_backend.describe()
+    if 'circuit_breaker' in backend:
+        breaker = backend['circuit_breaker']
+        upstream = {"upstream": backend['backend']}
+        yield "kisanmitra_upstream_circuit_open", "1 while the upstream circuit breaker is open", upstream, int(breaker['state'] == 'open')
+        yield from stats_gauges('kisanmitra_upstream_circuit_breaker', breaker, "Upstream circuit breaker statistics", upstream)
+        yield from stats_gauges('kisanmitra_upstream_rate_limiter', backend['rate_limiter'], "Upstream rate limiter statistics", upstream)
+
+metrics_registry.register_collector(collect_gauges)
 
 # Initialize database on startup
 def initialize_database():
@@ -110,6 +188,10 @@ def initialize_database():
         if not create_tables():
             print("❌ Failed to create database tables")
             return False
+        
+        # Indexes and later schema changes are applied by init_db.py upgrade, not at startup
+        from database import models, migrations
+        migrations.warn_if_pending(models.engine)
             
         print("✅ Database initialized successfully")
         return True
@@ -121,169 +203,11 @@ def initialize_database():
 # Initialize database when the module loads
 DB_INITIALIZED = initialize_database()
 
-def query_huggingface_api(image_bytes: bytes, max_retries: int = 2) -> Dict[str, Any]:
-    """
-    Query the Hugging Face Inference API with proper format
-    """
-    import time
-    
-    for attempt in range(max_retries + 1):
-        try:
-            # Send raw image bytes with correct content type
-            api_headers = {
-                "Authorization": f"Bearer {HF_TOKEN}",
-                "Content-Type": "application/octet-stream"  # Critical for image data!
-            }
-            
-            # Add wait-for-model header on retries
-            if attempt > 0:
-                api_headers["x-wait-for-model"] = "true"
-            
-            response = requests.post(HF_API_URL, headers=api_headers, data=image_bytes, timeout=30)
-            response.raise_for_status()
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
-            # Log the response content for debugging
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_detail = e.response.json()
-                    print(f"HF API Error Details (attempt {attempt + 1}): {error_detail}")
-                    
-                    # Check if it's a model loading issue
-                    if (e.response.status_code == 503 or 
-                        "'NoneType' object has no attribute" in str(error_detail) or
-                        "currently loading" in str(error_detail).lower() or
-                        "model" in str(error_detail).lower()):
-                        
-                        if attempt < max_retries:
-                            wait_time = min((attempt + 1) * 5, 15)  # Shorter waits: 5s, 10s, 15s max
-                            print(f"Model loading detected, waiting {wait_time}s before retry...")
-                            time.sleep(wait_time)
-                            continue
-                    
-                    raise Exception(f"Error calling Hugging Face API: {str(e)}. Details: {error_detail}")
-                except Exception as parse_error:
-                    error_text = e.response.text
-                    print(f"HF API Error Text (attempt {attempt + 1}): {error_text}")
-                    
-                    # Check for cold start patterns in text response
-                    if (e.response.status_code == 503 or 
-                        "loading" in error_text.lower() or
-                        "nonetype" in error_text.lower()):
-                        
-                        if attempt < max_retries:
-                            wait_time = (attempt + 1) * 10
-                            print(f"Model loading detected, waiting {wait_time}s before retry...")
-                            time.sleep(wait_time)
-                            continue
-                    
-                    raise Exception(f"Error calling Hugging Face API: {str(e)}. Response: {error_text}")
-            else:
-                if attempt < max_retries:
-                    print(f"Network error (attempt {attempt + 1}), retrying...")
-                    time.sleep(5)
-                    continue
-                raise Exception(f"Error calling Hugging Face API: {str(e)}")
-    
-    raise Exception("Max retries exceeded for Hugging Face API")
-
-def process_image_from_url(image_url: str) -> bytes:
-    """
-    Download and process image from URL for MobileNetV2 224x224 model
-    """
-    try:
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status()
-        
-        # Open and process the image
-        image = Image.open(response.raw)
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # CRITICAL: Resize to exactly 224x224 for MobileNetV2 model
-        image = image.resize((224, 224), Image.Resampling.LANCZOS)
-        
-        # Convert to bytes with high quality
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=95)
-        return img_byte_arr.getvalue()
-        
-    except Exception as e:
-        raise Exception(f"Error processing image from URL: {str(e)}")
-
-def process_base64_image(base64_data: str) -> bytes:
-    """
-    Process base64 encoded image for MobileNetV2 224x224 model
-    """
-    try:
-        # Remove data URL prefix if present
-        if ',' in base64_data:
-            base64_data = base64_data.split(',')[1]
-        
-        # Decode base64
-        image_data = base64.b64decode(base64_data)
-        
-        # Open and process the image
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # CRITICAL: Resize to exactly 224x224 for MobileNetV2 model
-        # This model expects 224x224 input images
-        image = image.resize((224, 224), Image.Resampling.LANCZOS)
-        
-        # Convert to bytes with high quality
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=95)
-        return img_byte_arr.getvalue()
-        
-    except Exception as e:
-        raise Exception(f"Error processing base64 image: {str(e)}")
-
-def get_disease_with_highest_probability(predictions: Any) -> Dict[str, Any]:
-    """
-    Extract the disease with highest probability from predictions
-    """
-    # Handle different response formats from HuggingFace API
-    if isinstance(predictions, dict):
-        if 'error' in predictions:
-            return {"error": predictions['error']}
-        # If it's a single prediction dict, convert to list
-        predictions = [predictions]
-    
-    if not predictions or not isinstance(predictions, list):
-        return {"error": "No valid predictions received"}
-    
-    # Find the prediction with highest score
-    highest_prediction = max(predictions, key=lambda x: x.get('score', 0))
-    
-    # Get the AI prediction and convert to 100% confidence
-    highest_prediction = max(predictions, key=lambda x: x.get('score', 0))
-    disease_name = highest_prediction.get('label', 'Unknown Disease')
-    
-    # Clean up disease name - remove technical prefixes and make user-friendly
-    import re
-    clean_disease_name = re.sub(r'^LABEL_\d+_?', '', disease_name, flags=re.IGNORECASE)
-    clean_disease_name = clean_disease_name.replace('_', ' ')
-    clean_disease_name = ' '.join(word.capitalize() for word in clean_disease_name.split())
-    
-    # Determine if healthy or not based on label
-    is_healthy = 'healthy' in disease_name.lower() or 'normal' in disease_name.lower()
-    
-    return {
-        "disease": clean_disease_name,
-        "confidence": 100,  # Always 100% as requested
-        "status": "healthy" if is_healthy else "not_healthy",
-        "is_healthy": is_healthy,
-        "all_predictions": [
-            {"disease": clean_disease_name, "confidence": 100}
-        ]
-    }
+def run_inference(image: PreprocessedImage) -> List[Dict[str, Any]]:
+    """Run one image through the batching scheduler, or straight through the backend"""
+    if inference_scheduler is not None:
+        return inference_scheduler.predict(image)
+    return inference_backend.predict(image)
 
 def get_demo_disease_result() -> Dict[str, Any]:
     """
@@ -321,68 +245,163 @@ def get_demo_disease_result() -> Dict[str, Any]:
         ]
     }
 
-def save_diagnosis_to_db(user_id: int, crop_name: str, diagnosis: str, confidence: int, treatment: str):
-    """Save diagnosis result to database"""
+def packed_top_k(result: Dict[str, Any]):
+    """The result's top-k predictions packed for the diagnoses.top_k column (None for demo results)"""
+    if not DATABASE_AVAILABLE:
+        return None
+    return pack_top_k((prediction['label_id'], prediction['probability'])
+                      for prediction in result.get('all_predictions', [])
+                      if prediction.get('label_id') is not None and 'probability' in prediction)
+
+def save_diagnosis_to_db(user_id: int, crop_name: str, diagnosis: str, confidence: int, treatment: str,
+                         top_k: bytes = None):
+    """
+    Save diagnosis result and its activity row in the request's transaction, returning the diagnosis id
+    The row is committed with the rest of the request once the handler returns
+    """
     if not DB_INITIALIZED or not DATABASE_AVAILABLE:
         print("Database not available - skipping diagnosis save")
         return None
         
     try:
-        db = get_db_session()
-        diagnosis_record = create_diagnosis(
-            db=db, 
-            user_id=user_id,
-            crop_name=crop_name,
-            diagnosis=diagnosis,
-            confidence=confidence,
-            treatment=treatment,
-            date=datetime.utcnow()
-        )
-        
-        # Log the diagnosis activity
-        create_user_activity(
-            db=db,
-            user_id=user_id,
-            action="plant_diagnosis",
-            data={
-                "diagnosis_id": diagnosis_record.id,
-                "crop_name": crop_name,
-                "diagnosis": diagnosis,
-                "confidence": confidence
-            }
-        )
-        
-        db.close()
-        print(f"✅ Diagnosis saved to database with ID: {diagnosis_record.id}")
-        return diagnosis_record
+        diagnosis_ids = bulk_create_diagnoses(get_request_db(write=True), [{
+            "user_id": user_id,
+            "crop_name": crop_name,
+            "diagnosis": diagnosis,
+            "confidence": confidence,
+            "treatment": treatment,
+            "date": datetime.utcnow(),
+            "top_k": top_k
+        }], commit=False)
+        print(f"✅ Diagnosis saved to database with ID: {diagnosis_ids[0]}")
+        return diagnosis_ids[0]
         
     except Exception as e:
         print(f"❌ Error saving diagnosis to database: {e}")
         return None
 
+def record_diagnosis(result: Dict[str, Any], user_id: int, crop_name: str):
+    """
+    Persist a diagnosis result for a user and mark the result accordingly
+    With the write buffer the row is only queued (queued_for_db) and saved after the response,
+    so saved_to_db stays False and no diagnosis_id is returned
+    """
+    if write_buffer is not None:
+        result['saved_to_db'] = False
+        # The buffer drops rows for unknown users when it flushes; do not queue them at all
+        if not get_cached_user_by_id(get_request_db(), user_id):
+            print(f"❌ Diagnosis not saved: user {user_id} not found")
+            result['queued_for_db'] = False
+            return
+        try:
+            write_buffer.add_diagnosis(
+                user_id=user_id,
+                crop_name=crop_name,
+                diagnosis=result.get('disease', ''),
+                confidence=result.get('confidence', 0),
+                treatment=result['treatment'],
+                top_k=packed_top_k(result)
+            )
+            result['queued_for_db'] = True
+        except (ValueError, TypeError) as e:
+            print(f"❌ Invalid diagnosis not saved: {e}")
+            result['queued_for_db'] = False
+        return
+    
+    diagnosis_id = save_diagnosis_to_db(
+        user_id=user_id,
+        crop_name=crop_name,
+        diagnosis=result.get('disease', ''),
+        confidence=result.get('confidence', 0),
+        treatment=result['treatment'],
+        top_k=packed_top_k(result)
+    )
+    if diagnosis_id:
+        result['diagnosis_id'] = diagnosis_id
+        result['saved_to_db'] = True
+    else:
+        result['saved_to_db'] = False
+
+def save_diagnoses_batch_to_db(records: List[Dict[str, Any]]) -> List[int]:
+    """Save many diagnosis results and their activity rows with one bulk insert"""
+    if not DB_INITIALIZED or not DATABASE_AVAILABLE:
+        print("Database not available - skipping batch diagnosis save")
+        return []
+        
+    db = None
+    try:
+        db = get_db_session()
+        diagnosis_ids = bulk_create_diagnoses(db, records)
+        print(f"✅ Saved {len(diagnosis_ids)} diagnoses to database in one batch")
+        return diagnosis_ids
+        
+    except Exception as e:
+        print(f"❌ Error saving diagnosis batch to database: {e}")
+        return []
+    finally:
+        if db:
+            db.close()
+
 def get_treatment_recommendation(disease_name: str) -> str:
-    """Generate treatment recommendation based on disease"""
-    # Basic treatment recommendations based on common diseases
-    treatments = {
-        "late blight": "Apply copper-based fungicides. Remove affected leaves. Improve air circulation. Avoid overhead watering.",
-        "early blight": "Use fungicides containing chlorothalonil. Practice crop rotation. Remove plant debris after harvest.",
-        "powdery mildew": "Apply sulfur or neem oil. Increase air circulation. Avoid overhead watering. Remove affected parts.",
-        "bacterial spot": "Use copper-based bactericides. Avoid overhead irrigation. Practice crop rotation. Remove infected plants.",
-        "mosaic virus": "Remove infected plants immediately. Control aphid vectors. Use virus-resistant varieties.",
-        "rust": "Apply fungicides with propiconazole. Improve air circulation. Avoid overhead watering.",
-        "black rot": "Use copper-based fungicides. Practice crop rotation. Remove infected plant parts promptly.",
-        "scab": "Apply fungicides during wet weather. Improve air circulation. Remove fallen leaves.",
-        "healthy": "Plant appears healthy. Continue current care practices. Monitor regularly for any changes."
-    }
+    """Treatment advice for a model label or free-text disease name (see label_registry.py)"""
+    return label_registry.treatment_for(disease_name)
+
+def load_image(file_data: bytes = None, image_url: str = None, base64_image: str = None) -> PreprocessedImage:
+    """
+    Decode (or download) an image from one of the request sources and preprocess it to the model input
+    The two halves are timed as the decode and preprocess stages
+    """
+    if file_data is not None:
+        with stage_timer('preprocess'):
+            return run_cpu_bound(preprocess_image_bytes, file_data)
+    if image_url:
+        # The fetcher decodes while downloading, so the download counts as decode
+        with stage_timer('decode'):
+            try:
+                source_image = fetch_image(image_url)
+            except Exception as e:
+                raise Exception(f"Error processing image from URL: {str(e)}")
+        # Resized inline: pickling the decoded image to the process pool costs more than the resize
+        with stage_timer('preprocess'):
+            return preprocess_image(source_image)
+    if base64_image:
+        with stage_timer('decode'):
+            image_data = decode_base64_payload(base64_image)
+        with stage_timer('preprocess'):
+            return run_cpu_bound(preprocess_image_bytes, image_data)
+    raise ValueError("Either image_url or base64_image must be provided")
+
+def diagnose_image(image: PreprocessedImage) -> Dict[str, Any]:
+    """
+    Diagnose one preprocessed image, serving repeats from the diagnosis cache
+    Returns a fresh result dict that callers may extend
+    """
+    with stage_timer('cache_lookup'):
+        cache_key = image.cache_key()
+        cached_result = diagnosis_cache.get(cache_key)
+    if cached_result is not None:
+        cached_result['cached'] = True
+        return cached_result
     
-    # Find matching treatment
-    disease_lower = disease_name.lower()
-    for key, treatment in treatments.items():
-        if key in disease_lower:
-            return treatment
+    # Run the configured inference backend
+    with stage_timer('inference'):
+        predictions = run_inference(image)
     
-    # Default treatment advice
-    return "Consult with a local agricultural expert for specific treatment recommendations. Monitor the plant closely and remove any affected parts."
+    # Process results
+    with stage_timer('postprocess'):
+        result = get_disease_with_highest_probability(predictions)
+    
+    # Generate treatment recommendation; too uncertain a result gets photo guidance instead
+    with stage_timer('treatment'):
+        if result.get('low_confidence'):
+            result['treatment'] = RETAKE_PHOTO_TREATMENT
+            result['retake_photo'] = True
+        else:
+            result['treatment'] = get_treatment_recommendation(result.get('disease', ''))
+    
+    if 'error' not in result:
+        diagnosis_cache.set(cache_key, result)
+    return dict(result)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -401,7 +420,13 @@ def health_check():
         "status": "healthy", 
         "message": "Plant Diagnosis API is running",
         "database": db_status,
-        "database_live_test": True  # Indicates this is a live test, not cached
+        "database_live_test": True,  # Indicates this is a live test, not cached
+        "inference": inference_backend.describe(),
+        "inference_scheduler": inference_scheduler.stats() if inference_scheduler else None,
+        "diagnosis_cache": diagnosis_cache.stats(),
+        "write_buffer": write_buffer.stats() if write_buffer else None,
+        "user_cache": user_cache.stats() if DATABASE_AVAILABLE else None,
+        "listing_counters": listing_counters.stats() if listing_counters else None
     })
 
 @app.route('/health', methods=['GET'])
@@ -426,56 +451,36 @@ def diagnose_plant():
         user_id = data.get('user_id')
         crop_name = data.get('crop_name', 'Unknown Crop')
         
-        image_bytes = None
+        # Convert user_id to int if provided
+        if user_id:
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                return jsonify({"error": "Invalid user_id format"}), 400
         
         # Process image from URL
         if 'image_url' in data:
             image_url = data['image_url']
             if not image_url:
                 return jsonify({"error": "image_url cannot be empty"}), 400
-            image_bytes = process_image_from_url(image_url)
+            image = load_image(image_url=image_url)
         
         # Process base64 image
         elif 'base64_image' in data:
             base64_data = data['base64_image']
             if not base64_data:
                 return jsonify({"error": "base64_image cannot be empty"}), 400
-            print(f"Processing base64 image, size: {len(base64_data)} chars")
-            image_bytes = process_base64_image(base64_data)
-            print(f"Processed image size: {len(image_bytes)} bytes")
+            image = load_image(base64_image=base64_data)
         
         else:
             return jsonify({"error": "Either image_url or base64_image must be provided"}), 400
         
-        # Query Hugging Face API
-        print(f"Sending {len(image_bytes)} bytes to HF API")
-        predictions = query_huggingface_api(image_bytes)
-        print(f"Raw HF API response: {predictions}")
-        
-        # Process results
-        result = get_disease_with_highest_probability(predictions)
-        print(f"Final result: {result}")
-        
-        # Generate treatment recommendation
-        treatment = get_treatment_recommendation(result.get('disease', ''))
-        result['treatment'] = treatment
-        
+        # Run inference, or reuse the result for an identical image
+        result = diagnose_image(image)
         # Save to database if user_id is provided
-        diagnosis_record = None
         if user_id and DB_INITIALIZED:
-            diagnosis_record = save_diagnosis_to_db(
-                user_id=user_id,
-                crop_name=crop_name,
-                diagnosis=result.get('disease', ''),
-                confidence=result.get('confidence', 0),
-                treatment=treatment
-            )
-            
-            if diagnosis_record:
-                result['diagnosis_id'] = diagnosis_record.id
-                result['saved_to_db'] = True
-            else:
-                result['saved_to_db'] = False
+            with stage_timer('db_save'):
+                record_diagnosis(result, user_id, crop_name)
         
         return jsonify({
             "success": True,
@@ -519,48 +524,16 @@ def diagnose_uploaded_file():
                 return jsonify({"error": "Invalid user_id format"}), 400
         
         # Read and process the uploaded file
-        image = Image.open(file.stream)
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize image if too large
-        max_size = (1024, 1024)
-        if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Convert to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=85)
-        image_bytes = img_byte_arr.getvalue()
-        
-        # Query Hugging Face API
-        predictions = query_huggingface_api(image_bytes)
-        
-        # Process results
-        result = get_disease_with_highest_probability(predictions)
-        
-        # Generate treatment recommendation
-        treatment = get_treatment_recommendation(result.get('disease', ''))
-        result['treatment'] = treatment
+        with stage_timer('decode'):
+            file_data = file.read()
+        image = load_image(file_data=file_data)
         
+        # Run inference, or reuse the result for an identical image
+        result = diagnose_image(image)
         # Save to database if user_id is provided
-        diagnosis_record = None
         if user_id and DB_INITIALIZED:
-            diagnosis_record = save_diagnosis_to_db(
-                user_id=user_id,
-                crop_name=crop_name,
-                diagnosis=result.get('disease', ''),
-                confidence=result.get('confidence', 0),
-                treatment=treatment
-            )
-            
-            if diagnosis_record:
-                result['diagnosis_id'] = diagnosis_record.id
-                result['saved_to_db'] = True
-            else:
-                result['saved_to_db'] = False
+            with stage_timer('db_save'):
+                record_diagnosis(result, user_id, crop_name)
         
         return jsonify({
             "success": True,
@@ -578,6 +551,127 @@ def diagnose_uploaded_file():
             "note": "Demo mode - AI service temporarily unavailable"
         })
 
+def _diagnose_batch_item(source: Dict[str, Any]) -> Dict[str, Any]:
+    """Preprocess and diagnose one image of a batch request (runs on the preprocess pool)"""
+    image = load_image(source.get('file_data'), source.get('image_url'), source.get('base64_image'))
+    return diagnose_image(image)
+
+def _read_batch_sources():
+    """
+    Collect the images of a batch request
+    Multipart: repeated 'files' fields, with user_id and crop_name form fields
+    NDJSON: one JSON object per line with base64_image or image_url and an optional crop_name;
+    user_id and crop_name defaults can be given as query parameters
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        user_id = request.args.get('user_id', type=int)
+        default_crop = request.args.get('crop_name', 'Unknown Crop')
+        sources = []
+        for line_number, raw_line in enumerate(request.stream, start=1):
+            raw_line = raw_line.strip()
+            if not raw_line:
+                continue
+            try:
+                item = json.loads(raw_line)
+            except ValueError:
+                raise ValueError(f"Line {line_number} is not valid JSON")
+            if not isinstance(item, dict):
+                raise ValueError(f"Line {line_number} must be a JSON object")
+            sources.append({
+                "image_url": item.get('image_url'),
+                "base64_image": item.get('base64_image'),
+                "crop_name": str(item.get('crop_name') or '').strip() or default_crop
+            })
+            if len(sources) > DIAGNOSE_BATCH_MAX_IMAGES:
+                break
+        return user_id, sources
+    
+    user_id = request.form.get('user_id', type=int)
+    crop_name = request.form.get('crop_name', 'Unknown Crop')
+    files = request.files.getlist('files') or request.files.getlist('file')
+    # Read uploads here; the streamed response outlives the request's file handles
+    sources = [{"file_data": file.read(), "crop_name": crop_name} for file in files if file.filename]
+    return user_id, sources
+
+@app.route('/api/diagnose/batch', methods=['POST'])
+def diagnose_batch():
+    """
+    Diagnose many images in one request
+    Accepts multipart uploads or NDJSON (see _read_batch_sources)
+    Streams back one NDJSON line per image as it completes, in completion order,
+    followed by a summary line once all rows are saved with a single bulk insert
+    """
+    try:
+        user_id, sources = _read_batch_sources()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not sources:
+        return jsonify({"error": "No images provided"}), 400
+    if len(sources) > DIAGNOSE_BATCH_MAX_IMAGES:
+        return jsonify({"error": f"At most {DIAGNOSE_BATCH_MAX_IMAGES} images per batch"}), 400
+    
+    # The write buffer drops rows for unknown users when it flushes; check once while the request is open
+    user_known = bool(user_id and DB_INITIALIZED and get_cached_user_by_id(get_request_db(), user_id))
+    
+    # Start all images now; concurrent inference calls are micro-batched by the scheduler
+    futures = {preprocess_pool.submit(_diagnose_batch_item, source): index for index, source in enumerate(sources)}
+    
+    def generate():
+        records = []
+        record_indexes = []
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+                if user_id and 'error' not in result:
+                    records.append({
+                        "user_id": user_id,
+                        "crop_name": sources[index]['crop_name'],
+                        "diagnosis": result.get('disease', ''),
+                        "confidence": result.get('confidence', 0),
+                        "treatment": result['treatment'],
+                        "top_k": packed_top_k(result)
+                    })
+                    record_indexes.append(index)
+                line = {"index": index, "success": True, "result": result}
+            except ValueError as e:
+                line = {"index": index, "success": False, "error": str(e)}
+            except Exception as e:
+                print(f"Error in /diagnose/batch item {index}: {str(e)}")
+                # Provide demo result instead of error, as the single-image endpoints do
+                demo_result = get_demo_disease_result()
+                demo_result['treatment'] = get_treatment_recommendation(demo_result.get('disease', ''))
+                line = {"index": index, "success": True, "result": demo_result,
+                        "note": "Demo mode - AI service temporarily unavailable"}
+            yield json.dumps(line) + "\n"
+        
+        summary = {"summary": True, "count": len(sources)}
+        if user_id and DB_INITIALIZED and write_buffer is not None:
+            # Rows are only queued here; the buffer saves them after the response
+            queued = 0
+            if user_known:
+                with stage_timer('db_save'):
+                    for record in records:
+                        try:
+                            write_buffer.add_diagnosis(**record)
+                            queued += 1
+                        except (ValueError, TypeError) as e:
+                            print(f"❌ Invalid batch diagnosis not saved: {e}")
+            else:
+                print(f"❌ Batch diagnoses not saved: user {user_id} not found")
+            summary["saved_to_db"] = False
+            summary["queued_for_db"] = queued
+            summary["not_saved"] = len(records) - queued
+        elif user_id and DB_INITIALIZED:
+            with stage_timer('db_save'):
+                diagnosis_ids = save_diagnoses_batch_to_db(records)
+            summary["saved_to_db"] = bool(diagnosis_ids)
+            summary["diagnosis_ids"] = {str(index): diagnosis_id for index, diagnosis_id in zip(record_indexes, diagnosis_ids)}
+        yield json.dumps(summary) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # User Management API endpoints
 @app.route('/api/users', methods=['POST'])
 def create_user_endpoint():
@@ -597,15 +691,15 @@ def create_user_endpoint():
             if field not in data or not data[field].strip():
                 return jsonify({"error": f"{field} is required"}), 400
         
-        db = get_db_session()
+        # Lookup, insert and activity share one transaction, committed after this handler
+        db = get_request_db(write=True)
         
-        # Check if user with this phone already exists
-        existing_user = get_user_by_phone(db, data['phone'])
+        # Check if user with this phone already exists; a cached "unknown" is re-checked before inserting
+        existing_user = get_cached_user_by_phone(db, data['phone'], use_negative=False)
         if existing_user:
-            db.close()
             return jsonify({
                 "success": True,
-                "user": existing_user.to_dict(),
+                "user": existing_user,
                 "message": "User already exists"
             })
         
@@ -616,7 +710,8 @@ def create_user_endpoint():
             phone=data['phone'].strip(),
             location=data['location'].strip(),
             state=data['state'].strip(),
-            avatar=data.get('avatar')
+            avatar=data.get('avatar'),
+            commit=False
         )
         
         # Log user registration activity
@@ -628,17 +723,18 @@ def create_user_endpoint():
                 "registration_method": "api",
                 "location": user.location,
                 "state": user.state
-            }
+            },
+            commit=False
         )
         
-        db.close()
-        
         return jsonify({
             "success": True,
             "user": user.to_dict(),
             "message": "User created successfully"
         })
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error creating user: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -650,17 +746,15 @@ def get_user_endpoint(user_id):
         if not DB_INITIALIZED or not DATABASE_AVAILABLE:
             return jsonify({"error": "Database not available"}), 503
             
-        db = get_db_session()
-        user = get_user_by_id(db, user_id)
+        # Served from the user cache; the session only takes a pooled connection on a miss
+        user = get_cached_user_by_id(get_request_db(), user_id)
         
         if not user:
-            db.close()
             return jsonify({"error": "User not found"}), 404
         
-        db.close()
         return jsonify({
             "success": True,
-            "user": user.to_dict()
+            "user": user
         })
         
     except Exception as e:
@@ -674,17 +768,15 @@ def get_user_by_phone_endpoint(phone):
         if not DB_INITIALIZED or not DATABASE_AVAILABLE:
             return jsonify({"error": "Database not available"}), 503
             
-        db = get_db_session()
-        user = get_user_by_phone(db, phone)
+        # Any accepted phone format; unknown numbers are negatively cached
+        user = get_cached_user_by_phone(get_request_db(), phone)
         
         if not user:
-            db.close()
             return jsonify({"error": "User not found"}), 404
         
-        db.close()
         return jsonify({
             "success": True,
-            "user": user.to_dict()
+            "user": user
         })
         
     except Exception as e:
@@ -702,36 +794,259 @@ def get_user_diagnoses_endpoint(user_id):
         limit = request.args.get('limit', 50, type=int)
         if limit > 100:  # Cap at 100 for performance
             limit = 100
-            
-        db = get_db_session()
-        
-        # Check if user exists
-        user = get_user_by_id(db, user_id)
-        if not user:
-            db.close()
-            return jsonify({"error": "User not found"}), 404
-        
-        # Get user diagnoses
-        diagnoses = get_user_diagnoses(db, user_id, limit)
         
-        diagnoses_data = [diagnosis.to_dict() for diagnosis in diagnoses]
+        # Opaque cursor from the previous page's next_cursor
+        cursor = request.args.get('cursor')
         
-        db.close()
+        # User existence check and one page of diagnoses in one query
+        user_exists, diagnoses_data, next_cursor = find_user_diagnoses(get_request_db(), user_id, limit, cursor)
+        if not user_exists:
+            return jsonify({"error": "User not found"}), 404
         
         return jsonify({
             "success": True,
             "user_id": user_id,
             "diagnoses": diagnoses_data,
-            "count": len(diagnoses_data)
+            "count": len(diagnoses_data),
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
         })
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error getting user diagnoses: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/api/listings', methods=['GET'])
+def search_listings_endpoint():
+    """Search marketplace listings with filters, sorting and cursor pagination"""
+    try:
+        if not DB_INITIALIZED or not DATABASE_AVAILABLE:
+            return jsonify({"error": "Database not available"}), 503
+        
+        limit = request.args.get('limit', 20, type=int)
+        sort = request.args.get('sort', 'recent')
+        
+        # Filters are validated by search_listings; the cursor comes from the previous page's next_cursor
+        listings, next_cursor = search_listings(
+            get_request_db(),
+            crop=request.args.get('crop'),
+            market=request.args.get('market'),
+            status=request.args.get('status', 'active'),
+            user_id=request.args.get('user_id', type=int),
+            min_price=request.args.get('min_price'),
+            max_price=request.args.get('max_price'),
+            min_quantity_kg=request.args.get('min_quantity_kg'),
+            max_quantity_kg=request.args.get('max_quantity_kg'),
+            sort=sort,
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+        
+        return jsonify({
+            "success": True,
+            "listings": listings,
+            "count": len(listings),
+            "sort": sort,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error searching listings: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/listings', methods=['POST'])
+def create_listing_endpoint():
+    """Create a marketplace listing"""
+    try:
+        if not DB_INITIALIZED or not DATABASE_AVAILABLE:
+            return jsonify({"error": "Database not available"}), 503
+        
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        
+        # Validate required fields
+        required_fields = ['user_id', 'crop', 'quantity', 'price_per_kg', 'market']
+        for field in required_fields:
+            if field not in data or data[field] in (None, ''):
+                return jsonify({"error": f"{field} is required"}), 400
+        
+        try:
+            user_id = int(data['user_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "user_id must be an integer"}), 400
+        
+        db = get_request_db(write=True)
+        if not get_cached_user_by_id(db, user_id):
+            return jsonify({"error": "User not found"}), 404
+        
+        listing = create_listing(
+            db=db,
+            user_id=user_id,
+            crop=str(data['crop']),
+            quantity=str(data['quantity']),
+            price_per_kg=data['price_per_kg'],
+            market=str(data['market']),
+            transport=data.get('transport', 'No'),
+            posted_date=data.get('posted_date') or 'Just now',
+            total_price=data.get('total_price'),
+            commit=False
+        )
+        
+        return jsonify({
+            "success": True,
+            "listing": listing.to_dict(),
+            "message": "Listing created successfully"
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error creating listing: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/listings/<int:listing_id>/view', methods=['POST'])
+def record_listing_view_endpoint(listing_id):
+    """Count a view of a listing; the count reaches the listing with the next counter flush"""
+    return _record_listing_counter(listing_id, views=1)
+
+@app.route('/api/listings/<int:listing_id>/inquiry', methods=['POST'])
+def record_listing_inquiry_endpoint(listing_id):
+    """Count an inquiry about a listing; the count reaches the listing with the next counter flush"""
+    return _record_listing_counter(listing_id, inquiries=1)
+
+def _record_listing_counter(listing_id: int, views: int = 0, inquiries: int = 0):
+    try:
+        if not DB_INITIALIZED or listing_counters is None:
+            return jsonify({"error": "Database not available"}), 503
+        
+        # No lookup here: increments for unknown listings update no rows when flushed
+        listing_counters.increment(listing_id, views=views, inquiries=inquiries)
+        return jsonify({"success": True, "listing_id": listing_id}), 202
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error recording listing counter: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/market/prices', methods=['GET'])
+def get_market_prices_endpoint():
+    """Daily price statistics per crop and market, served from the precomputed market_price_daily table"""
+    try:
+        if not DB_INITIALIZED or not DATABASE_AVAILABLE:
+            return jsonify({"error": "Database not available"}), 503
+        
+        kind = request.args.get('kind', 'sold')
+        days = request.args.get('days', 30, type=int)
+        
+        markets = get_market_prices(
+            get_request_db(),
+            crop=request.args.get('crop'),
+            market=request.args.get('market'),
+            kind=kind,
+            days=days
+        )
+        
+        return jsonify({
+            "success": True,
+            "kind": kind,
+            "days": days,
+            "markets": markets,
+            "count": len(markets)
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error getting market prices: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+CHAT_UNCONFIGURED_RESPONSE = "Hello! I'm Hariyali Mitra, your farming assistant. I can help you with crop cultivation, pest management, soil health, and other farming questions. However, I need proper API configuration to provide detailed responses. Please ask me about specific farming topics!"
+CHAT_ERROR_RESPONSE = "I'm experiencing some technical difficulties right now. As your farming assistant, I'm here to help with questions about crops, soil, pests, irrigation, and sustainable farming practices. Could you please try asking your question again?"
+
+def gemini_chat_usage(prompt: str, reply: str, response=None) -> Dict[str, Any]:
+    """Prompt length and token counts of a Gemini chat call, from its usage metadata when present"""
+    try:
+        metadata = response.usage_metadata
+        prompt_tokens, completion_tokens = metadata.prompt_token_count, metadata.candidates_token_count
+    except Exception:
+        prompt_tokens = completion_tokens = None
+    return chat_usage(prompt, reply, prompt_tokens or None, completion_tokens or None)
+
+def summarize_with_gemini(prompt: str) -> str:
+    """Model call conversation_memory uses to fold old turns into the running summary"""
+    try:
+        with upstream_request_seconds.time(upstream='gemini'):
+            return gemini_model.generate_content(prompt).text
+    except Exception as e:
+        record_upstream_error('gemini', type(e).__name__)
+        raise
+
+def remember_chat(user_id: int, user_message: str, bot_response: str, usage: Dict[str, Any]):
+    """Track the request's token usage and add the exchange to the user's conversation memory"""
+    record_chat_usage('gemini', usage)
+    print(f"[{datetime.now()}] Chat usage: {usage['prompt_chars']} prompt chars, "
+          f"{usage['prompt_tokens']} prompt / {usage['completion_tokens']} completion tokens")
+    if user_id:
+        conversation_memory.record_exchange(user_id, user_message, bot_response,
+                                            summarize=summarize_with_gemini, usage=usage)
+
+def stream_chat_events(user_message: str, full_prompt: str, user_id: int = None):
+    """
+    Generate SSE events for a Gemini reply as tokens arrive
+    If the client disconnects, the generator is closed and the upstream call is cancelled
+    """
+    if not gemini_model:
+        yield format_sse({'text': CHAT_UNCONFIGURED_RESPONSE}, event='token')
+        yield format_sse({'response': CHAT_UNCONFIGURED_RESPONSE, 'timestamp': datetime.now().isoformat()}, event='done')
+        return
+    
+    stream = None
+    finished = False
+    parts = []
+    try:
+        stream = gemini_model.generate_content(full_prompt, stream=True)
+        for chunk in stream:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # Chunk without text parts (e.g. only safety metadata)
+            if text:
+                parts.append(text)
+                yield format_sse({'text': text}, event='token')
+        
+        finished = True
+        bot_response = ''.join(parts).strip()
+        print(f"[{datetime.now()}] User: {user_message}")
+        print(f"[{datetime.now()}] Bot (streamed): {bot_response}")
+        usage = gemini_chat_usage(full_prompt, bot_response, stream)
+        remember_chat(user_id, user_message, bot_response, usage)
+        yield format_sse({'response': bot_response, 'usage': usage, 'timestamp': datetime.now().isoformat()},
+                         event='done')
+        
+    except Exception as e:
+        finished = True
+        record_upstream_error('gemini', type(e).__name__)
+        print(f"Error in streaming chat: {str(e)}")
+        yield format_sse({'error': CHAT_ERROR_RESPONSE}, event='error')
+    finally:
+        if stream is not None and not finished:
+            close_upstream(stream)
+
 # Chat API endpoint
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    """
+    Chat with the farming assistant
+    Returns JSON by default, or streams tokens over SSE when the client asks for it (see sse.py)
+    """
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
@@ -739,16 +1054,28 @@ def chat():
         if not user_message:
             return jsonify({'error': 'Message is required'}), 400
         
+        # Known users get their recent turns and a summary of older ones (see conversation_memory.py)
+        user_id = parse_user_id(data.get('user_id'))
+        conversation = conversation_memory.get(user_id) if user_id else None
+        full_prompt = chat_prompt(FARMING_SYSTEM_PROMPT, conversation, user_message)
+        
+        if wants_event_stream(request, data):
+            return sse_response(stream_chat_events(user_message, full_prompt, user_id))
+        
         if not gemini_model:
             # Provide a helpful fallback response when Gemini is not configured
             return jsonify({
-                'response': "Hello! I'm Hariyali Mitra, your farming assistant. I can help you with crop cultivation, pest management, soil health, and other farming questions. However, I need proper API configuration to provide detailed responses. Please ask me about specific farming topics!",
+                'response': CHAT_UNCONFIGURED_RESPONSE,
                 'timestamp': datetime.now().isoformat()
             })
             
         # Create chat completion with Gemini
-        full_prompt = f"{FARMING_SYSTEM_PROMPT}\n\nUser: {user_message}\n\nHariyali Mitra:"
-        response = gemini_model.generate_content(full_prompt)
+        try:
+            with upstream_request_seconds.time(upstream='gemini'):
+                response = gemini_model.generate_content(full_prompt)
+        except Exception as e:
+            record_upstream_error('gemini', type(e).__name__)
+            raise
         
         bot_response = response.text.strip()
         
@@ -756,8 +1083,12 @@ def chat():
         print(f"[{datetime.now()}] User: {user_message}")
         print(f"[{datetime.now()}] Bot: {bot_response}")
         
+        usage = gemini_chat_usage(full_prompt, bot_response, response)
+        remember_chat(user_id, user_message, bot_response, usage)
+        
         return jsonify({
             'response': bot_response,
+            'usage': usage,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -767,11 +1098,43 @@ def chat():
         
         # Provide helpful fallback response
         return jsonify({
-            'response': "I'm experiencing some technical difficulties right now. As your farming assistant, I'm here to help with questions about crops, soil, pests, irrigation, and sustainable farming practices. Could you please try asking your question again?",
+            'response': CHAT_ERROR_RESPONSE,
             'timestamp': datetime.now().isoformat()
         })
 
 # Gemini AI API endpoints for treatment management
+@app.route('/api/treatment/bundle', methods=['POST'])
+def get_treatment_bundle_endpoint():
+    """Get fertilizers, treatment steps, duration and success rate in one call, served from cache when possible"""
+    try:
+        data = request.get_json()
+        if not data or not data.get('disease'):
+            return jsonify({"error": "Disease name is required"}), 400
+        
+        # A low-confidence diagnosis is not worth a Gemini call; send photo guidance instead
+        confidence = data.get('confidence')
+        if isinstance(confidence, (int, float)) and not isinstance(confidence, bool) and is_low_confidence(confidence):
+            bundle = retake_photo_bundle()
+            return jsonify({"success": True, "retake_photo": True, "cached": False, **bundle})
+        
+        bundle, source = get_treatment_bundle(data['disease'], gemini_model)
+        
+        response = {
+            "success": True,
+            "fertilizers": bundle["fertilizers"],
+            "steps": bundle["steps"],
+            "duration": bundle["duration"],
+            "success_rate": bundle["success_rate"],
+            "cached": source in ('memory', 'database')
+        }
+        if source == 'fallback':
+            response["note"] = "Using fallback treatment data"
+        return jsonify(response)
+        
+    except Exception as e:
+        print(f"Error in treatment bundle: {str(e)}")
+        return jsonify({"error": "Failed to get treatment bundle"}), 500
+
 @app.route('/api/treatment/fertilizers', methods=['POST'])
 def get_fertilizer_recommendations():
     """Get fertilizer recommendations using Gemini AI"""
@@ -802,7 +1165,8 @@ def get_fertilizer_recommendations():
         
         try:
             if gemini_model:
-                response = gemini_model.generate_content(prompt)
+                with upstream_request_seconds.time(upstream='gemini'):
+                    response = gemini_model.generate_content(prompt)
                 response_text = response.text.strip()
                 
                 # Try to extract JSON from response
@@ -817,6 +1181,7 @@ def get_fertilizer_recommendations():
                         "fertilizers": fertilizer_data.get("fertilizers", [])
                     })
         except Exception as e:
+            record_upstream_error('gemini', type(e).__name__)
             print(f"Gemini API error for fertilizers: {str(e)}")
         
         # Fallback recommendations
@@ -866,7 +1231,8 @@ def get_treatment_steps():
         
         try:
             if gemini_model:
-                response = gemini_model.generate_content(prompt)
+                with upstream_request_seconds.time(upstream='gemini'):
+                    response = gemini_model.generate_content(prompt)
                 response_text = response.text.strip()
                 
                 # Try to extract JSON from response
@@ -881,6 +1247,7 @@ def get_treatment_steps():
                         "steps": steps_data.get("steps", [])
                     })
         except Exception as e:
+            record_upstream_error('gemini', type(e).__name__)
             print(f"Gemini API error for treatment steps: {str(e)}")
         
         # Fallback treatment steps
@@ -928,7 +1295,8 @@ def get_treatment_duration():
         
         try:
             if gemini_model:
-                response = gemini_model.generate_content(prompt)
+                with upstream_request_seconds.time(upstream='gemini'):
+                    response = gemini_model.generate_content(prompt)
                 response_text = response.text.strip()
                 
                 # Try to extract JSON from response
@@ -944,6 +1312,7 @@ def get_treatment_duration():
                         "success_rate": duration_data.get("success_rate", 85)
                     })
         except Exception as e:
+            record_upstream_error('gemini', type(e).__name__)
             print(f"Gemini API error for duration: {str(e)}")
         
         # Fallback data
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Request-scoped database sessions for the Flask API.
+
+Each request gets at most one session, checked out from the pool on first
+use by get_request_db() and returned when the request ends, whether the
+handler returned or raised. Handlers that write ask for
+get_request_db(write=True) and use the helpers' commit=False mode, so all
+of a request's writes land in one transaction that is committed once,
+before the response is sent. Error responses (status >= 400) and
+exceptions roll the transaction back instead.
+
+Work that must only happen once the writes are durable (updating an
+in-memory copy of a row, say) is registered with after_request_commit()
+and is dropped if the transaction rolls back.
+
+Shared modules that also run outside requests (CLI tools, background
+threads, the body of a streamed response, which runs after the commit)
+check in_request_transaction() before borrowing the request's session.
+"""
+
+from flask import g, has_request_context, jsonify, request
+
+try:
+    from database import get_db_session
+    DATABASE_AVAILABLE = True
+except ImportError:
+    DATABASE_AVAILABLE = False
+
+
+_FINISHED_KEY = 'kisanmitra.db_finished'
+
+
+def get_request_db(write: bool = False):
+    """The current request's session, or None when the database is unavailable"""
+    if write:
+        g.db_writes = True
+    if 'db' not in g:
+        g.db = get_db_session() if DATABASE_AVAILABLE else None
+    return g.db
+
+
+def in_request_transaction() -> bool:
+    """True while a request's transaction can still take writes that it will commit"""
+    # Kept in the environ, not g: a streamed body runs in a fresh app context after the commit
+    return has_request_context() and not request.environ.get(_FINISHED_KEY)
+
+
+def after_request_commit(callback):
+    """Call callback() once the request's transaction has committed; it is dropped if it rolls back"""
+    g.setdefault('db_commit_callbacks', []).append(callback)
+
+
+def _run_commit_callbacks():
+    for callback in g.pop('db_commit_callbacks', []):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in request commit callback: {e}")
+
+
+def _commit_request_db(response):
+    """Commit the request's writes before the response goes out, so a failed commit is reported"""
+    request.environ[_FINISHED_KEY] = True
+    db = g.get('db')
+    if db is None or not g.get('db_writes') or response.status_code >= 400:
+        return response
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error committing request transaction: {e}")
+        response = jsonify({"error": "Internal server error"})
+        response.status_code = 500
+        return response
+    _run_commit_callbacks()
+    return response
+
+
+def _close_request_db(exception=None):
+    """Return the session to the pool; closing rolls back anything left uncommitted"""
+    db = g.pop('db', None)
+    g.pop('db_writes', None)
+    g.pop('db_commit_callbacks', None)
+    if db is None:
+        return
+    try:
+        db.close()
+    except Exception as e:
+        print(f"Error closing request session: {e}")
+
+
+def init_request_session(app):
+    """Register the commit and cleanup hooks on a Flask app"""
+    app.after_request(_commit_request_db)
+    app.teardown_request(_close_request_db)
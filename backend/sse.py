@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Server-Sent Events helpers for the streaming chat endpoints.
+
+A streamed chat reply is a sequence of events:
+    event: token   data: {"text": "..."}          one per provider chunk
+    event: done    data: {"response": "...", "timestamp": "..."}
+    event: error   data: {"error": "..."}
+Clients opt in with {"stream": true} in the request body or an
+"Accept: text/event-stream" header; everyone else gets the JSON response.
+"""
+
+import json
+from typing import Any, Dict, Iterator, Optional
+
+from flask import Response, stream_with_context
+
+
+def wants_event_stream(flask_request, data: Optional[Dict[str, Any]]) -> bool:
+    """Whether the client asked for a streamed (SSE) response"""
+    if data and data.get('stream') is True:
+        return True
+    return 'text/event-stream' in flask_request.headers.get('Accept', '')
+
+
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Encode one SSE event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events: Iterator[str]) -> Response:
+    """Stream already formatted events to the client without proxy buffering"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Stop nginx-style proxies from holding back tokens
+        }
+    )
+
+
+def close_upstream(stream: Any):
+    """
+    Stop an upstream provider stream, e.g. after the client disconnected.
+    OpenAI streams expose close(); Gemini streaming responses wrap a gRPC
+    call that is cancelled through its iterator.
+    """
+    for target in (stream, getattr(stream, '_iterator', None)):
+        if target is None:
+            continue
+        for method_name in ('close', 'cancel'):
+            method = getattr(target, method_name, None)
+            if callable(method):
+                try:
+                    method()
+                    return
+                except Exception as e:
+                    print(f"Could not close upstream stream: {e}")
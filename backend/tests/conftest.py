@@ -0,0 +1,27 @@
+"""Shared pytest setup: the backend modules are imported top-level, as the servers do"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """An empty SQLite database file, set up the way models sets up its own SQLite engine"""
+    from sqlalchemy import create_engine, event
+
+    from database.models import _use_explicit_sqlite_transactions
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'kisanmitra.db'}")
+    _use_explicit_sqlite_transactions(engine)
+
+    @event.listens_for(engine, "connect")
+    def _enforce_foreign_keys(dbapi_connection, connection_record):
+        # PostgreSQL always checks foreign keys; SQLite only when asked
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+    yield engine
+    engine.dispose()
@@ -0,0 +1,149 @@
+"""State machine of the upstream circuit breaker and the token bucket"""
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, TokenBucket
+
+
+class FakeClock:
+    """Stands in for the time module inside circuit_breaker"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, 'time', fake)
+    return fake
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = dict(failure_threshold=3, recovery_timeout=10.0, max_recovery_timeout=300.0,
+                   jitter=0.0, state_dir=None)
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+
+
+def test_stays_closed_below_threshold_and_success_resets_failures(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_opens_after_threshold_and_rejects_until_cooldown(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+    clock.advance(9.9)
+    assert not breaker.allow_request()
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.advance(10)
+
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_and_resets_backoff(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow_request()
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.stats()["consecutive_opens"] == 0
+    assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+
+def test_failed_probe_reopens_with_doubled_cooldown(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.advance(10)
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    clock.advance(19.9)
+    assert not breaker.allow_request()
+    clock.advance(0.1)
+    assert breaker.allow_request()
+
+
+def test_cooldown_is_capped(clock):
+    breaker = make_breaker(recovery_timeout=10.0, max_recovery_timeout=25.0)
+    trip(breaker)
+    for _ in range(3):
+        clock.advance(breaker.max_recovery_timeout)
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.stats()["open_for_seconds"] == 25.0
+
+
+@pytest.mark.parametrize("retry_after, expected", [(60.0, 60.0), (1.0, 10.0), (1000.0, 300.0)])
+def test_retry_after_overrides_cooldown_within_bounds(clock, retry_after, expected):
+    breaker = make_breaker(failure_threshold=1)
+    assert breaker.allow_request()
+    breaker.record_failure(retry_after=retry_after)
+    assert breaker.stats()["open_for_seconds"] == expected
+
+
+def test_state_is_shared_through_state_dir(clock, tmp_path):
+    first = make_breaker(state_dir=str(tmp_path))
+    second = make_breaker(state_dir=str(tmp_path))
+    trip(first)
+
+    assert not second.allow_request()
+    assert second.state == OPEN
+
+    clock.advance(10)
+    assert second.allow_request()
+    second.record_success()
+    clock.advance(1)
+    assert first.allow_request()
+    assert first.state == CLOSED
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    bucket = TokenBucket(rate_per_second=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    clock.advance(0.5)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.stats()["rejected"] == 2
+
+
+def test_token_bucket_with_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(rate_per_second=0, burst=1)
+    assert all(bucket.try_acquire() for _ in range(100))
@@ -0,0 +1,148 @@
+"""Migration upgrade/downgrade round trips on SQLite, and the schema checks"""
+
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import inspect, text
+
+from database import migrations
+from database.migrations import MIGRATIONS, applied_versions, check_indexes, check_schema_drift, downgrade, upgrade
+
+LATEST = MIGRATIONS[-1].version
+
+
+def schema(engine) -> dict:
+    """table -> (columns, indexes) as the live database reports them"""
+    inspector = inspect(engine)
+    return {
+        table: (sorted(column['name'] for column in inspector.get_columns(table)),
+                sorted((index['name'], tuple(index['column_names'])) for index in inspector.get_indexes(table)))
+        for table in inspector.get_table_names() if table != 'schema_migrations'
+    }
+
+
+def columns(engine, table: str) -> set:
+    return {column['name'] for column in inspect(engine).get_columns(table)}
+
+
+def test_versions_are_unique_and_ascending():
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_upgrade_to_latest_on_an_empty_database(sqlite_engine):
+    assert upgrade(sqlite_engine) == len(MIGRATIONS)
+
+    assert applied_versions(sqlite_engine) == [migration.version for migration in MIGRATIONS]
+    assert check_indexes(sqlite_engine) == []
+    assert upgrade(sqlite_engine) == 0
+
+
+def test_upgrade_stops_at_target(sqlite_engine):
+    assert upgrade(sqlite_engine, target=3) == 3
+    assert applied_versions(sqlite_engine) == [1, 2, 3]
+    assert [migration.version for migration in migrations.pending_migrations(sqlite_engine)] == list(range(4, LATEST + 1))
+
+
+def test_each_migration_reverts_and_reapplies_cleanly(sqlite_engine):
+    upgrade(sqlite_engine)
+
+    for version in range(LATEST, 1, -1):
+        expected = schema(sqlite_engine)
+        assert downgrade(sqlite_engine) == 1
+        assert applied_versions(sqlite_engine)[-1] == version - 1
+        assert upgrade(sqlite_engine, target=version) == 1
+        assert schema(sqlite_engine) == expected
+        downgrade(sqlite_engine)
+
+    assert applied_versions(sqlite_engine) == [1]
+
+
+def test_full_round_trip_restores_the_schema(sqlite_engine):
+    upgrade(sqlite_engine)
+    expected = schema(sqlite_engine)
+
+    assert downgrade(sqlite_engine, target=1) == LATEST - 1
+    downgraded = schema(sqlite_engine)
+    for table in ('chat_conversations', 'market_price_daily', 'refresh_watermarks', 'user_activity_daily'):
+        assert table not in downgraded
+    assert 'top_k' not in columns(sqlite_engine, 'diagnoses')
+    assert {'quantity_kg', 'posted_at'}.isdisjoint(columns(sqlite_engine, 'listings'))
+    assert 'ix_diagnoses_user_id_created_at' not in dict(downgraded['diagnoses'][1])
+
+    assert upgrade(sqlite_engine) == LATEST - 1
+    assert schema(sqlite_engine) == expected
+    assert check_indexes(sqlite_engine) == []
+
+
+def test_rows_survive_a_round_trip_and_are_backfilled(sqlite_engine):
+    upgrade(sqlite_engine)
+    downgrade(sqlite_engine, target=3)
+    created = datetime(2024, 6, 10, 8, 0)
+    with sqlite_engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO users (id, name, phone, location, state, joined_date, created_at, updated_at) "
+            "VALUES (1, 'Ramesh', '98765 43210', 'Nashik', 'Maharashtra', :at, :at, :at)"
+        ), {"at": created})
+        conn.execute(text(
+            "INSERT INTO listings (id, user_id, crop, quantity, price_per_kg, market, transport, views, inquiries, "
+            "total_price, status, posted_date, created_at, updated_at) "
+            "VALUES (1, 1, 'Onion', '2 quintal', 18.5, 'Lasalgaon', 'Truck', 0, 0, 3700, 'active', '3 days ago', "
+            ":at, :at)"
+        ), {"at": created})
+
+    assert upgrade(sqlite_engine) == LATEST - 3
+
+    with sqlite_engine.connect() as conn:
+        listing = conn.execute(text("SELECT quantity_kg, posted_at FROM listings WHERE id = 1")).one()
+        phone = conn.execute(text("SELECT phone FROM users WHERE id = 1")).scalar_one()
+    assert Decimal(str(listing.quantity_kg)) == Decimal('200')
+    assert str(listing.posted_at).startswith('2024-06-07')
+    assert phone == '+919876543210'
+
+
+def test_baseline_cannot_be_downgraded(sqlite_engine):
+    upgrade(sqlite_engine, target=1)
+
+    with pytest.raises(RuntimeError):
+        downgrade(sqlite_engine, target=0)
+    assert applied_versions(sqlite_engine) == [1]
+    assert 'users' in inspect(sqlite_engine).get_table_names()
+
+
+def test_downgrade_refuses_versions_this_code_does_not_know(sqlite_engine):
+    upgrade(sqlite_engine)
+    with sqlite_engine.begin() as conn:
+        conn.execute(migrations.schema_migrations.insert().values(
+            version=LATEST + 1, name='from_the_future', applied_at=datetime.utcnow()
+        ))
+
+    with pytest.raises(RuntimeError):
+        downgrade(sqlite_engine)
+    assert applied_versions(sqlite_engine)[-1] == LATEST + 1
+
+
+def test_check_indexes_reports_a_missing_index(sqlite_engine):
+    upgrade(sqlite_engine)
+    with sqlite_engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_diagnoses_user_id_created_at"))
+
+    assert check_indexes(sqlite_engine) == [
+        "index ix_diagnoses_user_id_created_at on diagnoses (user_id, created_at, id) is missing"
+    ]
+
+
+def test_models_match_the_drizzle_schema():
+    assert check_schema_drift() == []
+
+
+def test_schema_drift_is_reported(tmp_path):
+    with open(migrations.SCHEMA_TS_PATH, encoding='utf-8') as f:
+        source = f.read()
+    edited = tmp_path / 'schema.ts'
+    edited.write_text(source.replace("bytea('top_k')", "bytea('top_k_scores')"), encoding='utf-8')
+
+    problems = check_schema_drift(str(edited))
+    assert "diagnoses.top_k is in the models but not in schema.ts" in problems
+    assert "diagnoses.top_k_scores is in schema.ts but not in the models" in problems
@@ -0,0 +1,206 @@
+"""Write-behind buffer: batched writes, the spool file and its replay"""
+
+import glob
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from database import write_buffer
+from database.models import Base, Diagnosis, User, UserActivity
+from database.write_buffer import ACTIVITY, DIAGNOSIS, WriteBehindBuffer, _decode_row, _encode_row
+
+
+class Database:
+    """Hands out sessions on the test engine, or None while it is 'down'"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.available = True
+
+    def get_db_session(self):
+        return self.sessions() if self.available else None
+
+    def count(self, model) -> int:
+        with self.sessions() as db:
+            return db.execute(select(func.count()).select_from(model)).scalar_one()
+
+
+@pytest.fixture
+def database(sqlite_engine, monkeypatch):
+    Base.metadata.create_all(bind=sqlite_engine)
+    db = Database(sqlite_engine)
+    with db.sessions() as session:
+        session.add(User(id=1, name='Ramesh', phone='+919876543210', location='Nashik', state='Maharashtra'))
+        session.commit()
+    monkeypatch.setattr(write_buffer, 'get_db_session', db.get_db_session)
+    return db
+
+
+@pytest.fixture
+def buffer(tmp_path, monkeypatch):
+    buffer = WriteBehindBuffer(flush_interval_ms=1000, flush_max_rows=2, max_pending=10,
+                               enqueue_timeout_ms=0, spool_dir=str(tmp_path / 'spool'))
+    # Tests drive flush() and _replay_spool() themselves instead of the background thread
+    monkeypatch.setattr(buffer, '_ensure_worker', lambda: None)
+    buffer._pid = os.getpid()
+    return buffer
+
+
+def diagnosis_row(user_id=1, **overrides):
+    row = {"user_id": user_id, "crop_name": "Tomato", "diagnosis": "Early blight", "confidence": 87,
+           "treatment": "Copper fungicide", "date": datetime(2024, 6, 1, 9, 30), "top_k": b'\x00\x01\xff'}
+    row.update(overrides)
+    return row
+
+
+def spool_files(buffer):
+    return glob.glob(os.path.join(buffer.spool_dir, 'spool-*.jsonl'))
+
+
+def spooled_rows(buffer):
+    rows = []
+    for path in spool_files(buffer):
+        with open(path, encoding='utf-8') as f:
+            rows.extend(_decode_row(line) for line in f if line.strip())
+    return rows
+
+
+def test_spool_encoding_round_trips_dates_and_top_k():
+    row = diagnosis_row()
+    kind, decoded = _decode_row(_encode_row(DIAGNOSIS, dict(row)))
+    assert kind == DIAGNOSIS
+    assert decoded == row
+
+    activity = {"user_id": 1, "action": "login", "data": {"via": "otp"}, "timestamp": datetime(2024, 6, 1)}
+    assert _decode_row(_encode_row(ACTIVITY, dict(activity))) == (ACTIVITY, activity)
+
+
+def test_invalid_rows_are_rejected_before_queueing(buffer):
+    with pytest.raises(ValueError):
+        buffer.add_diagnosis(0, 'Tomato', 'Early blight', 87, 'Copper fungicide')
+    with pytest.raises(ValueError):
+        buffer.add_activity(1, '  ')
+    assert buffer.stats()['enqueued'] == 0
+
+
+def test_flush_writes_diagnoses_with_their_activity_rows(buffer, database):
+    buffer.add_diagnosis(**diagnosis_row())
+    buffer.add_activity(1, 'market_search', {"crop": "Onion"})
+    buffer.flush()
+
+    assert database.count(Diagnosis) == 1
+    assert database.count(UserActivity) == 2
+    stats = buffer.stats()
+    assert stats['written'] == 2
+    assert stats['flushes'] == 1
+    assert stats['queue_depth'] == 0
+    assert spool_files(buffer) == []
+
+
+def test_rows_are_spooled_while_the_database_is_down(buffer, database):
+    database.available = False
+    buffer.add_diagnosis(**diagnosis_row())
+    buffer.add_activity(1, 'login')
+    buffer.flush()
+
+    assert buffer.stats()['spooled'] == 2
+    assert [kind for kind, _ in spooled_rows(buffer)] == [DIAGNOSIS, ACTIVITY]
+    assert spooled_rows(buffer)[0][1] == diagnosis_row()
+    database.available = True
+    assert database.count(Diagnosis) == 0
+
+
+def test_failed_flush_is_spooled(buffer, database, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(write_buffer, 'bulk_create_diagnoses', broken)
+    buffer.add_diagnosis(**diagnosis_row())
+    buffer.flush()
+
+    stats = buffer.stats()
+    assert stats['failed_flushes'] == 1
+    assert stats['spooled'] == 1
+    assert len(spooled_rows(buffer)) == 1
+
+
+def test_spool_is_replayed_after_the_database_comes_back(buffer, database):
+    database.available = False
+    for confidence in (60, 70, 80):
+        buffer.add_diagnosis(**diagnosis_row(confidence=confidence))
+    buffer.flush()
+    database.available = True
+
+    buffer._replay_spool()
+
+    assert spool_files(buffer) == []
+    assert os.listdir(buffer.spool_dir) == []
+    assert buffer.stats()['replayed'] == 3
+    with database.sessions() as db:
+        rows = db.execute(select(Diagnosis).order_by(Diagnosis.confidence)).scalars().all()
+        assert [row.confidence for row in rows] == [60, 70, 80]
+        assert rows[0].top_k == b'\x00\x01\xff'
+        assert rows[0].date == datetime(2024, 6, 1, 9, 30)
+
+
+def test_replay_skips_files_other_workers_have_claimed(buffer, database):
+    os.makedirs(buffer.spool_dir)
+    claimed = os.path.join(buffer.spool_dir, 'spool-1.jsonl.replay-2')
+    with open(claimed, 'w', encoding='utf-8') as f:
+        f.write(_encode_row(DIAGNOSIS, diagnosis_row()))
+
+    buffer._replay_spool()
+
+    assert os.path.exists(claimed)
+    assert database.count(Diagnosis) == 0
+
+
+def test_chunk_that_fails_during_replay_is_spooled_again(buffer, database):
+    database.available = False
+    buffer.add_diagnosis(**diagnosis_row())
+    buffer.flush()
+
+    buffer._replay_spool()
+
+    # Still down: the row went back into a fresh spool file rather than being lost
+    assert buffer.stats()['replayed'] == 0
+    assert len(spooled_rows(buffer)) == 1
+
+
+def test_rows_for_unknown_users_are_dropped_and_the_rest_written(buffer, database):
+    buffer.add_diagnosis(**diagnosis_row(confidence=55))
+    buffer.add_diagnosis(**diagnosis_row(user_id=999))
+    buffer.flush()
+
+    stats = buffer.stats()
+    assert stats['rejected'] == 1
+    assert stats['written'] == 1
+    assert stats['spooled'] == 0
+    assert database.count(Diagnosis) == 1
+
+
+def test_full_queue_spools_instead_of_dropping(tmp_path, monkeypatch):
+    buffer = WriteBehindBuffer(max_pending=1, enqueue_timeout_ms=0, spool_dir=str(tmp_path / 'spool'))
+    monkeypatch.setattr(buffer, '_ensure_worker', lambda: None)
+
+    buffer.add_activity(1, 'login')
+    buffer.add_activity(1, 'logout')
+
+    stats = buffer.stats()
+    assert stats['queue_depth'] == 1
+    assert stats['backpressure_waits'] == 1
+    assert stats['spooled'] == 1
+    assert [row['action'] for _, row in spooled_rows(buffer)] == ['logout']
+
+
+def test_without_a_spool_dir_rows_are_dropped(buffer, database):
+    buffer.spool_dir = None
+    database.available = False
+    buffer.add_activity(1, 'login')
+    buffer.flush()
+
+    assert buffer.stats()['spooled'] == 0
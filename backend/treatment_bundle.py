@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+Cached treatment bundles (fertilizers, treatment steps, duration and success
+rate) for a diagnosed disease.
+
+A bundle is produced by one structured Gemini prompt and cached per disease
+and prompt version, first in process memory and then in the treatment_cache
+table, so result pages are served without any LLM round trip once a disease
+has been seen. Bumping TREATMENT_PROMPT_VERSION invalidates every cached
+bundle. The cache can be warmed offline for every label the classifier can
+emit:
+
+    cd backend && python treatment_bundle.py warm
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from label_registry import normalize_label
+from metrics import record_upstream_error, upstream_request_seconds
+from request_session import get_request_db, in_request_transaction
+
+try:
+    from database import get_db_session, get_cached_treatment, upsert_cached_treatment
+    DATABASE_AVAILABLE = True
+except ImportError:
+    DATABASE_AVAILABLE = False
+
+TREATMENT_PROMPT_VERSION = 1
+TREATMENT_CACHE_TTL_SECONDS = int(os.environ.get('TREATMENT_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+TREATMENT_MEMORY_CACHE_SIZE = int(os.environ.get('TREATMENT_MEMORY_CACHE_SIZE', '512'))
+
+FALLBACK_FERTILIZERS = [
+    {"name": "Copper Fungicide Spray", "price": "₹450", "availability": "In Stock"},
+    {"name": "Organic Disease Control", "price": "₹320", "availability": "In Stock"},
+    {"name": "Plant Immunity Booster", "price": "₹280", "availability": "Out of Stock"}
+]
+
+FALLBACK_STEPS = [
+    {"step": 1, "title": "Remove Affected Parts", "description": "Carefully remove all affected leaves and stems. Dispose away from healthy plants."},
+    {"step": 2, "title": "Apply Treatment", "description": "Apply appropriate fungicide or treatment as recommended. Follow label instructions."},
+    {"step": 3, "title": "Improve Conditions", "description": "Improve air circulation and avoid overhead watering to prevent reinfection."},
+    {"step": 4, "title": "Monitor Progress", "description": "Check daily for new symptoms. Recovery should begin within 5-7 days."},
+    {"step": 5, "title": "Follow-up Care", "description": "Continue monitoring and apply follow-up treatments as needed."}
+]
+
+FALLBACK_DURATION = "14-21 days"
+FALLBACK_SUCCESS_RATE = 87
+
+
+def normalize_disease_key(disease_name: str) -> str:
+    """Cache key for a disease name, so 'Tomato_with_Late_Blight' and 'Tomato With Late Blight' match"""
+    return normalize_label(disease_name)
+
+
+def fallback_bundle() -> Dict[str, Any]:
+    """Generic bundle used when Gemini is unavailable or returns unusable output"""
+    return {
+        "fertilizers": [dict(item) for item in FALLBACK_FERTILIZERS],
+        "steps": [dict(item) for item in FALLBACK_STEPS],
+        "duration": FALLBACK_DURATION,
+        "success_rate": FALLBACK_SUCCESS_RATE
+    }
+
+
+def build_bundle_prompt(disease_name: str) -> str:
+    """One structured prompt covering everything the result page needs"""
+    return f"""
+        As an agricultural expert, provide a complete treatment plan for {disease_name} in plants.
+
+        Respond with only a JSON object in exactly this format:
+        {{
+            "fertilizers": [
+                {{
+                    "name": "Fertilizer name",
+                    "price": "₹XXX",
+                    "availability": "In Stock" or "Out of Stock"
+                }}
+            ],
+            "steps": [
+                {{
+                    "step": 1,
+                    "title": "Step title",
+                    "description": "Detailed description of what to do"
+                }}
+            ],
+            "duration": "X-Y days",
+            "success_rate": XX
+        }}
+
+        Provide exactly 3 fertilizers that are effective and commonly available in India,
+        exactly 5 practical, actionable treatment steps that farmers can easily follow,
+        the expected recovery time range as duration, and a realistic success rate
+        as a percentage (number only) for treating {disease_name}.
+        """
+
+
+def parse_bundle_response(response_text: str) -> Optional[Dict[str, Any]]:
+    """Extract and validate the bundle JSON from a model response"""
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}') + 1
+    if start_idx == -1 or end_idx <= start_idx:
+        return None
+
+    try:
+        data = json.loads(response_text[start_idx:end_idx])
+    except ValueError:
+        return None
+
+    fertilizers = data.get('fertilizers')
+    steps = data.get('steps')
+    if not isinstance(fertilizers, list) or not fertilizers or not isinstance(steps, list) or not steps:
+        return None
+
+    try:
+        success_rate = int(float(data.get('success_rate', FALLBACK_SUCCESS_RATE)))
+    except (TypeError, ValueError):
+        success_rate = FALLBACK_SUCCESS_RATE
+
+    return {
+        "fertilizers": [item for item in fertilizers if isinstance(item, dict)],
+        "steps": [item for item in steps if isinstance(item, dict)],
+        "duration": str(data.get('duration') or FALLBACK_DURATION),
+        "success_rate": max(0, min(100, success_rate))
+    }
+
+
+def generate_treatment_bundle(disease_name: str, gemini_model) -> Optional[Dict[str, Any]]:
+    """Ask Gemini for a treatment bundle; None if it is unavailable or the output is unusable"""
+    if not gemini_model:
+        return None
+    try:
+        with upstream_request_seconds.time(upstream='gemini'):
+            response = gemini_model.generate_content(build_bundle_prompt(disease_name))
+        return parse_bundle_response(response.text.strip())
+    except Exception as e:
+        record_upstream_error('gemini', type(e).__name__)
+        print(f"Gemini API error for treatment bundle: {str(e)}")
+        return None
+
+
+class TreatmentBundleCache:
+    """Per-disease bundle cache: in-process LRU in front of the treatment_cache table"""
+
+    def __init__(self, prompt_version: int = TREATMENT_PROMPT_VERSION,
+                 ttl_seconds: int = TREATMENT_CACHE_TTL_SECONDS,
+                 memory_size: int = TREATMENT_MEMORY_CACHE_SIZE):
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # disease_key -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, disease_key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (payload, source) where source is 'memory' or 'database', or (None, None)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(disease_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(disease_key)
+                    return entry[1], 'memory'
+                del self._memory[disease_key]
+
+        entry = self._read_database(disease_key)
+        if entry is None:
+            return None, None
+        payload, expires_at = entry
+        # Keep it in memory only for the row's remaining lifetime, not a fresh TTL
+        self._remember(disease_key, payload, expires_at)
+        return payload, 'database'
+
+    def put(self, disease_key: str, payload: Dict[str, Any]):
+        """Store a freshly generated bundle in memory and in the database"""
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        self._remember(disease_key, payload, expires_at)
+        if not DATABASE_AVAILABLE:
+            return
+
+        # Inside a request the row joins the request's transaction (see request_session.py)
+        in_request = in_request_transaction()
+        db = get_request_db(write=True) if in_request else get_db_session()
+        if not db:
+            return
+        try:
+            upsert_cached_treatment(db, disease_key, self.prompt_version, payload, expires_at, commit=not in_request)
+        except Exception as e:
+            print(f"⚠️ Could not persist treatment bundle for '{disease_key}': {e}")
+        finally:
+            if not in_request:
+                db.close()
+
+    def _remember(self, disease_key: str, payload: Dict[str, Any], expires_at: datetime):
+        """Keep a bundle in memory until expires_at (UTC, as stored in treatment_cache)"""
+        remaining = (expires_at - datetime.utcnow()).total_seconds()
+        with self._lock:
+            self._memory[disease_key] = (time.time() + remaining, payload)
+            self._memory.move_to_end(disease_key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _read_database(self, disease_key: str) -> Optional[Tuple[Dict[str, Any], datetime]]:
+        if not DATABASE_AVAILABLE:
+            return None
+        if in_request_transaction():
+            return get_cached_treatment(get_request_db(), disease_key, self.prompt_version)
+        db = get_db_session()
+        if not db:
+            return None
+        try:
+            return get_cached_treatment(db, disease_key, self.prompt_version)
+        finally:
+            db.close()
+
+
+treatment_cache = TreatmentBundleCache()
+
+
+def get_treatment_bundle(disease_name: str, gemini_model) -> Tuple[Dict[str, Any], str]:
+    """
+    Get the treatment bundle for a disease
+    Returns (bundle, source) with source one of 'memory', 'database', 'generated' or 'fallback'
+    """
+    disease_key = normalize_disease_key(disease_name)
+    payload, source = treatment_cache.get(disease_key)
+    if payload is not None:
+        return payload, source
+
+    payload = generate_treatment_bundle(disease_name, gemini_model)
+    if payload is None:
+        # Fallbacks are not cached, so the next request tries Gemini again
+        return fallback_bundle(), 'fallback'
+
+    treatment_cache.put(disease_key, payload)
+    return payload, 'generated'
+
+
+def warm_treatment_cache(disease_names: Iterable[str], gemini_model, force: bool = False,
+                         delay_seconds: float = 0.0) -> Dict[str, int]:
+    """Generate and store bundles for every disease name that is not cached yet"""
+    counts = {"cached": 0, "generated": 0, "failed": 0}
+    for disease_name in disease_names:
+        disease_key = normalize_disease_key(disease_name)
+        if not force and treatment_cache.get(disease_key)[0] is not None:
+            counts["cached"] += 1
+            continue
+
+        payload = generate_treatment_bundle(disease_name, gemini_model)
+        if payload is None:
+            counts["failed"] += 1
+            print(f"❌ No treatment bundle for {disease_name}")
+        else:
+            treatment_cache.put(disease_key, payload)
+            counts["generated"] += 1
+            print(f"✅ Cached treatment bundle for {disease_name}")
+
+        if delay_seconds:
+            time.sleep(delay_seconds)
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    from inference import load_model_labels
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Treatment bundle cache utility')
+    parser.add_argument('command', choices=['warm'], help='Command to run')
+    parser.add_argument('--force', action='store_true', help='Regenerate bundles that are already cached')
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds to wait between Gemini calls')
+    args = parser.parse_args()
+
+    gemini_api_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_api_key:
+        print("❌ GEMINI_API_KEY is required to warm the treatment cache")
+        sys.exit(1)
+    genai.configure(api_key=gemini_api_key)
+
+    counts = warm_treatment_cache(load_model_labels(), genai.GenerativeModel('gemini-pro'),
+                                  force=args.force, delay_seconds=args.delay)
+    print(f"🎉 Treatment cache warm-up finished: {counts}")
+    sys.exit(0 if counts["failed"] == 0 else 1)
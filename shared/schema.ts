@@ -1,7 +1,14 @@
 // KisanMitra Database Schema
-import { pgTable, serial, text, integer, decimal, timestamp, boolean, varchar, jsonb } from 'drizzle-orm/pg-core';
+import { pgTable, customType, serial, text, integer, decimal, timestamp, date, boolean, varchar, json, jsonb, index, unique, primaryKey } from 'drizzle-orm/pg-core';
 import { relations } from 'drizzle-orm';
 
+// Raw binary column; diagnoses.top_k holds packed (label id, probability) pairs
+const bytea = customType<{ data: Buffer }>({
+  dataType() {
+    return 'bytea';
+  },
+});
+
 // Users table
 export const users = pgTable('users', {
   id: serial('id').primaryKey(),
@@ -29,12 +36,22 @@ export const listings = pgTable('listings', {
   totalPrice: decimal('total_price', { precision: 12, scale: 2 }).notNull(),
   status: varchar('status', { length: 20 }).default('active').notNull(), // active, sold, expired
   postedDate: varchar('posted_date', { length: 50 }).notNull(),
+  quantityKg: decimal('quantity_kg', { precision: 12, scale: 2 }), // parsed from quantity
+  postedAt: timestamp('posted_at').defaultNow().notNull(), // parsed from posted_date
   soldDate: timestamp('sold_date'),
   soldPrice: decimal('sold_price', { precision: 12, scale: 2 }),
   buyer: varchar('buyer', { length: 255 }),
   createdAt: timestamp('created_at').defaultNow().notNull(),
   updatedAt: timestamp('updated_at').defaultNow().notNull(),
-});
+}, (table) => [
+  index('ix_listings_status_crop_market').on(table.status, table.crop, table.market),
+  index('ix_listings_status_price_id').on(table.status, table.pricePerKg, table.id),
+  index('ix_listings_status_posted_at_id').on(table.status, table.postedAt, table.id),
+  index('ix_listings_status_views_id').on(table.status, table.views, table.id),
+  index('ix_listings_updated_at').on(table.updatedAt),
+  index('ix_listings_crop_market_posted_at').on(table.crop, table.market, table.postedAt),
+  index('ix_listings_crop_market_sold_date').on(table.crop, table.market, table.soldDate),
+]);
 
 // Diagnoses table
 export const diagnoses = pgTable('diagnoses', {
@@ -46,7 +63,10 @@ export const diagnoses = pgTable('diagnoses', {
   treatment: text('treatment').notNull(),
   date: timestamp('date').notNull(),
   createdAt: timestamp('created_at').defaultNow().notNull(),
-});
+  topK: bytea('top_k'),
+}, (table) => [
+  index('ix_diagnoses_user_id_created_at').on(table.userId, table.createdAt, table.id),
+]);
 
 // Advisory records table
 export const advisoryRecords = pgTable('advisory_records', {
@@ -59,13 +79,76 @@ export const advisoryRecords = pgTable('advisory_records', {
   createdAt: timestamp('created_at').defaultNow().notNull(),
 });
 
-// User activities table
+// User activities table (range-partitioned by month on timestamp in PostgreSQL)
 export const userActivities = pgTable('user_activities', {
   id: serial('id').primaryKey(),
   userId: integer('user_id').references(() => users.id).notNull(),
   action: varchar('action', { length: 100 }).notNull(),
   data: jsonb('data'),
   timestamp: timestamp('timestamp').defaultNow().notNull(),
+}, (table) => [
+  index('ix_user_activities_user_id_timestamp').on(table.userId, table.timestamp),
+  index('ix_user_activities_timestamp_brin').using('brin', table.timestamp),
+]);
+
+// Daily activity rollups that replace raw user activities past the retention window
+export const userActivityDaily = pgTable('user_activity_daily', {
+  userId: integer('user_id').references(() => users.id).notNull(),
+  day: date('day').notNull(),
+  action: varchar('action', { length: 100 }).notNull(),
+  eventCount: integer('event_count').notNull(),
+  firstAt: timestamp('first_at').notNull(),
+  lastAt: timestamp('last_at').notNull(),
+}, (table) => [
+  primaryKey({ columns: [table.userId, table.day, table.action] }),
+]);
+
+// Daily price statistics per crop and market (maintained by the backend refresh job)
+export const marketPriceDaily = pgTable('market_price_daily', {
+  crop: varchar('crop', { length: 100 }).notNull(),
+  market: varchar('market', { length: 255 }).notNull(),
+  kind: varchar('kind', { length: 10 }).notNull(), // listed, sold
+  day: date('day').notNull(),
+  listingCount: integer('listing_count').notNull(),
+  minPrice: decimal('min_price', { precision: 10, scale: 2 }).notNull(),
+  maxPrice: decimal('max_price', { precision: 10, scale: 2 }).notNull(),
+  medianPrice: decimal('median_price', { precision: 10, scale: 2 }).notNull(),
+  vwap: decimal('vwap', { precision: 10, scale: 2 }),
+  totalQuantityKg: decimal('total_quantity_kg', { precision: 14, scale: 2 }).notNull(),
+  refreshedAt: timestamp('refreshed_at').defaultNow().notNull(),
+}, (table) => [
+  primaryKey({ columns: [table.crop, table.market, table.kind, table.day] }),
+  index('ix_market_price_daily_day').on(table.day),
+]);
+
+// Progress of the backend's incremental refresh jobs
+export const refreshWatermarks = pgTable('refresh_watermarks', {
+  name: varchar('name', { length: 100 }).primaryKey(),
+  watermark: timestamp('watermark').notNull(),
+  updatedAt: timestamp('updated_at').defaultNow().notNull(),
+});
+
+// Treatment bundle cache table (written by the backend only)
+export const treatmentCache = pgTable('treatment_cache', {
+  id: serial('id').primaryKey(),
+  diseaseKey: varchar('disease_key', { length: 255 }).notNull(),
+  promptVersion: integer('prompt_version').notNull(),
+  payload: json('payload').notNull(),
+  createdAt: timestamp('created_at').defaultNow().notNull(),
+  expiresAt: timestamp('expires_at').notNull(),
+}, (table) => [
+  unique('uq_treatment_cache_disease_version').on(table.diseaseKey, table.promptVersion),
+]);
+
+// Chat memory per user: recent turns plus a running summary (written by the backend only)
+export const chatConversations = pgTable('chat_conversations', {
+  userId: integer('user_id').references(() => users.id).primaryKey(),
+  summary: text('summary'),
+  turns: json('turns').notNull(),
+  revision: integer('revision').notNull(),
+  promptTokens: integer('prompt_tokens').default(0).notNull(),
+  completionTokens: integer('completion_tokens').default(0).notNull(),
+  updatedAt: timestamp('updated_at').defaultNow().notNull(),
 });
 
 // Relations
@@ -114,4 +197,11 @@ export type InsertDiagnosis = typeof diagnoses.$inferInsert;
 export type AdvisoryRecord = typeof advisoryRecords.$inferSelect;
 export type InsertAdvisoryRecord = typeof advisoryRecords.$inferInsert;
 export type UserActivity = typeof userActivities.$inferSelect;
-export type InsertUserActivity = typeof userActivities.$inferInsert;
\ No newline at end of file
+export type InsertUserActivity = typeof userActivities.$inferInsert;
+export type UserActivityDailyRow = typeof userActivityDaily.$inferSelect;
+export type InsertUserActivityDailyRow = typeof userActivityDaily.$inferInsert;
+export type MarketPriceDailyRow = typeof marketPriceDaily.$inferSelect;
+export type RefreshWatermark = typeof refreshWatermarks.$inferSelect;
+export type TreatmentCacheEntry = typeof treatmentCache.$inferSelect;
+export type InsertTreatmentCacheEntry = typeof treatmentCache.$inferInsert;
+export type ChatConversation = typeof chatConversations.$inferSelect;
\ No newline at end of file
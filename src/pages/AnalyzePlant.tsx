@@ -109,14 +109,15 @@ const AnalyzePlant = () => {
           
           const results = {
             disease: disease, // Will show actual disease name
-            confidence: 100, // Always 100% as requested
+            confidence: confidence, // Calibrated top-1 confidence from the backend
             affectedArea: affectedArea,
             stage: isHealthy ? 'Plant is healthy' : 'Needs attention',
             severity: isHealthy ? 'low' : 'medium',
             status: status,
             isHealthy: isHealthy,
             detectedDate: new Date().toISOString(),
-            allPredictions: data.result.all_predictions || []
+            allPredictions: data.result.all_predictions || [],
+            retakePhoto: Boolean(data.result.retake_photo)
           };
           
           localStorage.setItem('diagnosis_results', JSON.stringify(results));
@@ -14,7 +14,8 @@ import {
   Calendar,
   Award,
   ShoppingCart,
-  Loader2
+  Loader2,
+  Camera
 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { Progress } from '@/components/ui/progress';
@@ -29,6 +30,7 @@ interface DiagnosisResult {
   detectedDate: string;
   status?: string;
   isHealthy?: boolean;
+  retakePhoto?: boolean;
 }
 
 interface Fertilizer {
@@ -64,10 +66,8 @@ const DiagnoseResults = () => {
       setResults(parsedResults);
       
       // Load Gemini AI data for the diagnosed disease
-      if (parsedResults.disease && !parsedResults.isHealthy) {
-        loadFertilizerRecommendations(parsedResults.disease);
-        loadTreatmentSteps(parsedResults.disease);
-        loadTreatmentDuration(parsedResults.disease);
+      if (parsedResults.disease && (!parsedResults.isHealthy || parsedResults.retakePhoto)) {
+        loadTreatmentBundle(parsedResults.disease, parsedResults.confidence);
       }
     }
     if (savedImage) {
@@ -75,56 +75,46 @@ const DiagnoseResults = () => {
     }
   }, []);
 
-  const loadFertilizerRecommendations = async (diseaseName: string) => {
-    setLoadingFertilizers(true);
+  const setTreatmentLoading = (loading: boolean) => {
+    setLoadingFertilizers(loading);
+    setLoadingSteps(loading);
+    setLoadingDuration(loading);
+  };
+
+  const loadTreatmentBundle = async (diseaseName: string, confidence?: number) => {
+    setTreatmentLoading(true);
     try {
-      const response = await fetch('/api/treatment/fertilizers', {
+      // One cached call for fertilizers, steps and duration
+      const response = await fetch('/api/treatment/bundle', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ disease: diseaseName }),
+        // Low-confidence results get "retake photo" steps instead of a treatment plan
+        body: JSON.stringify({ disease: diseaseName, confidence }),
       });
       
       if (response.ok) {
         const data = await response.json();
-        if (data.success && data.fertilizers) {
-          setFertilizers(data.fertilizers);
+        if (data.success) {
+          if (data.fertilizers) {
+            setFertilizers(data.fertilizers);
+          }
+          if (data.steps) {
+            setTreatmentSteps(data.steps);
+          }
+          setTreatmentDuration(data.duration || '14-21 days');
+          setSuccessRate(data.success_rate || 87);
         }
       }
     } catch (error) {
-      console.error('Error loading fertilizers:', error);
-      // Use fallback fertilizers
+      console.error('Error loading treatment bundle:', error);
+      // Use fallback fertilizers and steps, keep fallback duration values
       setFertilizers([
         { name: 'Copper Fungicide Spray', price: '₹450', availability: 'In Stock' },
         { name: 'Organic Disease Control', price: '₹320', availability: 'In Stock' },
         { name: 'Plant Immunity Booster', price: '₹280', availability: 'Out of Stock' }
       ]);
-    } finally {
-      setLoadingFertilizers(false);
-    }
-  };
-
-  const loadTreatmentSteps = async (diseaseName: string) => {
-    setLoadingSteps(true);
-    try {
-      const response = await fetch('/api/treatment/steps', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ disease: diseaseName }),
-      });
-      
-      if (response.ok) {
-        const data = await response.json();
-        if (data.success && data.steps) {
-          setTreatmentSteps(data.steps);
-        }
-      }
-    } catch (error) {
-      console.error('Error loading treatment steps:', error);
-      // Use fallback steps
       setTreatmentSteps([
         { step: 1, title: 'Remove Affected Parts', description: 'Carefully remove all affected leaves and stems. Dispose away from healthy plants.' },
         { step: 2, title: 'Apply Treatment', description: 'Apply appropriate fungicide or treatment as recommended. Follow label instructions.' },
@@ -133,33 +123,7 @@ const DiagnoseResults = () => {
         { step: 5, title: 'Follow-up Care', description: 'Continue monitoring and apply follow-up treatments as needed.' }
       ]);
     } finally {
-      setLoadingSteps(false);
-    }
-  };
-
-  const loadTreatmentDuration = async (diseaseName: string) => {
-    setLoadingDuration(true);
-    try {
-      const response = await fetch('/api/treatment/duration', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ disease: diseaseName }),
-      });
-      
-      if (response.ok) {
-        const data = await response.json();
-        if (data.success) {
-          setTreatmentDuration(data.duration || '14-21 days');
-          setSuccessRate(data.success_rate || 87);
-        }
-      }
-    } catch (error) {
-      console.error('Error loading treatment duration:', error);
-      // Keep fallback values
-    } finally {
-      setLoadingDuration(false);
+      setTreatmentLoading(false);
     }
   };
 
@@ -292,9 +256,9 @@ const DiagnoseResults = () => {
               </h2>
               <div className="flex items-center space-x-3 mb-3">
                 <div className="flex items-center space-x-2">
-                  <Progress value={100} className="w-20 h-2" />
+                  <Progress value={results.confidence} className="w-20 h-2" />
                   <span className={`text-sm font-medium ${results.isHealthy ? 'text-green-600' : 'text-red-600'}`}>
-                    100% Confidence
+                    {results.confidence}% Confidence
                   </span>
                 </div>
                 <span className={`px-2 py-1 rounded-full text-xs font-medium ${
@@ -319,35 +283,54 @@ const DiagnoseResults = () => {
           </div>
         </div>
 
-        {/* Treatment Timeline */}
-        <div className="bg-blue-50 rounded-2xl p-6 border border-blue-200">
-          <div className="flex items-center space-x-3 mb-4">
-            {loadingDuration ? (
-              <Loader2 className="w-6 h-6 text-blue-600 animate-spin" />
-            ) : (
-              <Clock className="w-6 h-6 text-blue-600" />
-            )}
-            <h3 className="font-bold text-blue-900">Treatment Timeline</h3>
-            {loadingDuration && <span className="text-xs text-blue-600">Loading AI insights...</span>}
-          </div>
-          
-          <div className="space-y-3">
-            <div className="flex items-center justify-between">
-              <span className="text-blue-800">Recovery Duration:</span>
-              <span className="font-semibold text-blue-900">{treatmentDuration}</span>
+        {/* Retake guidance for a low-confidence result; the steps below explain how */}
+        {results.retakePhoto && (
+          <div className="bg-yellow-50 rounded-2xl p-6 border border-yellow-200">
+            <div className="flex items-center space-x-3 mb-3">
+              <Camera className="w-6 h-6 text-yellow-600" />
+              <h3 className="font-bold text-yellow-900">Please Retake the Photo</h3>
             </div>
-            <div className="flex items-center justify-between">
-              <span className="text-blue-800">Success Rate:</span>
-              <span className="font-semibold text-agri-success">{successRate}% farmers recovered</span>
+            <p className="text-sm text-yellow-800 mb-4">
+              We could not identify the problem confidently from this photo, so no treatment is suggested yet.
+              Follow the steps below and take a new photo.
+            </p>
+            <Button onClick={() => navigate('/diagnose')} className="w-full">
+              Retake Photo
+            </Button>
+          </div>
+        )}
+
+        {/* Treatment Timeline */}
+        {!results.retakePhoto && (
+          <div className="bg-blue-50 rounded-2xl p-6 border border-blue-200">
+            <div className="flex items-center space-x-3 mb-4">
+              {loadingDuration ? (
+                <Loader2 className="w-6 h-6 text-blue-600 animate-spin" />
+              ) : (
+                <Clock className="w-6 h-6 text-blue-600" />
+              )}
+              <h3 className="font-bold text-blue-900">Treatment Timeline</h3>
+              {loadingDuration && <span className="text-xs text-blue-600">Loading AI insights...</span>}
             </div>
-            <div className="flex items-center justify-between">
-              <span className="text-blue-800">Best Treatment Time:</span>
-              <span className="font-semibold text-blue-900">Early morning</span>
+          
+            <div className="space-y-3">
+              <div className="flex items-center justify-between">
+                <span className="text-blue-800">Recovery Duration:</span>
+                <span className="font-semibold text-blue-900">{treatmentDuration}</span>
+              </div>
+              <div className="flex items-center justify-between">
+                <span className="text-blue-800">Success Rate:</span>
+                <span className="font-semibold text-agri-success">{successRate}% farmers recovered</span>
+              </div>
+              <div className="flex items-center justify-between">
+                <span className="text-blue-800">Best Treatment Time:</span>
+                <span className="font-semibold text-blue-900">Early morning</span>
+              </div>
             </div>
-          </div>
           
-          <Progress value={successRate} className="w-full h-2 mt-4" />
-        </div>
+            <Progress value={successRate} className="w-full h-2 mt-4" />
+          </div>
+        )}
 
         {/* Treatment Steps */}
         <div className="bg-gradient-to-r from-green-50 to-blue-50 rounded-3xl p-6 border border-green-200">